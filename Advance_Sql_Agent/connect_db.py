@@ -1,7 +1,5 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.exc import SQLAlchemyError
 
 load_dotenv()
 
@@ -9,10 +7,15 @@ SERVER = os.environ.get("MSSQL_SERVER", r"ASCINLAP61389\SQLEXPRESS")
 DATABASE = os.environ.get("MSSQL_DATABASE", "db")
 DRIVER = os.environ.get("ODBC_DRIVER", "ODBC Driver 17 for SQL Server")
 TIMEOUT = int(os.environ.get("MSSQL_TIMEOUT", "30"))
+# optional full SQLAlchemy URL (e.g. sqlite:///local.db) overriding the MSSQL settings
+DATABASE_URL = os.environ.get("DATABASE_URL")
 
 def build_connection_string() -> str:
     from urllib.parse import quote_plus
 
+    if DATABASE_URL:
+        return DATABASE_URL
+
     odbc_str = (
         f"DRIVER={{{DRIVER}}};"
         f"SERVER={SERVER};"
@@ -24,8 +27,14 @@ def build_connection_string() -> str:
 
 
 def get_engine():
+    # imported here so importing this module (for its settings) does not load sqlalchemy
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import SQLAlchemyError
+
     conn_str = build_connection_string()
     try:
+        if not conn_str.startswith("mssql"):
+            return create_engine(conn_str)
         engine = create_engine(
             conn_str,
             fast_executemany=True,
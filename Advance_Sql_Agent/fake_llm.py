@@ -0,0 +1,268 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Union
+
+# Offline stand-in for genai.Client, so the agent can run (and be benchmarked) with
+# no API key. A `responder(prompt, schema)` returns the value the "model" means to
+# answer with:
+#   - with response_schema in the config the reply is that value as strict JSON,
+#     and it MUST conform to the schema - as with Gemini's constrained decoding, a
+#     non-conforming reply is impossible, so a scripted one raises SchemaViolation;
+#   - without it the reply is chatty text around the JSON, and with probability
+#     `malformed_rate` the JSON itself is broken the way models break it.
+# `latency_ms` ({model: ms}, "*" = any other model) makes tiered models measurable.
+#
+# FakeGeminiServer serves the same replies over Gemini's REST API on 127.0.0.1 and
+# injects latency and HTTP errors, so the real genai client - timeouts, retries and
+# hedging in llm_client included - can be exercised end to end:
+#
+#     with FakeGeminiServer(responder, faults=[503, "hang", None]) as server:
+#         os.environ["GEMINI_BASE_URL"] = server.base_url   # before llm_client builds its client
+#
+#     from fake_llm import FakeGeminiClient
+#     client = FakeGeminiClient(lambda prompt, schema: {"sql": "SELECT 1", "notes": None})
+#     generate_json(prompt, schema, client=client)
+
+
+class SchemaViolation(Exception):
+    pass
+
+
+_TYPES = {
+    "OBJECT": dict,
+    "ARRAY": list,
+    "STRING": str,
+    "BOOLEAN": bool,
+    "INTEGER": int,
+    "NUMBER": (int, float),
+}
+
+
+def schema_errors(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    # the subset of the OpenAPI schema Gemini accepts: type, properties, required, items, nullable, enum
+    if value is None:
+        return [] if schema.get("nullable") else [f"{path}: null is not allowed"]
+    kind = str(schema.get("type", "")).upper()
+    expected = _TYPES.get(kind)
+    if expected is not None:
+        wrong_bool = isinstance(value, bool) and kind in ("INTEGER", "NUMBER")
+        if not isinstance(value, expected) or wrong_bool:
+            return [f"{path}: expected {kind.lower()}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} not in {schema['enum']}"]
+    errors: List[str] = []
+    if kind == "OBJECT":
+        props = schema.get("properties", {})
+        errors += [f"{path}.{k}: required" for k in schema.get("required", []) if k not in value]
+        errors += [f"{path}.{k}: not in schema" for k in value if props and k not in props]
+        for k, sub in props.items():
+            if k in value:
+                errors += schema_errors(value[k], sub, f"{path}.{k}")
+    elif kind == "ARRAY" and "items" in schema:
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema["items"], f"{path}[{i}]")
+    return errors
+
+
+def _malform(text: str, rng: random.Random) -> str:
+    # the usual ways a free-text JSON answer goes wrong
+    breakers = [
+        lambda t: t.replace("\\n", "\n"),                 # raw newlines inside the SQL string
+        lambda t: t.replace('"', "'"),                    # python-style quoting
+        lambda t: t[:max(1, int(len(t) * 0.7))],          # truncated reply
+        lambda t: t.replace(": null", ": None").replace(": true", ": True").replace(": false", ": False") + " // done",
+    ]
+    return rng.choice(breakers)(text)
+
+
+class FakeResponse:
+    def __init__(self, text: str, parsed: Any = None):
+        self.text = text
+        self.parsed = parsed
+
+
+class _Models:
+    def __init__(self, owner: "FakeGeminiClient"):
+        self._owner = owner
+
+    def generate_content(self, model: Optional[str] = None, contents: Any = "", config: Any = None) -> FakeResponse:
+        time.sleep(self._owner.delay(model))
+        return self._owner._reply(model, contents, config)
+
+
+class _AsyncModels:
+    def __init__(self, owner: "FakeGeminiClient"):
+        self._owner = owner
+
+    async def generate_content(self, model: Optional[str] = None, contents: Any = "", config: Any = None) -> FakeResponse:
+        await asyncio.sleep(self._owner.delay(model))
+        return self._owner._reply(model, contents, config)
+
+
+class _Aio:
+    def __init__(self, owner: "FakeGeminiClient"):
+        self.models = _AsyncModels(owner)
+
+
+class FakeGeminiClient:
+    def __init__(self, responder: Callable[[str, Optional[Dict[str, Any]]], Any],
+                 malformed_rate: float = 0.0, seed: int = 0,
+                 latency_ms: Optional[Dict[str, float]] = None):
+        self.responder = responder
+        self.malformed_rate = malformed_rate
+        self.latency_ms = latency_ms or {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # {prompt, model, structured} per call, in order
+        self.calls: List[Dict[str, Any]] = []
+        self.models = _Models(self)
+        self.aio = _Aio(self)
+
+    def delay(self, model: Optional[str]) -> float:
+        return self.latency_ms.get(model or "", self.latency_ms.get("*", 0.0)) / 1000.0
+
+    def _reply(self, model: Optional[str], contents: Any, config: Any) -> FakeResponse:
+        prompt = contents if isinstance(contents, str) else str(contents)
+        if config is not None and not isinstance(config, dict):
+            config = config.model_dump(exclude_none=True)
+        schema = (config or {}).get("response_schema")
+        with self._lock:
+            self.calls.append({"prompt": prompt, "model": model, "structured": schema is not None})
+        value = self.responder(prompt, schema)
+
+        if schema is not None:
+            errors = schema_errors(value, schema)
+            if errors:
+                raise SchemaViolation("; ".join(errors))
+            return FakeResponse(json.dumps(value), parsed=value)
+
+        text = value if isinstance(value, str) else json.dumps(value, indent=2)
+        with self._lock:
+            broken = self._rng.random() < self.malformed_rate
+            if broken:
+                text = _malform(text, self._rng)
+        return FakeResponse(f"Sure, here is the result:\n```json\n{text}\n```\nLet me know if you need more.")
+
+    def close(self) -> None:
+        pass
+
+
+_STATUS = {400: "INVALID_ARGUMENT", 429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 504: "DEADLINE_EXCEEDED"}
+
+# a fault: an HTTP status to fail with, "hang" (no answer within hang_ms), a float/int
+# latency in ms given as a string ("250"), or None for a normal answer
+Fault = Union[int, str, None]
+
+
+class FakeGeminiServer:
+    def __init__(self, responder: Callable[[str, Optional[Dict[str, Any]]], Any],
+                 latency_ms: Union[float, Callable[[], float]] = 0.0,
+                 error_rate: float = 0.0,
+                 error_codes: tuple = (429, 503),
+                 faults: Optional[List[Fault]] = None,
+                 hang_ms: float = 30000.0,
+                 malformed_rate: float = 0.0,
+                 seed: int = 0,
+                 port: int = 0):
+        # faults are consumed one per request, in order; after that latency_ms / error_rate apply
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.faults: List[Fault] = list(faults or [])
+        self.hang_ms = hang_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._client = FakeGeminiClient(responder, malformed_rate=malformed_rate, seed=seed)
+        # {model, structured, status, ms} per request, in arrival order
+        self.requests: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeGeminiServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _next_fault(self) -> Fault:
+        with self._lock:
+            if self.faults:
+                return self.faults.pop(0)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return self._rng.choice(self.error_codes)
+        return None
+
+    def _latency(self) -> float:
+        return self.latency_ms() if callable(self.latency_ms) else self.latency_ms
+
+    def _answer(self, path: str, body: Dict[str, Any]) -> tuple:
+        # (status, payload) for one generateContent request
+        model = path.rsplit("/", 1)[-1].split(":", 1)[0]
+        prompt = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+        gen_config = body.get("generationConfig") or {}
+        schema = gen_config.get("responseSchema")
+        fault = self._next_fault()
+        delay = self._latency()
+        if fault == "hang":
+            delay = self.hang_ms
+        elif isinstance(fault, str):
+            delay = float(fault)
+        time.sleep(delay / 1000.0)
+        status = fault if isinstance(fault, int) else 200
+        with self._lock:
+            self.requests.append({"model": model, "structured": schema is not None, "status": status, "ms": delay})
+        if status != 200:
+            return status, {"error": {"code": status, "message": "injected fault", "status": _STATUS.get(status, "UNKNOWN")}}
+        try:
+            reply = self._client._reply(model, prompt, {"response_schema": schema} if schema else None)
+        except SchemaViolation as e:
+            return 500, {"error": {"code": 500, "message": f"SchemaViolation: {e}", "status": "INTERNAL"}}
+        return 200, {
+            "candidates": [{"content": {"parts": [{"text": reply.text}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "modelVersion": model,
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                status, payload = server._answer(self.path.split("?", 1)[0], body)
+                data = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (timeout / hedge won) - expected
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -35,12 +35,17 @@ def add_history_entry(
     is_complex: bool,
     validated_sql: str | None = None,
     generated_sql: str | None = None,
+    split_decision: Dict[str, Any] | None = None,
 ) -> int:
     entry: Dict[str, Any] = {
         "timestamp_utc": datetime.utcnow().isoformat(),
         "question": question,
         "is_complex": bool(is_complex),
     }
+    if split_decision:
+        # who decided is_complex: the Gemini splitter ("uncertain" locally) or the local classifier;
+        # split_classifier.examples_from_history only learns from the former
+        entry["split_source"] = "llm" if split_decision.get("decision") == "uncertain" else "local"
     if validated_sql:
         entry["validated_sql"] = validated_sql
     if generated_sql:
@@ -0,0 +1,96 @@
+import json
+import re
+from typing import Any, Iterator, List, Optional, Tuple
+
+# Single-pass extraction of JSON values from free-form model output. The scanner
+# tracks string/escape state, so braces inside JSON strings (e.g. a SQL literal
+# '{x}') do not confuse it, and it never rescans text it has already walked past.
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSER = {"{": "}", "[": "]"}
+# a top-level candidate must open like JSON; prose such as "use {placeholder" never does,
+# so its quotes and braces cannot throw the string tracking off for the real answer
+_JSON_START = re.compile(r'\{\s*["}]|\[\s*(?:["{\[\]\-\d]|true|false|null)')
+
+
+def _decode(candidate: str) -> Tuple[bool, Any]:
+    try:
+        return True, json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    # the one slip models make most often
+    repaired = _TRAILING_COMMA.sub(r"\1", candidate)
+    if repaired != candidate:
+        try:
+            return True, json.loads(repaired)
+        except json.JSONDecodeError:
+            pass
+    return False, None
+
+
+def _spans(text: str) -> Iterator[Tuple[int, int, List[Tuple[int, int]]]]:
+    # (start, end, children) of every balanced top-level {...} / [...] in order, where
+    # children are the closed spans one level down - tried when the outer span is not JSON
+    stack: List[str] = []
+    start = child = 0
+    children: List[Tuple[int, int]] = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if not stack:
+            if ch in _CLOSER and _JSON_START.match(text, i):
+                stack.append(_CLOSER[ch])
+                start, children = i, []
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSER:
+            if len(stack) == 1:
+                child = i
+            stack.append(_CLOSER[ch])
+        elif ch in "}]":
+            if ch != stack[-1]:
+                # unbalanced noise: drop this candidate and carry on from here
+                stack.clear()
+                in_string = False
+                continue
+            stack.pop()
+            if len(stack) == 1:
+                children.append((child, i + 1))
+            elif not stack:
+                yield start, i + 1, children
+    if stack:
+        # a candidate that never closed (truncated output) may still hold whole values
+        for s, e in children:
+            yield s, e, []
+
+
+def iter_json(text: str) -> Iterator[Any]:
+    # every decodable JSON object / array in `text`, outermost first, in order of appearance
+    if not text:
+        return
+    for start, end, children in _spans(text):
+        ok, value = _decode(text[start:end])
+        if ok:
+            yield value
+            continue
+        # e.g. `{"note": oops, "answer": {"sql": ...}}` - the wrapper is broken but a child may be whole
+        for s, e in children:
+            ok, value = _decode(text[s:e])
+            if ok:
+                yield value
+
+
+def extract_json(text: str, expect: Optional[type] = None) -> Any:
+    # first JSON value in `text` (of type `expect`, dict or list, when given), else None
+    for value in iter_json(text):
+        if expect is None or isinstance(value, expect):
+            return value
+    return None
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+import llm_retry
+import llm_stages
+
+load_dotenv()
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+# client-wide HTTP timeout for Gemini calls, in milliseconds; each call is further
+# capped per attempt and by the request deadline (llm_retry)
+GEMINI_TIMEOUT_MS = int(os.getenv("GEMINI_TIMEOUT_MS", "60000"))
+# another endpoint for the Gemini REST API, e.g. fake_llm.FakeGeminiServer's base_url
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") or None
+# JSON prompts go out with response_mime_type + response_schema so Gemini returns the
+# typed object directly; "0" = plain text replies with the JSON scraped out (json_extract)
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") != "0"
+
+# One genai.Client per process. The client owns the underlying httpx connection
+# pool, so reusing it keeps TLS sessions / keep-alive connections warm across the
+# generator, checker, splitter and web summary calls.
+_CLIENT: Optional[Any] = None
+_CLIENT_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+# process-wide: replies that came back schema-typed, calls that fell back to plain text
+# (model/endpoint rejected the schema), and replies that still held no usable JSON
+STRUCTURED_STATS: Dict[str, int] = {"structured": 0, "text_fallbacks": 0, "parse_failures": 0}
+
+
+def get_client():
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                import google.genai as genai
+                from google.genai import types
+
+                _CLIENT = genai.Client(
+                    api_key=GOOGLE_API_KEY,
+                    http_options=types.HttpOptions(timeout=GEMINI_TIMEOUT_MS, base_url=GEMINI_BASE_URL),
+                )
+    return _CLIENT
+
+
+def reset_client() -> None:
+    # drop the shared client (e.g. after rotating the API key); the next call builds a new one
+    global _CLIENT
+    with _CLIENT_LOCK:
+        client, _CLIENT = _CLIENT, None
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def _resolve_client(client: Any):
+    # `client` may be a genai.Client or a zero-arg callable returning one (resolved
+    # only on a cache miss, so cached answers never need an API key)
+    if client is None:
+        return get_client()
+    return client() if callable(client) else client
+
+
+def _with_timeout(config: Optional[Dict[str, Any]], timeout_ms: int) -> Dict[str, Any]:
+    return dict(config or {}, http_options={"timeout": timeout_ms})
+
+
+def _call(client: Any, model: Optional[str], prompt: str, config: Optional[Dict[str, Any]],
+          stage: Optional[str], deadline: Optional[float] = None) -> Any:
+    # one real API call with per-attempt timeout, retries and optional hedging (llm_retry);
+    # every HTTP attempt is timed against its stage (llm_stages) when a stage is given
+    models = _resolve_client(client).models
+
+    def attempt(timeout_ms: int) -> Any:
+        return models.generate_content(model=model, contents=prompt, config=_with_timeout(config, timeout_ms))
+
+    return llm_retry.call(attempt, stage, deadline)
+
+
+async def _acall(client: Any, model: Optional[str], prompt: str, config: Optional[Dict[str, Any]],
+                 stage: Optional[str], deadline: Optional[float] = None) -> Any:
+    models = _resolve_client(client).aio.models
+
+    async def attempt(timeout_ms: int) -> Any:
+        return await models.generate_content(model=model, contents=prompt, config=_with_timeout(config, timeout_ms))
+
+    return await llm_retry.acall(attempt, stage, deadline)
+
+
+def generate(prompt: str, model: Optional[str] = None, use_cache: bool = True, client: Any = None,
+             stage: Optional[str] = None, deadline: Optional[float] = None) -> str:
+    # `stage` picks the model (GEMINI_MODEL_<STAGE>) unless `model` is given, and labels the latency;
+    # `deadline` (time.monotonic()) bounds the call and its retries - LLMDeadlineExceeded past it
+    from llm_cache import get_llm_cache
+
+    model = model or llm_stages.stage_model(stage)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(model, prompt)
+        if cached is not None:
+            return cached
+
+    resp = _call(client, model, prompt, None, stage, deadline)
+    text = getattr(resp, "text", str(resp))
+    if cache is not None and text:
+        cache.put(model, prompt, text)
+    return text
+
+
+async def agenerate(prompt: str, model: Optional[str] = None, use_cache: bool = True, client: Any = None,
+                    stage: Optional[str] = None, deadline: Optional[float] = None) -> str:
+    # same as generate(), but awaits the HTTP call on the client's async transport
+    # so an event loop (web_app) keeps serving other requests meanwhile
+    from llm_cache import get_llm_cache
+
+    model = model or llm_stages.stage_model(stage)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(model, prompt)
+        if cached is not None:
+            return cached
+
+    resp = await _acall(client, model, prompt, None, stage, deadline)
+    text = getattr(resp, "text", str(resp))
+    if cache is not None and text:
+        cache.put(model, prompt, text)
+    return text
+
+
+def _count(name: str) -> None:
+    with _STATS_LOCK:
+        STRUCTURED_STATS[name] += 1
+
+
+def structured_stats() -> Dict[str, int]:
+    with _STATS_LOCK:
+        return dict(STRUCTURED_STATS)
+
+
+def _json_config(schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def _structured_cache_model(model: Optional[str], schema: Dict[str, Any]) -> str:
+    # structured replies are cached apart from plain-text replies to the same prompt
+    digest = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{model}|json:{digest}"
+
+
+# what the API / SDK error says when it refuses the structured-output config itself
+_SCHEMA_ERROR_MARKERS = ("response_schema", "responseschema", "response_mime_type", "responsemimetype",
+                         "json mode")
+
+
+def _schema_rejected(exc: Exception) -> bool:
+    # only a refusal of the response schema / JSON mode falls back to plain text; any other 400
+    # (oversized prompt, bad argument), SDK or code error is a real failure and propagates
+    message = str(exc).lower()
+    if not any(marker in message for marker in _SCHEMA_ERROR_MARKERS):
+        return False
+    if getattr(exc, "code", None) == 400:
+        return True
+    try:
+        from pydantic import ValidationError
+    except ImportError:
+        return False
+    # the SDK validating the schema dict client-side, before any request
+    return isinstance(exc, ValidationError)
+
+
+def _parse_reply(text: str, schema: Dict[str, Any]) -> Any:
+    from json_extract import extract_json
+
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return extract_json(text, list if str(schema.get("type", "")).upper() == "ARRAY" else dict)
+
+
+def _json_result(text: str, schema: Dict[str, Any], structured: bool) -> Dict[str, Any]:
+    value = _parse_reply(text, schema)
+    if value is None:
+        _count("parse_failures")
+    return {"value": value, "text": text, "structured": structured}
+
+
+def generate_json(prompt: str, schema: Dict[str, Any], model: Optional[str] = None,
+                  use_cache: bool = True, client: Any = None, stage: Optional[str] = None,
+                  deadline: Optional[float] = None) -> Dict[str, Any]:
+    # {"value": parsed JSON (None if unusable), "text": raw reply, "structured": bool}
+    from llm_cache import get_llm_cache
+
+    model = model or llm_stages.stage_model(stage)
+    if not GEMINI_STRUCTURED_OUTPUT:
+        return _json_result(generate(prompt, model, use_cache, client, stage, deadline), schema, False)
+
+    cache_model = _structured_cache_model(model, schema)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(cache_model, prompt)
+        if cached is not None:
+            return _json_result(cached, schema, True)
+
+    try:
+        resp = _call(client, model, prompt, _json_config(schema), stage, deadline)
+    except Exception as e:
+        if not _schema_rejected(e):
+            raise
+        _count("text_fallbacks")
+        return _json_result(generate(prompt, model, use_cache, client, stage, deadline), schema, False)
+    text = getattr(resp, "text", None) or ""
+    _count("structured")
+    if cache is not None and text:
+        cache.put(cache_model, prompt, text)
+    return _json_result(text, schema, True)
+
+
+async def agenerate_json(prompt: str, schema: Dict[str, Any], model: Optional[str] = None,
+                         use_cache: bool = True, client: Any = None, stage: Optional[str] = None,
+                         deadline: Optional[float] = None) -> Dict[str, Any]:
+    from llm_cache import get_llm_cache
+
+    model = model or llm_stages.stage_model(stage)
+    if not GEMINI_STRUCTURED_OUTPUT:
+        return _json_result(await agenerate(prompt, model, use_cache, client, stage, deadline), schema, False)
+
+    cache_model = _structured_cache_model(model, schema)
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(cache_model, prompt)
+        if cached is not None:
+            return _json_result(cached, schema, True)
+
+    try:
+        resp = await _acall(client, model, prompt, _json_config(schema), stage, deadline)
+    except Exception as e:
+        if not _schema_rejected(e):
+            raise
+        _count("text_fallbacks")
+        return _json_result(await agenerate(prompt, model, use_cache, client, stage, deadline), schema, False)
+    text = getattr(resp, "text", None) or ""
+    _count("structured")
+    if cache is not None and text:
+        cache.put(cache_model, prompt, text)
+    return _json_result(text, schema, True)
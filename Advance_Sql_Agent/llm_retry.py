@@ -0,0 +1,262 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import llm_stages
+
+# Timeouts, retries and hedging around one Gemini call (llm_client._call / _acall).
+# Every HTTP attempt gets min(LLM_CALL_TIMEOUT_MS, time left before the request
+# deadline). Transient failures (429, 5xx, timeouts, dropped connections) are retried
+# with exponential backoff and full jitter, but never past the deadline. With
+# LLM_HEDGE=1 an attempt still unanswered at its stage's p95 (llm_stages) gets a
+# duplicate fired next to it and the first answer wins - the slow tail is cut for
+# roughly 5% extra calls. Anything else (400, auth, schema errors) fails at once.
+
+LLM_CALL_TIMEOUT_MS = int(os.getenv("LLM_CALL_TIMEOUT_MS", "30000"))
+# retries after the first attempt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_MS = float(os.getenv("LLM_BACKOFF_BASE_MS", "250"))
+LLM_BACKOFF_MAX_MS = float(os.getenv("LLM_BACKOFF_MAX_MS", "4000"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+# hedge at this percentile of the stage's recent latencies; it must sit below the slow
+# tail - if more than 5% of calls are slow, the p95 is the tail and 0.9 works better
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# the percentile is trusted once the stage has this many samples; until then no hedging
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# never hedge sooner than this, however fast the stage usually is
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "100"))
+# threads for hedged sync calls (both copies run there so the caller can wait on either)
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+# budget for all LLM calls of one user question, counted from its RequestContext; 0 = none
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "60000"))
+
+_TRANSIENT_CODES = {408, 429, 500, 502, 503, 504}
+
+_LOCK = threading.Lock()
+_POOL: Optional[Any] = None
+RETRY_STATS: Dict[str, int] = {
+    "attempts": 0, "failed_attempts": 0, "timeouts": 0, "retries": 0,
+    "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0,
+}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+def _count(name: str) -> None:
+    with _LOCK:
+        RETRY_STATS[name] += 1
+
+
+def retry_stats() -> Dict[str, int]:
+    with _LOCK:
+        return dict(RETRY_STATS)
+
+
+def reset_stats() -> None:
+    with _LOCK:
+        for name in RETRY_STATS:
+            RETRY_STATS[name] = 0
+
+
+def deadline_after(ms: float) -> Optional[float]:
+    # absolute time.monotonic() deadline, or None for ms <= 0
+    return time.monotonic() + ms / 1000.0 if ms and ms > 0 else None
+
+
+def remaining_ms(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else (deadline - time.monotonic()) * 1000.0
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    if isinstance(exc, TimeoutError):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TimeoutException)
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, LLMDeadlineExceeded):
+        return False
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in _TRANSIENT_CODES
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_ms(retry: int) -> float:
+    # full jitter: uniform in [0, min(max, base * 2^retry)]
+    return random.uniform(0, min(LLM_BACKOFF_MAX_MS, LLM_BACKOFF_BASE_MS * (2 ** retry)))
+
+
+def hedge_after_ms(stage: Optional[str]) -> Optional[float]:
+    if not LLM_HEDGE or not stage:
+        return None
+    after = llm_stages.percentile(stage, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+    return None if after is None else max(LLM_HEDGE_MIN_MS, after)
+
+
+def _attempt_timeout_ms(deadline: Optional[float]) -> int:
+    left = remaining_ms(deadline)
+    if left is not None and left <= 0:
+        _count("deadline_exceeded")
+        raise LLMDeadlineExceeded("request deadline exceeded before the LLM call")
+    return max(1, int(LLM_CALL_TIMEOUT_MS if left is None else min(LLM_CALL_TIMEOUT_MS, left)))
+
+
+def _next_delay_ms(exc: Exception, retry: int, deadline: Optional[float]) -> float:
+    # backoff before the next attempt; re-raises when `exc` is final
+    if not is_transient(exc) or retry >= LLM_MAX_RETRIES:
+        raise exc
+    delay = backoff_ms(retry)
+    left = remaining_ms(deadline)
+    if left is not None and delay >= left:
+        _count("deadline_exceeded")
+        raise LLMDeadlineExceeded(
+            f"request deadline exceeded while retrying after {type(exc).__name__}: {exc}") from exc
+    _count("retries")
+    return delay
+
+
+def _record(stage: Optional[str], t0: float, exc: Optional[BaseException]) -> None:
+    # every HTTP attempt (hedge copies included) feeds the stage latency and its p95
+    _count("attempts")
+    if exc is not None:
+        _count("failed_attempts")
+        if _is_timeout(exc):
+            _count("timeouts")
+    if stage:
+        llm_stages.record(stage, (time.perf_counter() - t0) * 1000, exc is None)
+
+
+def _run(attempt: Callable[[int], Any], timeout_ms: int, stage: Optional[str]) -> Any:
+    t0 = time.perf_counter()
+    try:
+        resp = attempt(timeout_ms)
+    except Exception as e:
+        _record(stage, t0, e)
+        raise
+    _record(stage, t0, None)
+    return resp
+
+
+async def _arun(attempt: Callable[[int], Awaitable[Any]], timeout_ms: int, stage: Optional[str]) -> Any:
+    t0 = time.perf_counter()
+    try:
+        resp = await attempt(timeout_ms)
+    except Exception as e:
+        _record(stage, t0, e)
+        raise
+    _record(stage, t0, None)
+    return resp
+
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        with _LOCK:
+            if _POOL is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _POOL = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+    return _POOL
+
+
+def _hedged(attempt: Callable[[int], Any], timeout_ms: int, stage: Optional[str]) -> Any:
+    hedge_ms = hedge_after_ms(stage)
+    if hedge_ms is None or hedge_ms >= timeout_ms:
+        return _run(attempt, timeout_ms, stage)
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    first = _pool().submit(_run, attempt, timeout_ms, stage)
+    if wait([first], timeout=hedge_ms / 1000.0).done:
+        return first.result()
+    _count("hedges")
+    # the copy shares the original's end time; the loser runs out in the background
+    second = _pool().submit(_run, attempt, max(1, int(timeout_ms - hedge_ms)), stage)
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            if future is second:
+                _count("hedge_wins")
+            return future.result()
+    raise error
+
+
+async def _ahedged(attempt: Callable[[int], Awaitable[Any]], timeout_ms: int, stage: Optional[str]) -> Any:
+    hedge_ms = hedge_after_ms(stage)
+    if hedge_ms is None or hedge_ms >= timeout_ms:
+        return await _arun(attempt, timeout_ms, stage)
+    import asyncio
+
+    first = asyncio.ensure_future(_arun(attempt, timeout_ms, stage))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_ms / 1000.0)
+        if done:
+            return first.result()
+        _count("hedges")
+        second = asyncio.ensure_future(_arun(attempt, max(1, int(timeout_ms - hedge_ms)), stage))
+        tasks.append(second)
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                if task is second:
+                    _count("hedge_wins")
+                return task.result()
+        raise error
+    finally:
+        # the loser (or both, if the caller was cancelled) is cancelled, closing its connection
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def call(attempt: Callable[[int], Any], stage: Optional[str] = None, deadline: Optional[float] = None) -> Any:
+    # attempt(timeout_ms) makes one HTTP request; deadline is an absolute time.monotonic()
+    retry = 0
+    while True:
+        timeout_ms = _attempt_timeout_ms(deadline)
+        try:
+            return _hedged(attempt, timeout_ms, stage)
+        except Exception as e:
+            delay = _next_delay_ms(e, retry, deadline)
+        retry += 1
+        time.sleep(delay / 1000.0)
+
+
+async def acall(attempt: Callable[[int], Awaitable[Any]], stage: Optional[str] = None,
+                deadline: Optional[float] = None) -> Any:
+    import asyncio
+
+    retry = 0
+    while True:
+        timeout_ms = _attempt_timeout_ms(deadline)
+        try:
+            return await _ahedged(attempt, timeout_ms, stage)
+        except Exception as e:
+            delay = _next_delay_ms(e, retry, deadline)
+        retry += 1
+        await asyncio.sleep(delay / 1000.0)
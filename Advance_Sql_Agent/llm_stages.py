@@ -0,0 +1,98 @@
+import math
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-stage Gemini model and latency SLO. The cheap stages (split decision, checker,
+# result summary) can run on a lighter model while generation / repair keep the
+# strong one:
+#   GEMINI_MODEL_SPLIT=gemini-2.5-flash-lite  GEMINI_MODEL_GENERATE=gemini-2.5-pro ...
+# Unset stages use GEMINI_MODEL. Latency is recorded per stage (real API calls only,
+# not llm_cache hits) so p50 / p95 and SLO breaches can be compared before / after.
+STAGES = ("split", "generate", "check", "repair", "summarize")
+# end-to-end time of one user question, recorded next to the stages it is made of
+REQUEST_STAGE = "request"
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+STAGE_MODELS: Dict[str, Optional[str]] = {
+    s: os.getenv(f"GEMINI_MODEL_{s.upper()}") or GEMINI_MODEL for s in STAGES
+}
+
+_DEFAULT_SLO_MS = {"split": 1500, "generate": 8000, "check": 2500, "repair": 8000, "summarize": 2500,
+                   REQUEST_STAGE: 20000}
+STAGE_SLO_MS: Dict[str, int] = {
+    s: int(os.getenv(f"GEMINI_SLO_MS_{s.upper()}", str(ms))) for s, ms in _DEFAULT_SLO_MS.items()
+}
+# samples kept per stage for the percentiles
+STAGE_LATENCY_WINDOW = int(os.getenv("STAGE_LATENCY_WINDOW", "500"))
+
+_LOCK = threading.Lock()
+_SAMPLES: Dict[str, Deque[float]] = {s: deque(maxlen=STAGE_LATENCY_WINDOW) for s in _DEFAULT_SLO_MS}
+_COUNTS: Dict[str, Dict[str, int]] = {s: {"calls": 0, "errors": 0, "slo_breaches": 0} for s in _DEFAULT_SLO_MS}
+
+
+def stage_model(stage: Optional[str]) -> Optional[str]:
+    return STAGE_MODELS.get(stage, GEMINI_MODEL) if stage else GEMINI_MODEL
+
+
+def record(stage: str, elapsed_ms: float, ok: bool = True) -> None:
+    with _LOCK:
+        if stage not in _SAMPLES:
+            _SAMPLES[stage] = deque(maxlen=STAGE_LATENCY_WINDOW)
+            _COUNTS[stage] = {"calls": 0, "errors": 0, "slo_breaches": 0}
+        _SAMPLES[stage].append(elapsed_ms)
+        counts = _COUNTS[stage]
+        counts["calls"] += 1
+        counts["errors"] += 0 if ok else 1
+        slo = STAGE_SLO_MS.get(stage)
+        if slo and elapsed_ms > slo:
+            counts["slo_breaches"] += 1
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    # nearest-rank
+    if not ordered:
+        return None
+    return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 1)
+
+
+def percentile(stage: str, q: float, min_samples: int = 1) -> Optional[float]:
+    # one percentile of the stage's recent latencies; None below `min_samples` samples
+    with _LOCK:
+        samples = _SAMPLES.get(stage)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+    return _percentile(ordered, q)
+
+
+def stage_stats() -> Dict[str, Dict[str, Any]]:
+    with _LOCK:
+        snapshot = {s: (sorted(v), dict(_COUNTS[s])) for s, v in _SAMPLES.items()}
+    out: Dict[str, Dict[str, Any]] = {}
+    for stage, (ordered, counts) in snapshot.items():
+        slo = STAGE_SLO_MS.get(stage)
+        window_breaches = sum(1 for ms in ordered if slo and ms > slo)
+        out[stage] = {
+            "model": STAGE_MODELS.get(stage) if stage != REQUEST_STAGE else None,
+            "slo_ms": slo,
+            **counts,
+            "p50_ms": _percentile(ordered, 0.50),
+            "p95_ms": _percentile(ordered, 0.95),
+            "max_ms": round(ordered[-1], 1) if ordered else None,
+            "window": len(ordered),
+            "window_breach_rate": round(window_breaches / len(ordered), 3) if ordered else 0.0,
+        }
+    return out
+
+
+def reset_stats() -> None:
+    with _LOCK:
+        for stage in _SAMPLES:
+            _SAMPLES[stage].clear()
+            _COUNTS[stage] = {"calls": 0, "errors": 0, "slo_breaches": 0}
@@ -1,7 +1,6 @@
 import json
 import re
 from datetime import date, datetime
-import pandas as pd
 from sql_agent import process_user_request
 from history_utils import load_history, add_history_entry, print_history, get_history_entry
 
@@ -22,6 +21,8 @@ def _print_table_rows(rows, title="Table"):
         return
     norm_rows = [normalize_row_values(r) for r in rows]
     try:
+        import pandas as pd
+
         df = pd.DataFrame(norm_rows)
         print(df.to_string(index=False))
     except Exception:
@@ -196,5 +197,6 @@ if __name__ == "__main__":
             is_complex=is_complex,
             validated_sql=validated_sql,
             generated_sql=generated_sql,
+            split_decision=out.get("split_decision"),
         )
         print(f"\n(Saved to history as entry #{idx})")
@@ -0,0 +1,148 @@
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from sql_tools import SchemaSnapshot
+
+# Generation / repair prompts for nl_to_sql, assembled from sections:
+#   static prefix (instructions, output format), examples, schema, keys, request.
+# The static prefix is a module constant and always comes first, but nothing is
+# cached per request: at ~200 tokens it is below Gemini's implicit-caching minimum
+# (1024 tokens on Flash, more on Pro). The savings come from sending less; the
+# schema goes out as "Table(col1,col2,...)" lines instead of indented JSON.
+# Token counts are estimated per section; over PROMPT_TOKEN_BUDGET the examples are
+# dropped first, then the least relevant tables.
+
+# 0 = no budget
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# estimate only - an exact count would cost a count_tokens round trip per prompt
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+# a prompt never keeps fewer tables than this, whatever the budget says
+PROMPT_MIN_TABLES = int(os.getenv("PROMPT_MIN_TABLES", "2"))
+
+_GENERATE_PREFIX = """\
+You are an expert Microsoft SQL Server (T-SQL) assistant. Generate one valid, read-only T-SQL query that answers the user request.
+Rules:
+- T-SQL only: TOP (n) not LIMIT; no backticks, double-quoted identifiers, "::type" casts, ILIKE, USING joins or RETURNING.
+- Dates: GETDATE(), DATEADD(), EOMONTH(), YEAR(), MONTH(), FORMAT(x, 'yyyy-MM').
+- Use only the tables and columns listed in SCHEMA, spelled exactly; never invent columns.
+- Join with explicit ON: use a KEYS condition when one links the tables (pick one of "one of:" alternatives);
+  when KEYS lists none, join on matching id columns from SCHEMA.
+- GROUP BY every non-aggregated selected column; WHERE to filter; ORDER BY to rank.
+- If information is missing, make a reasonable assumption and state it in notes.
+Output: ONLY a JSON object, no surrounding text:
+{"sql": "<the T-SQL query only, or null>", "notes": "<short assumptions>"}"""
+
+_REPAIR_PREFIX = """\
+You are an expert Microsoft SQL Server (T-SQL) assistant. A query you generated failed validation. Find every cause \
+in VALIDATION_MESSAGE and return a corrected, read-only T-SQL query for the user request (rebuild it if needed).
+Rules:
+- T-SQL only: TOP (n) not LIMIT; no backticks, double-quoted identifiers, "::type" casts, ILIKE, USING joins or RETURNING.
+- Dates: GETDATE(), DATEADD(), EOMONTH(), YEAR(), MONTH(), FORMAT(x, 'yyyy-MM').
+- Use only the tables and columns listed in SCHEMA, spelled exactly; never invent columns.
+- Join with explicit ON: use a KEYS condition when one links the tables, otherwise matching id columns
+  from SCHEMA; include GROUP BY when aggregating.
+- If it cannot be fixed, return "sql": null and say why in notes.
+Output: ONLY a JSON object, no surrounding text:
+{"sql": "<the corrected T-SQL query only, or null>", "notes": "<short description of the fix>"}"""
+
+_GENERATE_EXAMPLES = """\
+EXAMPLES (correct T-SQL):
+- "Top 10 customers by total spending" ->
+  SELECT TOP (10) c.CustomerID, c.Name, SUM(o.TotalAmount) AS TotalSpending FROM Customers c JOIN Orders o ON c.CustomerID = o.CustomerID GROUP BY c.CustomerID, c.Name ORDER BY TotalSpending DESC;
+- "Monthly sales for 2023" ->
+  SELECT FORMAT(OrderDate, 'yyyy-MM') AS YearMonth, SUM(TotalAmount) AS MonthlySales FROM Orders WHERE YEAR(OrderDate) = 2023 GROUP BY FORMAT(OrderDate, 'yyyy-MM') ORDER BY YearMonth;
+- "Employees hired in the last 90 days" ->
+  SELECT EmployeeID, FirstName, LastName, HireDate FROM Employees WHERE HireDate >= DATEADD(DAY, -90, CAST(GETDATE() AS DATE));
+NEVER: SELECT * FROM Orders LIMIT 10 | WHERE Name ILIKE '%john%' | SELECT "CustomerID" FROM "Orders" | JOIN Customers USING (CustomerID)"""
+
+_REPAIR_EXAMPLES = """\
+EXAMPLES (wrong -> fixed):
+- SELECT "id", "name" FROM Customers LIMIT 10; -> SELECT TOP (10) id, name FROM Customers;
+- SELECT * FROM Orders JOIN Customers USING (CustomerID); -> SELECT o.OrderID, c.CustomerName FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID;
+- SELECT Region, SUM(Sales), CustomerName FROM Sales; -> SELECT Region, SUM(Sales) AS TotalSales FROM Sales GROUP BY Region;
+- WHERE OrderDate >= NOW() - INTERVAL '30 days' -> WHERE OrderDate >= DATEADD(DAY, -30, GETDATE())"""
+
+_PREFIXES = {"generate": _GENERATE_PREFIX, "repair": _REPAIR_PREFIX}
+_EXAMPLES = {"generate": _GENERATE_EXAMPLES, "repair": _REPAIR_EXAMPLES}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / PROMPT_CHARS_PER_TOKEN)
+
+
+def encode_schema(schema: Dict[str, List[str]]) -> str:
+    # one "Table(col1,col2,...)" line per table, in the mapping's (relevance) order
+    return "\n".join(f"{table}({','.join(cols)})" for table, cols in schema.items())
+
+
+def static_prefix(kind: str) -> Tuple[str, int]:
+    # (text, tokens); identical for every prompt of this kind
+    text = _PREFIXES[kind]
+    return text, estimate_tokens(text)
+
+
+def _sections(kind: str, tables: Dict[str, List[str]], snapshot: SchemaSnapshot,
+              with_examples: bool, dynamic: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    sections = [("prefix", static_prefix(kind)[0])]
+    if with_examples:
+        sections.append(("examples", _EXAMPLES[kind]))
+    sections.append(("schema", "SCHEMA (Table(columns)):\n" + encode_schema(tables)))
+    sections.append(("keys", "KEYS:\n" + snapshot.key_hints(list(tables))))
+    sections.extend(dynamic)
+    return sections
+
+
+def build_prompt(kind: str,
+                 schema: Dict[str, List[str]],
+                 snapshot: SchemaSnapshot,
+                 user_request: str,
+                 invalid_sql: Optional[str] = None,
+                 validation_message: Optional[str] = None,
+                 budget: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    # kind: "generate" | "repair"; returns (prompt, prompt_stats)
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    dynamic = []
+    if kind == "repair":
+        dynamic.append(("invalid_sql", "INVALID_SQL:\n" + (invalid_sql or "<no sql returned>")))
+        dynamic.append(("validation_message", "VALIDATION_MESSAGE:\n" + (validation_message or "No message")))
+    dynamic.append(("request", "USER REQUEST:\n" + user_request))
+
+    tables = dict(schema)
+    with_examples = True
+    dropped: List[str] = []
+    sections = _sections(kind, tables, snapshot, with_examples, dynamic)
+    tokens = {name: estimate_tokens(text) for name, text in sections}
+    if budget > 0 and sum(tokens.values()) > budget:
+        with_examples = False
+        dropped.append("examples")
+        sections = _sections(kind, tables, snapshot, with_examples, dynamic)
+        tokens = {name: estimate_tokens(text) for name, text in sections}
+    if budget > 0 and sum(tokens.values()) > budget and len(tables) > PROMPT_MIN_TABLES:
+        # keep the longest relevance-ordered head of the tables that fits; schema and KEYS
+        # both shrink with it, so each probe re-renders (log2(n) renders in total)
+        names = list(tables)
+        lo, hi = PROMPT_MIN_TABLES, len(names) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            probe = _sections(kind, {t: tables[t] for t in names[:mid]}, snapshot, with_examples, dynamic)
+            if sum(estimate_tokens(text) for _, text in probe) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        dropped.extend(f"table:{t}" for t in names[lo:])
+        tables = {t: tables[t] for t in names[:lo]}
+        sections = _sections(kind, tables, snapshot, with_examples, dynamic)
+        tokens = {name: estimate_tokens(text) for name, text in sections}
+
+    prompt = "\n\n".join(text for _, text in sections)
+    total = estimate_tokens(prompt)
+    return prompt, {
+        "kind": kind,
+        "sections": tokens,
+        "total_tokens": total,
+        "budget": budget,
+        "over_budget": budget > 0 and total > budget,
+        "dropped": dropped,
+        "tables": len(tables),
+    }
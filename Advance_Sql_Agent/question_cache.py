@@ -0,0 +1,118 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# normalized question -> validated SQL, persisted like query_history.json
+QUESTION_CACHE_FILE = os.getenv("QUESTION_CACHE_FILE", "question_cache.json")
+QUESTION_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "1000"))
+
+# only articles and politeness: a hit skips the LLM entirely, so two questions may share
+# a key only if the same SQL answers both. Direction (to / from), negation (not, no),
+# tense (is / was), quantifiers (all, any, each), "top", "per", "by" and numbers all stay.
+_STOP_WORDS = {"a", "an", "the", "please", "pls", "kindly"}
+# bumped whenever normalize_question changes; entries stored under another one are dropped
+_KEY_VERSION = 2
+
+_CACHE: Optional[Dict[str, Dict[str, Any]]] = None
+_LOCK = threading.Lock()
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_question(question: str) -> str:
+    words = re.findall(r"[a-z0-9]+", (question or "").lower())
+    return " ".join(_singular(w) for w in words if w not in _STOP_WORDS)
+
+
+def _load() -> Dict[str, Dict[str, Any]]:
+    global _CACHE
+    if _CACHE is None:
+        data: Any = {}
+        if os.path.exists(QUESTION_CACHE_FILE):
+            try:
+                with open(QUESTION_CACHE_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                data = {}
+        _CACHE = data if isinstance(data, dict) else {}
+    return _CACHE
+
+
+def _save(cache: Dict[str, Dict[str, Any]]) -> None:
+    tmp = f"{QUESTION_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp, QUESTION_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def lookup_question(question: str, schema_version: str) -> Optional[Dict[str, Any]]:
+    key = normalize_question(question)
+    if not key:
+        return None
+    with _LOCK:
+        cache = _load()
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry.get("key_version") != _KEY_VERSION:
+            # keyed by an older, looser normalization - it may belong to a different question
+            del cache[key]
+            _save(cache)
+            return None
+        if entry.get("schema_version") != schema_version:
+            # schema moved on: everything cached against an older version is suspect
+            stale = [k for k, e in cache.items() if e.get("schema_version") != schema_version]
+            for k in stale:
+                del cache[k]
+            _save(cache)
+            return None
+        entry["hits"] = entry.get("hits", 0) + 1
+        entry["last_used_utc"] = datetime.utcnow().isoformat()
+        return dict(entry)
+
+
+def store_question(question: str,
+                   schema_version: str,
+                   validated_sql: str,
+                   notes: Optional[str] = None) -> None:
+    key = normalize_question(question)
+    if not key or not validated_sql:
+        return
+    now = datetime.utcnow().isoformat()
+    with _LOCK:
+        cache = _load()
+        cache[key] = {
+            "question": question,
+            "schema_version": schema_version,
+            "key_version": _KEY_VERSION,
+            "validated_sql": validated_sql,
+            "notes": notes,
+            "hits": 0,
+            "created_utc": now,
+            "last_used_utc": now,
+        }
+        if len(cache) > QUESTION_CACHE_MAX_ENTRIES:
+            oldest: List[str] = sorted(cache, key=lambda k: cache[k].get("last_used_utc", ""))
+            for k in oldest[:len(cache) - QUESTION_CACHE_MAX_ENTRIES]:
+                del cache[k]
+        _save(cache)
+
+
+def forget_question(question: str) -> None:
+    key = normalize_question(question)
+    with _LOCK:
+        cache = _load()
+        if cache.pop(key, None) is not None:
+            _save(cache)
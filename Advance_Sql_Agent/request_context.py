@@ -0,0 +1,106 @@
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from sql_tools import SchemaSnapshot, get_schema_snapshot, get_shared_engine, run_in_db_pool
+from llm_client import get_client
+from llm_retry import REQUEST_DEADLINE_MS, deadline_after, remaining_ms
+
+# Everything one user question needs, resolved once and handed down explicitly:
+# process_user_request -> handle_complex_request -> nl_to_sql -> checker. All parts
+# of a complex request share the same schema snapshot, Gemini client, validation memo,
+# counters and deadline, so an N-part request reads the catalog once instead of ~3N
+# times. DB work is not shared: each use checks out its own pooled connection, so
+# concurrent parts never queue behind one another.
+
+
+class RequestContext:
+    def __init__(self, snapshot: Optional[SchemaSnapshot] = None, client: Any = None):
+        self.snapshot = snapshot if snapshot is not None else get_schema_snapshot()
+        self._client = client
+        # (sql, loop state) -> checker result, shared by every part of the request
+        self.validation_memo: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # db_connections = most pooled connections the request held at once
+        self.counters: Dict[str, int] = {
+            "llm_calls": 0, "db_round_trips": 0, "db_connections": 0,
+            "structured_responses": 0, "parse_failures": 0, "prompt_tokens": 0,
+        }
+        self.started = time.perf_counter()
+        # every LLM call of the question (retries, hedges) must finish by then; None = no limit
+        self.deadline = deadline_after(REQUEST_DEADLINE_MS)
+        # wall time per LLM stage (llm_stages.STAGES), cache hits included
+        self.stage_ms: Dict[str, float] = {}
+        self._conns_in_use = 0
+        self._counter_lock = threading.Lock()
+
+    @property
+    def schema_version(self) -> str:
+        return self.snapshot.version
+
+    def get_client(self) -> Any:
+        # resolved on the first real LLM call, so cache-served requests never build a client
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def note_reply(self, reply: Dict[str, Any]) -> Dict[str, Any]:
+        # a generate_json reply: schema-typed, and whether any JSON could be read from it
+        if reply.get("structured"):
+            self.count("structured_responses")
+        if reply.get("value") is None:
+            self.count("parse_failures")
+        return reply
+
+    @contextmanager
+    def timed(self, stage: Optional[str]):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if stage:
+                with self._counter_lock:
+                    self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + (time.perf_counter() - t0) * 1000
+
+    @contextmanager
+    def connection(self):
+        # checked out per use and returned on exit; the pool rolls back the (read-only)
+        # transaction on return, so no locks linger and a broken connection is discarded
+        with get_shared_engine().connect() as conn:
+            with self._counter_lock:
+                self._conns_in_use += 1
+                self.counters["db_round_trips"] += 1
+                self.counters["db_connections"] = max(self.counters["db_connections"], self._conns_in_use)
+            try:
+                yield conn
+            finally:
+                with self._counter_lock:
+                    self._conns_in_use -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.counters)
+        out["schema_version"] = self.schema_version
+        out["validation_memo_entries"] = len(self.validation_memo)
+        with self._counter_lock:
+            out["stage_ms"] = {s: round(ms, 1) for s, ms in self.stage_ms.items()}
+        out["elapsed_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        left = remaining_ms(self.deadline)
+        out["deadline_left_ms"] = None if left is None else round(left, 1)
+        return out
+
+
+@contextmanager
+def request_scope(ctx: Optional[RequestContext] = None):
+    # reuse the caller's context, or a fresh one for the duration of the block; connections
+    # go back to the pool after each use, so there is nothing to release afterwards
+    yield ctx if ctx is not None else RequestContext()
+
+
+@asynccontextmanager
+async def arequest_scope(ctx: Optional[RequestContext] = None):
+    # building the context may refresh the schema snapshot, which hits the DB
+    yield ctx if ctx is not None else await run_in_db_pool(RequestContext)
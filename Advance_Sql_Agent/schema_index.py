@@ -0,0 +1,141 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from sql_tools import SchemaSnapshot
+
+# number of best-matching tables sent to the model (0 disables pruning)
+SCHEMA_PRUNE_TOP_K = int(os.getenv("SCHEMA_PRUNE_TOP_K", "8"))
+# extra tables pulled in along foreign keys, on top of the top-k
+SCHEMA_PRUNE_MAX_NEIGHBOURS = int(os.getenv("SCHEMA_PRUNE_MAX_NEIGHBOURS", "8"))
+
+# table-name hits matter more than column-name hits
+_TABLE_NAME_WEIGHT = 3
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+_STOP_WORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "by", "to", "and", "or", "with", "from",
+    "is", "are", "was", "were", "be", "me", "my", "all", "each", "per", "show", "list",
+    "give", "get", "find", "what", "which", "who", "how", "many", "much", "top", "last",
+    "id", "ids",
+}
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("ses", "xes", "zes", "ches", "shes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    # splits snake_case, camelCase and plain prose alike
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    words = re.findall(r"[A-Za-z]+|\d+", text.lower())
+    return [_stem(w) for w in words if w not in _STOP_WORDS]
+
+
+class SchemaIndex:
+    # BM25 over table and column name tokens; one document per table
+    def __init__(self, snapshot: SchemaSnapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self._docs: Dict[str, Counter] = {}
+        for table, cols in snapshot.columns.items():
+            terms = tokenize(table) * _TABLE_NAME_WEIGHT
+            for c in cols:
+                terms.extend(tokenize(c["name"]))
+            self._docs[table] = Counter(terms)
+
+        n = len(self._docs) or 1
+        self._avg_len = sum(sum(d.values()) for d in self._docs.values()) / n
+        df: Counter = Counter()
+        for d in self._docs.values():
+            df.update(d.keys())
+        self._idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def score(self, question: str) -> Dict[str, float]:
+        q_terms = set(tokenize(question))
+        scores: Dict[str, float] = {}
+        for table, doc in self._docs.items():
+            doc_len = sum(doc.values())
+            s = 0.0
+            for term in q_terms:
+                tf = doc.get(term)
+                if not tf:
+                    continue
+                norm = tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * doc_len / self._avg_len)
+                s += self._idf[term] * tf * (_BM25_K1 + 1) / norm
+            if s > 0:
+                scores[table] = s
+        return scores
+
+    def top_tables(self, question: str, k: int = SCHEMA_PRUNE_TOP_K) -> List[str]:
+        scores = self.score(question)
+        return sorted(scores, key=lambda t: (-scores[t], t))[:k]
+
+
+_INDEX: Optional[SchemaIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_schema_index(snapshot: SchemaSnapshot) -> SchemaIndex:
+    global _INDEX
+    idx = _INDEX
+    if idx is not None and idx.version == snapshot.version:
+        return idx
+    with _INDEX_LOCK:
+        if _INDEX is None or _INDEX.version != snapshot.version:
+            _INDEX = SchemaIndex(snapshot)
+        return _INDEX
+
+
+def select_tables(snapshot: SchemaSnapshot,
+                  question: str,
+                  top_k: int = SCHEMA_PRUNE_TOP_K,
+                  max_neighbours: int = SCHEMA_PRUNE_MAX_NEIGHBOURS) -> List[str]:
+    # every table when pruning is off or the schema is small
+    if top_k <= 0 or len(snapshot.columns) <= top_k:
+        return snapshot.tables
+    index = get_schema_index(snapshot)
+    scores = index.score(question)
+    picked = sorted(scores, key=lambda t: (-scores[t], t))[:top_k]
+    if not picked:
+        return _fallback_tables(snapshot, top_k)
+
+    # expand along foreign keys so join partners are present, best-scoring first
+    candidates = []
+    for table in picked:
+        for n in snapshot.neighbours(table):
+            if n not in picked and n not in candidates:
+                candidates.append(n)
+    candidates.sort(key=lambda t: -scores.get(t, 0.0))
+    return picked + candidates[:max_neighbours]
+
+
+def _fallback_tables(snapshot: SchemaSnapshot, top_k: int) -> List[str]:
+    # nothing matched: the best-connected tables, which most queries join through, still top-k only
+    return sorted(snapshot.tables, key=lambda t: (-len(snapshot.neighbours(t)), t))[:top_k]
+
+
+def prune_schema(snapshot: SchemaSnapshot,
+                 question: str,
+                 top_k: int = SCHEMA_PRUNE_TOP_K,
+                 max_neighbours: int = SCHEMA_PRUNE_MAX_NEIGHBOURS) -> Dict[str, List[str]]:
+    return snapshot.mapping(select_tables(snapshot, question, top_k, max_neighbours))
+
+
+def prune_schema_for_sql(snapshot: SchemaSnapshot, sql: str,
+                         top_k: int = SCHEMA_PRUNE_TOP_K) -> Dict[str, List[str]]:
+    # for the checker: every table the SQL names, plus the closest top-k matches so a
+    # misspelled table or column can be corrected to a real one
+    named = snapshot.tables_in_sql(sql)
+    closest = [t for t in select_tables(snapshot, sql, top_k, max_neighbours=0) if t not in named]
+    return snapshot.mapping(named + closest[:top_k])
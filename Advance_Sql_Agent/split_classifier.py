@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Local split / no-split / uncertain decision for a question, so the Gemini split
+# call is only paid for when the question is genuinely ambiguous. A small logistic
+# model over clause-parsing features; weights can be re-fit from query_history.json.
+SPLIT_CLASSIFIER = os.getenv("SPLIT_CLASSIFIER", "1") != "0"
+SPLIT_CLASSIFIER_WEIGHTS = os.getenv("SPLIT_CLASSIFIER_WEIGHTS", "split_classifier_weights.json")
+# probability bands: >= HIGH -> split locally, <= LOW -> no split, otherwise ask the LLM
+SPLIT_CLASSIFIER_HIGH = float(os.getenv("SPLIT_CLASSIFIER_HIGH", "0.75"))
+SPLIT_CLASSIFIER_LOW = float(os.getenv("SPLIT_CLASSIFIER_LOW", "0.25"))
+
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "bias": -2.5,
+    "extra_tasks": 3.0,       # clauses beyond the first that carry their own task verb
+    "extra_clauses": 0.8,
+    "semicolons": 1.0,
+    "numbered_items": 1.2,
+    "also": 0.8,              # "also", "as well as", "additionally", "in addition"
+    "comparison": 0.3,        # "vs", "versus", "compare"
+    "dependent_refs": -1.5,   # later clauses that lean on an earlier one ("those", "them", ...)
+    "leading_scope": -1.0,    # "For each campaign, ..." scopes every clause to one query
+    "grouping": -0.4,         # "per", "each", "by" - usually one GROUP BY query
+    "length": 0.4,
+    "ands": 0.1,
+}
+
+_TASK_VERBS = {
+    "show", "list", "find", "get", "give", "calculate", "compute", "count", "compare", "identify",
+    "display", "return", "rank", "summarize", "summarise", "determine", "report", "provide",
+    "analyze", "analyse", "fetch", "retrieve", "plot", "break", "total", "sum", "measure",
+    "what", "which", "how", "who", "when", "where", "tell",
+}
+_DEPENDENT = {"it", "its", "this", "those", "them", "these", "that", "they", "their", "such", "same"}
+# words that give a clause its own scope (a filter, a ranking, a grouping, a quantity)
+_SCOPE_WORDS = {
+    "top", "per", "by", "each", "every", "all", "any", "with", "without", "for", "from", "in", "of",
+    "where", "who", "whose", "never", "over", "under", "above", "below", "last", "first", "between",
+    "than", "most", "least", "since", "before", "after", "during",
+}
+# columns rather than things: "show the supplier name" describes rows found by another clause
+_ATTRIBUTE_WORDS = {
+    "name", "names", "id", "ids", "price", "prices", "date", "dates", "email", "emails", "address",
+    "addresses", "phone", "status", "category", "categories", "description", "title", "code", "details",
+}
+
+# boundaries, strongest first; " and <verb>" only splits when a new task verb follows
+_NUMBERED = re.compile(r"(?:^|\s)\(?\d{1,2}[.)]\s+")
+_HARD_BOUNDARY = re.compile(r"\s*;\s*|\s*\n+\s*|(?<=[.?!])\s+(?=[A-Z0-9])")
+_SOFT_BOUNDARY = re.compile(
+    r",?\s+(?:and\s+(?:also|then|additionally|separately)|as\s+well\s+as|and|also|plus)\s+(?=(?:" +
+    "|".join(sorted(_TASK_VERBS - {"when", "where", "who", "how", "what", "which"})) + r")\b)",
+    re.I,
+)
+# in a question ("Which region ... and which employee ...?") a second question word starts a new task
+_QUESTION_BOUNDARY = re.compile(r",?\s+and\s+(?=(?:how\s+(?:many|much)|which|what|who)\b)", re.I)
+_QUESTION_WORDS = {"what", "which", "how", "who", "when", "where"}
+
+_MODEL: Optional[Dict[str, float]] = None
+_MODEL_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+# process-wide counts; "local_*" decisions are split calls that never reached Gemini
+STATS: Dict[str, int] = {"local_split": 0, "local_no_split": 0, "uncertain": 0}
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def split_clauses(question: str) -> List[str]:
+    # candidate independent clauses, in order; a single-intent question comes back as one clause
+    text = (question or "").strip()
+    if not text:
+        return []
+    pieces = [p for p in _NUMBERED.split(text) if p.strip()]
+    clauses: List[str] = []
+    for piece in pieces:
+        for hard in _HARD_BOUNDARY.split(piece):
+            for soft in _SOFT_BOUNDARY.split(hard):
+                if _words(soft)[:1] and _words(soft)[0] in _QUESTION_WORDS:
+                    clauses.extend(_QUESTION_BOUNDARY.split(soft))
+                else:
+                    clauses.append(soft)
+    out = []
+    for c in clauses:
+        c = (c or "").strip(" ,.;:\t\r\n")
+        if len(_words(c)) >= 2:
+            out.append(c)
+        elif out and c:
+            out[-1] = f"{out[-1]} {c}"
+    return out or [text]
+
+
+def is_complex_request(user_request: str, length_threshold: int = 350) -> bool:
+    # the original keyword heuristic; every question it flags used to pay a Gemini split call
+    if not user_request or not isinstance(user_request, str):
+        return False
+    if len(user_request) > length_threshold:
+        return True
+    low = user_request.lower()
+    strong_tokens = [";", " vs ", " compare ", " and also "]
+    weak_tokens = [" and ", " each ", " per "]
+    strong_hits = sum(1 for t in strong_tokens if t in low)
+    weak_hits = sum(1 for t in weak_tokens if t in low)
+    return strong_hits >= 1 or weak_hits >= 2
+
+
+def _has_task(clause: str) -> bool:
+    return any(w in _TASK_VERBS for w in _words(clause)[:6])
+
+
+def stands_alone(clause: str) -> bool:
+    # False for a later clause that only makes sense on top of an earlier one:
+    # "... and show the supplier name", "... and list their orders"
+    words = _words(clause)
+    verb = next((i for i, w in enumerate(words) if w in _TASK_VERBS), -1)
+    rest = [w for w in words[verb + 1:] if w not in ("me", "us")]
+    if not rest or any(w in _DEPENDENT for w in rest[:3]):
+        return False
+    if any(w in _SCOPE_WORDS or w.isdigit() for w in rest):
+        return True
+    return rest[0] != "the" and rest[-1] not in _ATTRIBUTE_WORDS
+
+
+def extract_features(question: str) -> Dict[str, float]:
+    text = question or ""
+    low = f" {text.lower()} "
+    clauses = split_clauses(text)
+    task_clauses = sum(1 for c in clauses if _has_task(c))
+    dependent = sum(1 for c in clauses[1:] if any(w in _DEPENDENT for w in _words(c)[:4]))
+    return {
+        "bias": 1.0,
+        "extra_tasks": float(min(max(task_clauses - 1, 0), 4)),
+        "extra_clauses": float(min(max(len(clauses) - 1, 0), 4)),
+        "semicolons": float(min(text.count(";"), 3)),
+        "numbered_items": 1.0 if len(_NUMBERED.findall(text)) >= 2 else 0.0,
+        "also": float(min(sum(low.count(t) for t in (" also ", " as well as ", " additionally ", " in addition ")), 2)),
+        "comparison": 1.0 if re.search(r"\b(vs\.?|versus|compare[sd]?)\b", low) else 0.0,
+        "dependent_refs": float(min(dependent, 2)),
+        "leading_scope": 1.0 if re.match(r"\s*(?:\d+[.)]\s*)?(for\s+(each|every|all)|per)\b", text, re.I) else 0.0,
+        "grouping": float(min(len(re.findall(r"\b(per|each|by)\b", low)), 3)),
+        "length": min(len(text) / 400.0, 2.0),
+        "ands": float(min(low.count(" and "), 5)),
+    }
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def _score(weights: Dict[str, float], features: Dict[str, float]) -> float:
+    return _sigmoid(sum(weights.get(k, 0.0) * v for k, v in features.items()))
+
+
+def get_model() -> Dict[str, float]:
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                weights = dict(DEFAULT_WEIGHTS)
+                if SPLIT_CLASSIFIER_WEIGHTS and os.path.exists(SPLIT_CLASSIFIER_WEIGHTS):
+                    try:
+                        with open(SPLIT_CLASSIFIER_WEIGHTS, "r", encoding="utf-8") as f:
+                            data = json.load(f)
+                        weights.update({k: float(v) for k, v in data.get("weights", {}).items()})
+                    except (OSError, ValueError, AttributeError):
+                        pass
+                _MODEL = weights
+    return _MODEL
+
+
+def set_model(weights: Dict[str, float]) -> None:
+    global _MODEL
+    with _MODEL_LOCK:
+        _MODEL = dict(weights)
+
+
+def classify(question: str,
+             max_parts: int = 5,
+             weights: Optional[Dict[str, float]] = None,
+             record: bool = True) -> Dict[str, Any]:
+    # {"decision": "split" | "no_split" | "uncertain", "probability", "parts"}
+    probability = _score(weights or get_model(), extract_features(question))
+    parts = split_clauses(question)
+    if probability >= SPLIT_CLASSIFIER_HIGH and len(parts) > 1 and all(stands_alone(p) for p in parts[1:]):
+        decision = "split"
+    elif probability <= SPLIT_CLASSIFIER_LOW or not is_complex_request(question):
+        # an uncertain question the old heuristic would not have split either stays one
+        # query, so the classifier never makes a split call the heuristic did not
+        decision = "no_split"
+        parts = [question]
+    else:
+        # includes likely splits whose later clause leans on an earlier one - the LLM decides
+        decision = "uncertain"
+        parts = []
+    if record:
+        with _STATS_LOCK:
+            STATS[{"split": "local_split", "no_split": "local_no_split"}.get(decision, "uncertain")] += 1
+    return {"decision": decision, "probability": round(probability, 3), "parts": parts[:max_parts]}
+
+
+def split_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = dict(STATS)
+    out["split_calls_saved"] = STATS["local_split"] + STATS["local_no_split"]
+    return out
+
+
+def train(examples: List[Tuple[str, bool]],
+          init: Optional[Dict[str, float]] = None,
+          epochs: int = 300,
+          lr: float = 0.1,
+          l2: float = 1.0) -> Dict[str, float]:
+    # batch gradient descent on log-loss; L2 pulls towards `init`, so a handful of
+    # history entries nudges the hand-set weights instead of replacing them
+    prior = dict(init or DEFAULT_WEIGHTS)
+    weights = dict(prior)
+    data = [(extract_features(q), 1.0 if label else 0.0) for q, label in examples if q]
+    if not data:
+        return weights
+    for _ in range(epochs):
+        grad = {k: 0.0 for k in weights}
+        for feats, y in data:
+            err = _score(weights, feats) - y
+            for k, v in feats.items():
+                grad[k] = grad.get(k, 0.0) + err * v
+        for k in weights:
+            weights[k] -= lr * (grad.get(k, 0.0) / len(data) + l2 * (weights[k] - prior[k]))
+    return weights
+
+
+def examples_from_history(path: str) -> List[Tuple[str, bool]]:
+    # query_history.json labels: a hand-set "split_label" wins; otherwise only entries whose
+    # split was decided by the LLM splitter (split_source "llm"). Entries decided by this
+    # classifier or by the old heuristic would only teach it its own mistakes, so they are skipped
+    with open(path, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    examples = []
+    for h in history:
+        if not isinstance(h, dict) or not h.get("question"):
+            continue
+        if "split_label" in h:
+            examples.append((h["question"], bool(h["split_label"])))
+        elif h.get("split_source") == "llm":
+            examples.append((h["question"], bool(h.get("is_complex"))))
+    return examples
+
+
+def save_model(weights: Dict[str, float], path: str = SPLIT_CLASSIFIER_WEIGHTS, n_examples: int = 0) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"weights": weights, "examples": n_examples}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def evaluate(examples: List[Tuple[str, bool]], weights: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    # precision / recall of local decisions for the "split" class; uncertain = deferred to the LLM
+    tp = fp = fn = tn = uncertain = 0
+    for question, label in examples:
+        decision = classify(question, weights=weights, record=False)["decision"]
+        if decision == "uncertain":
+            uncertain += 1
+        elif decision == "split":
+            tp, fp = (tp + 1, fp) if label else (tp, fp + 1)
+        else:
+            fn, tn = (fn + 1, tn) if label else (fn, tn + 1)
+    decided = tp + fp + fn + tn
+    return {
+        "examples": len(examples),
+        "decided_locally": decided,
+        "uncertain": uncertain,
+        "coverage": round(decided / len(examples), 3) if examples else 0.0,
+        "accuracy": round((tp + tn) / decided, 3) if decided else 0.0,
+        "precision": round(tp / (tp + fp), 3) if tp + fp else 0.0,
+        "recall": round(tp / (tp + fn), 3) if tp + fn else 0.0,
+        "confusion": {"tp": tp, "fp": fp, "fn": fn, "tn": tn},
+    }
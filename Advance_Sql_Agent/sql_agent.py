@@ -1,92 +1,188 @@
-import json
 import re
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any, Tuple, List
 
-import google.genai as genai
-
 from sql_tools import (
     sql_db_list_tables,
     sql_db_schema,
     sql_db_query_checker,
     sql_db_query,
-    get_tool_docs_text,
+    get_schema_snapshot,
+    SQL_CHECKER_BACKENDS,
+    asql_db_query_checker,
+    sql_db_query_checker_batch,
+    asql_db_query_checker_batch,
+    run_in_db_pool,
 )
+from schema_index import prune_schema
+from llm_client import generate, agenerate, generate_json, agenerate_json
+from llm_retry import LLMDeadlineExceeded
+from question_cache import lookup_question, store_question, forget_question
+from sql_rewriter import rewrite_tsql
+from request_context import RequestContext, request_scope, arequest_scope
+from split_classifier import SPLIT_CLASSIFIER, classify as classify_split, is_complex_request
+from json_extract import extract_json
+from prompt_builder import build_prompt, encode_schema
+import llm_stages
 
 
-tool_docs_text = get_tool_docs_text()
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# how many sub-requests of a complex request are generated / validated / executed at once
+COMPLEX_MAX_CONCURRENCY = int(os.getenv("COMPLEX_MAX_CONCURRENCY", "4"))
+# one Gemini call splits a complex request and drafts SQL for every part
+COMBINED_SPLIT_GENERATE = os.getenv("COMBINED_SPLIT_GENERATE", "0") == "1"
 
 
 
-def process_user_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5) -> Dict[str, Any]:
+def process_user_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5,
+                         max_concurrency: Optional[int] = None,
+                         ctx: Optional[RequestContext] = None,
+                         combined: Optional[bool] = None) -> Dict[str, Any]:
     if not user_request or not isinstance(user_request, str) or not user_request.strip():
         return {"error": "Empty user request."}
 
-    if not is_complex_request(user_request):
-        return nl_to_sql(user_request, execute=execute, limit=limit)
+    started = time.perf_counter()
+    with request_scope(ctx) as ctx:
+        # a cached answer skips splitting as well as generation
+        result = _from_question_cache(user_request, ctx.schema_version, execute, limit, ctx)
+        if result is None:
+            decision = _split_decision(user_request, max_parts)
+            try:
+                if decision["decision"] == "no_split":
+                    result = nl_to_sql(user_request, execute=execute, limit=limit, ctx=ctx)
+                else:
+                    result = handle_complex_request(user_request, execute=execute, limit=limit,
+                                                    max_parts=max_parts, max_concurrency=max_concurrency,
+                                                    ctx=ctx, split_decision=decision, combined=combined)
+            except LLMDeadlineExceeded as e:
+                # the split call ran out of time; the repair loop reports its own timeouts
+                result = _deadline_result(e, [])
+            result.setdefault("split_decision", decision)
+        result["request_stats"] = ctx.stats()
+    llm_stages.record(llm_stages.REQUEST_STAGE, (time.perf_counter() - started) * 1000, "Error" not in result)
+    return result
 
-    return handle_complex_request(user_request, execute=execute, limit=limit, max_parts=max_parts)
 
+async def aprocess_user_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5,
+                                max_concurrency: Optional[int] = None,
+                                ctx: Optional[RequestContext] = None,
+                                combined: Optional[bool] = None) -> Dict[str, Any]:
+    # async twin of process_user_request: Gemini calls are awaited, DB work runs in the DB pool
+    if not user_request or not isinstance(user_request, str) or not user_request.strip():
+        return {"error": "Empty user request."}
 
+    started = time.perf_counter()
+    async with arequest_scope(ctx) as ctx:
+        result = await run_in_db_pool(_from_question_cache, user_request, ctx.schema_version, execute, limit, ctx)
+        if result is None:
+            decision = _split_decision(user_request, max_parts)
+            try:
+                if decision["decision"] == "no_split":
+                    result = await anl_to_sql(user_request, execute=execute, limit=limit, ctx=ctx)
+                else:
+                    result = await ahandle_complex_request(user_request, execute=execute, limit=limit,
+                                                           max_parts=max_parts, max_concurrency=max_concurrency,
+                                                           ctx=ctx, split_decision=decision, combined=combined)
+            except LLMDeadlineExceeded as e:
+                result = _deadline_result(e, [])
+            result.setdefault("split_decision", decision)
+        result["request_stats"] = ctx.stats()
+    llm_stages.record(llm_stages.REQUEST_STAGE, (time.perf_counter() - started) * 1000, "Error" not in result)
+    return result
 
-def _call_gemini(prompt: str) -> str:
-    client = genai.Client(api_key=GOOGLE_API_KEY)
-    resp = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt,
-    )
-    return getattr(resp, "text", str(resp))
-
-
-
-def _get_schema_mapping() -> Dict[str, list]:
-    tables_resp = sql_db_list_tables()
-    tables = tables_resp.get("tables", []) if isinstance(tables_resp, dict) else tables_resp
-    if not isinstance(tables, list):
-        tables = []
-    tables_str = ",".join(tables)
-    schema_full = sql_db_schema(tables_str)
-    # normalize to table -> [colnames]
-    out = {}
-    for t, cols in schema_full.items():
-        if isinstance(cols, list):
-            out[t] = [c["name"] for c in cols]
-        else:
-            out[t] = []
-    return out
 
 
-def extract_json_from_text(text: str) -> Optional[dict]:
-    if not text:
-        return None
-    start = text.find("{")
-    while start != -1:
-        stack = []
-        for i in range(start, len(text)):
-            ch = text[i]
-            if ch == "{":
-                stack.append("{")
-            elif ch == "}":
-                if stack:
-                    stack.pop()
-                if not stack:
-                    candidate = text[start:i + 1]
-                    try:
-                        return json.loads(candidate)
-                    except json.JSONDecodeError:
-                        break
-        start = text.find("{", start + 1)
-
-    m = re.search(r"\{.*?\}", text, re.S)
-    if m:
-        try:
-            return json.loads(m.group(0))
-        except Exception:
-            return None
-    return None
+def _call_gemini(prompt: str, use_cache: bool = True, ctx: Optional[RequestContext] = None,
+                 stage: Optional[str] = None) -> str:
+    # shared, process-wide client (see llm_client); identical prompts are served from llm_cache;
+    # `stage` (llm_stages.STAGES) picks that stage's model and labels its latency; with a ctx the
+    # call (retries included) must finish before the request deadline (llm_retry)
+    if ctx is None:
+        return generate(prompt, use_cache=use_cache, stage=stage)
+    ctx.count("llm_calls")
+    with ctx.timed(stage):
+        return generate(prompt, use_cache=use_cache, client=ctx.get_client, stage=stage, deadline=ctx.deadline)
+
+
+async def _acall_gemini(prompt: str, use_cache: bool = True, ctx: Optional[RequestContext] = None,
+                        stage: Optional[str] = None) -> str:
+    if ctx is None:
+        return await agenerate(prompt, use_cache=use_cache, stage=stage)
+    ctx.count("llm_calls")
+    with ctx.timed(stage):
+        return await agenerate(prompt, use_cache=use_cache, client=ctx.get_client, stage=stage,
+                               deadline=ctx.deadline)
+
+
+# response schemas for the JSON prompts; with structured output Gemini returns these
+# objects directly and text scraping (json_extract) is only the fallback
+GENERATION_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    # null = "cannot produce / fix a query", as the generation and repair prompts ask for
+    "properties": {"sql": {"type": "STRING", "nullable": True}, "notes": {"type": "STRING", "nullable": True}},
+    "required": ["sql"],
+}
+SPLIT_SCHEMA: Dict[str, Any] = {"type": "ARRAY", "items": {"type": "STRING"}}
+SPLIT_GENERATE_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "parts": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "sub_request": {"type": "STRING"},
+                    "sql": {"type": "STRING", "nullable": True},
+                    "notes": {"type": "STRING", "nullable": True},
+                },
+                "required": ["sub_request", "sql"],
+            },
+        },
+    },
+    "required": ["parts"],
+}
+
+
+def _call_gemini_json(prompt: str, schema: Dict[str, Any], use_cache: bool = True,
+                      ctx: Optional[RequestContext] = None, stage: Optional[str] = None) -> Dict[str, Any]:
+    # {"value", "text", "structured"} - see llm_client.generate_json
+    if ctx is None:
+        return generate_json(prompt, schema, use_cache=use_cache, stage=stage)
+    ctx.count("llm_calls")
+    with ctx.timed(stage):
+        reply = generate_json(prompt, schema, use_cache=use_cache, client=ctx.get_client, stage=stage,
+                              deadline=ctx.deadline)
+    return ctx.note_reply(reply)
+
+
+async def _acall_gemini_json(prompt: str, schema: Dict[str, Any], use_cache: bool = True,
+                             ctx: Optional[RequestContext] = None, stage: Optional[str] = None) -> Dict[str, Any]:
+    if ctx is None:
+        return await agenerate_json(prompt, schema, use_cache=use_cache, stage=stage)
+    ctx.count("llm_calls")
+    with ctx.timed(stage):
+        reply = await agenerate_json(prompt, schema, use_cache=use_cache, client=ctx.get_client, stage=stage,
+                                     deadline=ctx.deadline)
+    return ctx.note_reply(reply)
+
+
+
+def _get_schema_mapping(user_request: Optional[str] = None, ctx: Optional[RequestContext] = None) -> Dict[str, list]:
+    # table -> [colnames], served from the request's (or the process-wide) schema snapshot;
+    # with a request, only the relevant tables (plus their FK neighbours) are kept
+    snapshot = ctx.snapshot if ctx is not None else get_schema_snapshot()
+    if user_request:
+        return prune_schema(snapshot, user_request)
+    return snapshot.mapping()
+
+
+def extract_json_from_text(text: str, expect: Optional[type] = None) -> Any:
+    # first JSON object/array in a model response (see json_extract); `expect` = dict or list
+    return extract_json(text, expect)
 
 
 #Basic static safety checks
@@ -111,9 +207,13 @@ def _basic_execute_safety(sql: str) -> Tuple[bool, Optional[str]]:
     return True, None
 
 
-def run_checked_query(candidate_sql: str, execute: bool = False, limit: int = 5) -> Dict[str, Any]:
+def run_checked_query(candidate_sql: str, execute: bool = False, limit: int = 5,
+                      ctx: Optional[RequestContext] = None) -> Dict[str, Any]:
     result: Dict[str, Any] = {"original_sql": candidate_sql}
-    checker_out = sql_db_query_checker(candidate_sql)
+    candidate_sql, rewrites = rewrite_tsql(candidate_sql, ctx.snapshot if ctx is not None else get_schema_snapshot())
+    if rewrites:
+        result["rewrites"] = rewrites
+    checker_out = sql_db_query_checker(candidate_sql, ctx=ctx)
     result["checker"] = checker_out
     validated_sql = candidate_sql
     if isinstance(checker_out, dict) and checker_out.get("fixed_sql"):
@@ -123,30 +223,43 @@ def run_checked_query(candidate_sql: str, execute: bool = False, limit: int = 5)
 
     if not (isinstance(checker_out, dict) and checker_out.get("valid", False)):
         if not checker_out.get("fixed_sql"):
+            result["llm_calls"] = _checker_llm_calls(result)
             result["execution"] = {"skipped": True, "reason": "Query invalid according to checker; no fixed_sql provided."}
             return result
         
     if validated_sql != candidate_sql:
-        checker_fixed = sql_db_query_checker(validated_sql)
+        # re-check the fix with the deterministic backends only; when they cannot decide,
+        # the checker's own fix is trusted instead of paying for another LLM validation
+        checker_fixed = sql_db_query_checker(validated_sql, backends=_deterministic_backends(), ctx=ctx)
         result["checker_fixed_sql_validation"] = checker_fixed
-        if not (isinstance(checker_fixed, dict) and checker_fixed.get("valid", False)):
+        if isinstance(checker_fixed, dict) and checker_fixed.get("valid") is False and not _undecided(checker_fixed):
+            result["llm_calls"] = _checker_llm_calls(result)
             result["execution"] = {"skipped": True, "reason": "Checker's fixed_sql failed validation."}
             return result
-        validated_sql = checker_fixed.get("fixed_sql") or validated_sql
 
     safe, reason = _basic_execute_safety(validated_sql)
     if not safe:
+        result["llm_calls"] = _checker_llm_calls(result)
         result["execution"] = {"skipped": True, "reason": reason}
         return result
     
     if execute:
-        exec_out = sql_db_query(validated_sql, limit=limit)
+        exec_out = sql_db_query(validated_sql, limit=limit, ctx=ctx)
         result["execution"] = exec_out
     else:
         result["execution"] = {"skipped": True, "reason": "Execution not requested.", "sql_to_execute": validated_sql}
+    result["llm_calls"] = _checker_llm_calls(result)
     return result
 
 
+def _checker_llm_calls(result: Dict[str, Any]) -> Dict[str, int]:
+    checks = sum(
+        1 for key in ("checker", "checker_fixed_sql_validation")
+        if isinstance(result.get(key), dict) and result[key].get("source") == "llm"
+    )
+    return {"check": checks, "total": checks}
+
+
 
 
 
@@ -157,7 +270,8 @@ def _finalize_result(generated_sql: str,
                      raw_model_responses: List[str],
                      attempts_info: List[Dict[str, Any]],
                      execute: bool,
-                     limit: int) -> Dict[str, Any]:
+                     limit: int,
+                     ctx: Optional[RequestContext] = None) -> Dict[str, Any]:
     result: Dict[str, Any] = {
         "generated_sql": generated_sql,
         "validated_sql": validated_sql,
@@ -173,7 +287,7 @@ def _finalize_result(generated_sql: str,
             result["execution"] = {"error": f"Execution blocked: {reason}", "validated_sql": validated_sql}
             return result
 
-        exec_out = sql_db_query(validated_sql, limit=limit)
+        exec_out = sql_db_query(validated_sql, limit=limit, ctx=ctx)
         result["execution"] = exec_out
 
     return result
@@ -182,324 +296,528 @@ def _finalize_result(generated_sql: str,
 
 
 
-def nl_to_sql(user_request: str, execute: bool = False, limit: int = 5) -> Dict[str, Any]:
-    schema = _get_schema_mapping()
-    attempts_info: List[Dict[str, Any]] = []
-    raw_model_responses: List[str] = []
-
-    gen_prompt_template = f"""
-    You are an expert SQL assistant with deep knowledge of Microsoft SQL Server. Your job is to generate 
-    only valid and fully correct T-SQL queries. Always follow official SQL Server syntax and avoid using 
-    any syntax or functions from MySQL, PostgreSQL, SQLite, or any other SQL dialect. Use only the exact 
-    table names and column names provided in the schema, without guessing or inventing new fields. Your 
-    output must be strictly valid T-SQL and should never include unsupported keywords such as LIMIT, USING, 
-    ILIKE, or double-quoted identifiers. Every query you produce must be syntactically correct, semantically 
-    accurate, safe to execute, and fully compatible with SQL Server
-
-    TOOLS:
-    {tool_docs_text}
-
-    Strict rules:
-     - Use ONLY SQL Server syntax (T-SQL). Do NOT use LIMIT, backticks, "::type", ILIKE, or other non-T-SQL features.
-     - Use GETDATE(), DATEADD(), FORMAT(...,'yyyy-MM'), EOMONTH(), YEAR(), MONTH() where needed.
-     - Use TOP instead of LIMIT.
-     - Use exact table/column names from the schema below.
-
-    SCHEMA:
-    {json.dumps(schema, indent=2)}
-
-
-    EXAMPLES OF CORRECT T-SQL (You SHOULD imitate these)
-    Natural language:
-    "List top 10 customers by total spending."
-
-    Correct T-SQL:
-    SELECT TOP (10) c.CustomerID, c.Name, SUM(o.TotalAmount) AS TotalSpending
-    FROM Customers c
-    JOIN Orders o ON c.CustomerID = o.CustomerID
-    GROUP BY c.CustomerID, c.Name
-    ORDER BY TotalSpending DESC;
-
-
-    Natural language:
-    "Show monthly sales for 2023."
-
-    Correct T-SQL:
-    SELECT FORMAT(OrderDate, 'yyyy-MM') AS YearMonth, SUM(TotalAmount) AS MonthlySales
-    FROM Orders
-    WHERE YEAR(OrderDate) = 2023
-    GROUP BY FORMAT(OrderDate, 'yyyy-MM')
-    ORDER BY YearMonth;
-
-    Natural language:
-    "Find all employees hired in the last 90 days."
-
-    Correct T-SQL:
-    SELECT EmployeeID, FirstName, LastName, HireDate
-    FROM Employees
-    WHERE HireDate >= DATEADD(DAY, -90, CAST(GETDATE() AS DATE));
-
-
-    EXAMPLES OF INCORRECT SQL (NEVER DO THIS)
-
-    Using LIMIT:
-    SELECT * FROM Orders LIMIT 10;
-
-    Using ILIKE:
-    SELECT * FROM Customers WHERE Name ILIKE '%john%';
-
-    Using double quotes for identifiers:
-    SELECT "CustomerID" FROM "Orders";
-
-    Using USING join:
-    SELECT * FROM Orders JOIN Customers USING (CustomerID);
-
-    Inventing columns:
-    SELECT FakeColumn FROM Orders;
-
-
-    LOGIC RULES YOU MUST APPLY BEFORE GENERATING SQL
-    1. Identify the correct table(s) from the schema.
-    2. Identify join keys from the schema (never guess).
-    3. Use GROUP BY whenever aggregation is used.
-    4. Use WHERE for filtering.
-    5. Use ORDER BY for ranking.
-    6. Use TOP (n) for limiting results.
-    7. If necessary information is missing, make a reasonable assumption and note it.
-
-
-    USER REQUEST:
-    {user_request}
-
-    Return ONLY valid JSON (no surrounding text) with keys:
-    {{
-    "sql": "<SQL query only — NO comments, NO explanations, NO text outside the pure SQL. or NULL>",
-    "notes": "<short explanation or assumptions>",
-    "parameters": null
-    }}
-    """
-
-    repair_prompt_template = """
-    You previously generated the SQL query shown below, but that query did not pass the validation checks. 
-    This means the SQL contained one or more issues such as incorrect or non-existent table names, invalid 
-    column references, unsupported or non-T-SQL functions, syntactical mistakes, unsafe keywords, improper 
-    JOIN logic, or any other structure that is incompatible with Microsoft SQL Server (T-SQL). Your task now 
-    is to thoroughly review the previously generated query, identify all the reasons it failed, and produce a
-    corrected version that fully satisfies SQL Server standards. The corrected SQL must use only valid T-SQL
-    syntax, adhere strictly to the schema provided to you, maintain read-only behavior, and avoid any 
-    MySQL/Postgres/SQLite constructs such as LIMIT, backticks (`table`), ILIKE, USING joins, "::type" casts,
-    or date functions not supported by T-SQL. You must ensure all table and column names exactly match the 
-    schema, avoid any unsafe operations, and rewrite the logic if necessary to achieve syntactic and semantic 
-    correctness. Return only properly structured JSON containing the following keys: 
-
-    INVALID_SQL:
-    {invalid_sql}
-
-    VALIDATION_MESSAGE:
-    {validation_message}
-
-    USER REQUEST:
-    {user_request}
-
-    SCHEMA:
-    {schema}
-
-
-    STRICT RULES (YOU MUST FOLLOW)
-    - Use ONLY SQL Server syntax (T-SQL).
-    - Use TOP (n), never LIMIT.
-    - Do NOT use backticks, double-quoted identifiers, or "::type" casts.
-    - Do NOT use ILIKE or USING joins.
-    - Do NOT invent table names or columns not in the schema.
-    - Always include GROUP BY when required.
-    - Maintain read-only behavior (no INSERT/UPDATE/DELETE).
-    - Ensure joins use explicit ON conditions.
-    - Ensure all table/column names match schema exactly (case-insensitive but spelling must match).
+# Generation -> validation -> repair, as an explicit state machine.
+# GENERATE asks the model (first prompt, then repair prompts); VALIDATE runs the
+# checker on the generated SQL; VALIDATE_FIX re-checks an LLM-proposed fixed_sql
+# with the deterministic backends only. Validation results are memoised per SQL
+# string, so a repeated candidate never costs a second checker call.
+_GENERATE = "generate"
+_VALIDATE = "validate"
+_VALIDATE_FIX = "validate_fix"
+_DONE = "done"
+_FAILED = "failed"
+
+
+def _deterministic_backends() -> List[str]:
+    return [b for b in SQL_CHECKER_BACKENDS if b != "llm"]
+
+
+def _undecided(checker_out: Dict[str, Any]) -> bool:
+    # sql_db_query_checker's "no backend could decide" verdict (valid False, source "none")
+    return isinstance(checker_out, dict) and checker_out.get("source") == "none"
+
+
+class _SqlRepairLoop:
+    # gen_prompt and build_repair_prompt(sql, message) give (prompt, prompt_stats)
+    def __init__(self, gen_prompt: Tuple[str, Dict[str, Any]], build_repair_prompt, max_attempts: int = 3,
+                 ctx: Optional[RequestContext] = None):
+        self.gen_prompt = gen_prompt
+        self.ctx = ctx
+        self.snapshot = ctx.snapshot if ctx is not None else get_schema_snapshot()
+        self.build_repair_prompt = build_repair_prompt
+        self.max_attempts = max_attempts
+        # per request: every part of a complex request shares the context's memo
+        self.memo = ctx.validation_memo if ctx is not None else {}
+        self.state = _GENERATE
+        self.attempt = 0
+        self.candidate_sql: Optional[str] = None
+        self.candidate_notes: Optional[str] = None
+        self.validated_sql: Optional[str] = None
+        self.last_checker: Dict[str, Any] = {}
+        self._llm_checker: Dict[str, Any] = {}
+        self.attempts_info: List[Dict[str, Any]] = []
+        self.raw_model_responses: List[str] = []
+        self.llm_calls = {"generate": 0, "repair": 0, "check": 0}
+        # generation replies that came back schema-typed / that held no usable JSON
+        # (each parse failure burns an attempt on a repair prompt)
+        self.structured_responses = 0
+        self.parse_failures = 0
+        self.prompt_stats: List[Dict[str, Any]] = []
+        self.checker_calls = 0
+        self.memo_hits = 0
+        # set when the request deadline cut the loop short (LLMDeadlineExceeded)
+        self.timed_out: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (_DONE, _FAILED)
+
+    @property
+    def llm_stage(self) -> str:
+        # the first prompt is generation, every later one a repair (llm_stages model / SLO)
+        return "generate" if self.attempt == 0 else "repair"
+
+    # GENERATE
+    def next_prompt(self) -> Tuple[str, bool]:
+        # (prompt, use_cache); a repeated repair prompt means the cached answer already failed
+        if self.attempt == 0:
+            prompt, stats = self.gen_prompt
+        else:
+            message = self.last_checker.get("message", "No message") if isinstance(self.last_checker, dict) else "No message"
+            prompt, stats = self.build_repair_prompt(self.candidate_sql, message)
+        self.prompt_stats.append(stats)
+        if self.ctx is not None:
+            self.ctx.count("prompt_tokens", stats["total_tokens"])
+        return prompt, self.attempt == 0
+
+    def on_model_response(self, reply: Dict[str, Any]) -> None:
+        # reply from generate_json against GENERATION_SCHEMA
+        self.attempt += 1
+        self.llm_calls["generate" if self.attempt == 1 else "repair"] += 1
+        self.raw_model_responses.append(reply["text"])
+        self.structured_responses += 1 if reply["structured"] else 0
+
+        parsed = reply["value"]
+        if not isinstance(parsed, dict):
+            self.parse_failures += 1
+            parsed = None
+        gen_sql = parsed.get("sql") if parsed else None
+        gen_notes = parsed.get("notes") if parsed else None
+        self._on_candidate(gen_sql, gen_notes)
+        self.attempts_info[-1]["structured"] = reply["structured"]
 
-    
-    EXAMPLES — How to repair queries
+    def seed(self, sql: str, notes: Optional[str] = None, source: str = "split_generate") -> None:
+        # start from SQL drafted elsewhere (the combined split+generate call) as attempt 1
+        self.attempt += 1
+        self._on_candidate(sql, notes, source)
 
-    Example 1 — Incorrect identifier quoting  
-     Wrong:
-    SELECT "id", "name" FROM Customers LIMIT 10;
+    def _on_candidate(self, gen_sql: Optional[str], gen_notes: Optional[str], source: str = "generate") -> None:
+        # mechanical dialect fixes (LIMIT, ILIKE, quoting, casts, USING) before any checker/repair
+        rewrites: List[str] = []
+        if gen_sql:
+            gen_sql, rewrites = rewrite_tsql(gen_sql, self.snapshot)
 
-    Correct T-SQL:
-    SELECT TOP (10) id, name
-    FROM Customers;
+        self.attempts_info.append({
+            "attempt": self.attempt,
+            "source": source if self.attempt == 1 else "repair",
+            "generated_sql": gen_sql,
+            "notes": gen_notes,
+            "rewrites": rewrites,
+            "checker": None,
+        })
+        self.candidate_sql = gen_sql
+        self.candidate_notes = gen_notes
+        if gen_sql:
+            self.state = _VALIDATE
+        else:
+            self._rejected({"valid": False, "message": "No SQL produced", "fixed_sql": None})
+
+    # VALIDATE / VALIDATE_FIX
+    def pending_validation(self) -> Tuple[str, Optional[List[str]]]:
+        # (sql, backends); None = the configured default chain
+        if self.state == _VALIDATE_FIX:
+            return self.candidate_sql, _deterministic_backends()
+        return self.candidate_sql, None
+
+    def memoised(self, sql: str) -> Optional[Dict[str, Any]]:
+        out = self.memo.get((sql, self.state))
+        if out is None and self.state == _VALIDATE_FIX:
+            # a full-chain verdict is at least as good as a deterministic-only one
+            out = self.memo.get((sql, _VALIDATE))
+        if out is not None:
+            self.memo_hits += 1
+        return out
+
+    def on_validated(self, sql: str, checker_out: Dict[str, Any], from_memo: bool = False) -> None:
+        if not isinstance(checker_out, dict):
+            checker_out = {"valid": False, "message": "Checker returned no result.", "fixed_sql": None}
+        if not from_memo:
+            self.checker_calls += 1
+            if checker_out.get("source") == "llm":
+                self.llm_calls["check"] += 1
+            self.memo[(sql, self.state)] = checker_out
+
+        if self.state == _VALIDATE:
+            self.attempts_info[-1]["checker"] = checker_out
+            fixed = checker_out.get("fixed_sql")
+            if fixed and fixed.strip() != sql.strip():
+                self._llm_checker = checker_out
+                self.candidate_sql = checker_out["fixed_sql"]
+                self.candidate_notes = (self.candidate_notes or "") + " | Applied checker-proposed fix."
+                self.attempts_info[-1]["generated_sql"] = self.candidate_sql
+                self.state = _VALIDATE_FIX
+            elif checker_out.get("valid"):
+                self._accept(sql, checker_out)
+            else:
+                self._rejected(checker_out)
+            return
+
+        # VALIDATE_FIX
+        self.attempts_info[-1]["fix_checker"] = checker_out
+        if checker_out.get("valid"):
+            self._accept(sql, checker_out)
+        elif checker_out.get("valid") is None or _undecided(checker_out):
+            # no deterministic backend could decide: trust the checker's own fix rather
+            # than paying for a second full LLM validation of it
+            trusted = dict(self._llm_checker, valid=True,
+                           message=(self._llm_checker.get("message") or "") + " (checker-proposed fix trusted)")
+            self._accept(sql, trusted)
+        else:
+            self._rejected(checker_out)
+
+    def on_deadline(self, exc: Exception) -> None:
+        # no time left for another model or checker call: stop with what we have
+        self.timed_out = str(exc)
+        self.state = _FAILED
+
+    def _accept(self, sql: str, checker_out: Dict[str, Any]) -> None:
+        self.validated_sql = sql
+        self.last_checker = checker_out
+        self.state = _DONE
+
+    def _rejected(self, checker_out: Dict[str, Any]) -> None:
+        self.last_checker = checker_out
+        if self.attempts_info and self.attempts_info[-1].get("checker") is None:
+            self.attempts_info[-1]["checker"] = checker_out
+        self.state = _GENERATE if self.attempt < self.max_attempts else _FAILED
+
+    def llm_call_summary(self) -> Dict[str, int]:
+        out = dict(self.llm_calls)
+        out["total"] = sum(self.llm_calls.values())
+        out["checker_calls"] = self.checker_calls
+        out["validation_memo_hits"] = self.memo_hits
+        out["structured_responses"] = self.structured_responses
+        out["parse_failures"] = self.parse_failures
+        return out
+
+
+def _run_repair_loop(loop: _SqlRepairLoop) -> _SqlRepairLoop:
+    while not loop.finished:
+        try:
+            _repair_step(loop)
+        except LLMDeadlineExceeded as e:
+            loop.on_deadline(e)
+    return loop
+
+
+def _repair_step(loop: _SqlRepairLoop) -> None:
+    if loop.state == _GENERATE:
+        prompt, use_cache = loop.next_prompt()
+        loop.on_model_response(_call_gemini_json(prompt, GENERATION_SCHEMA, use_cache=use_cache,
+                                                 ctx=loop.ctx, stage=loop.llm_stage))
+        return
+    sql, backends = loop.pending_validation()
+    cached = loop.memoised(sql)
+    if cached is not None:
+        loop.on_validated(sql, cached, from_memo=True)
+    else:
+        loop.on_validated(sql, sql_db_query_checker(sql, backends=backends, ctx=loop.ctx))
 
 
-    Example 2 — Wrong join syntax  
-        Wrong:
-        SELECT * FROM Orders JOIN Customers USING (CustomerID);
+async def _arun_repair_loop(loop: _SqlRepairLoop) -> _SqlRepairLoop:
+    # same transitions as _run_repair_loop; only the I/O is awaited
+    while not loop.finished:
+        try:
+            await _arepair_step(loop)
+        except LLMDeadlineExceeded as e:
+            loop.on_deadline(e)
+    return loop
+
+
+async def _arepair_step(loop: _SqlRepairLoop) -> None:
+    if loop.state == _GENERATE:
+        prompt, use_cache = loop.next_prompt()
+        loop.on_model_response(
+            await _acall_gemini_json(prompt, GENERATION_SCHEMA, use_cache=use_cache,
+                                     ctx=loop.ctx, stage=loop.llm_stage))
+        return
+    sql, backends = loop.pending_validation()
+    cached = loop.memoised(sql)
+    if cached is not None:
+        loop.on_validated(sql, cached, from_memo=True)
+    else:
+        loop.on_validated(sql, await asql_db_query_checker(sql, backends=backends, ctx=loop.ctx))
 
-    Correct:
-        SELECT o.OrderID, c.CustomerName
-        FROM Orders o
-        JOIN Customers c ON o.CustomerID = c.CustomerID;
 
+def _from_question_cache(user_request: str, schema_version: str, execute: bool, limit: int,
+                         ctx: Optional[RequestContext] = None) -> Optional[Dict[str, Any]]:
+    cached = lookup_question(user_request, schema_version)
+    if not cached:
+        return None
+    result = _finalize_result(
+        generated_sql=cached["validated_sql"],
+        validated_sql=cached["validated_sql"],
+        notes=cached.get("notes"),
+        checker={"valid": True, "message": "Served from question cache.", "fixed_sql": None},
+        raw_model_responses=[],
+        attempts_info=[],
+        execute=execute,
+        limit=limit,
+        ctx=ctx,
+    )
+    if "error" in result.get("execution", {}):
+        # the cached SQL no longer runs (data/permissions changed) - drop it and regenerate
+        forget_question(user_request)
+        return None
+    result["cache_hit"] = True
+    return result
 
-    Example 3 — Invalid or missing GROUP BY  
-        Wrong:
-        SELECT Region, SUM(Sales), CustomerName FROM Sales;
 
-    Correct:
-        SELECT Region, SUM(Sales) AS TotalSales
-        FROM Sales
-        GROUP BY Region;
+def nl_to_sql(user_request: str, execute: bool = False, limit: int = 5,
+              ctx: Optional[RequestContext] = None,
+              initial_sql: Optional[str] = None, initial_notes: Optional[str] = None) -> Dict[str, Any]:
+    # initial_sql: a draft to validate first (and repair if needed) instead of generating one
+    with request_scope(ctx) as ctx:
+        cached = _from_question_cache(user_request, ctx.schema_version, execute, limit, ctx)
+        if cached is not None:
+            return cached
+
+        loop = _build_repair_loop(user_request, ctx)
+        if initial_sql:
+            loop.seed(initial_sql, initial_notes)
+        loop = _run_repair_loop(loop)
+        return _nl_to_sql_result(loop, user_request, execute, limit)
+
+
+async def anl_to_sql(user_request: str, execute: bool = False, limit: int = 5,
+                     ctx: Optional[RequestContext] = None,
+                     initial_sql: Optional[str] = None, initial_notes: Optional[str] = None) -> Dict[str, Any]:
+    async with arequest_scope(ctx) as ctx:
+        cached = await run_in_db_pool(_from_question_cache, user_request, ctx.schema_version, execute, limit, ctx)
+        if cached is not None:
+            return cached
+
+        loop = _build_repair_loop(user_request, ctx)
+        if initial_sql:
+            loop.seed(initial_sql, initial_notes)
+        loop = await _arun_repair_loop(loop)
+        return await run_in_db_pool(_nl_to_sql_result, loop, user_request, execute, limit)
+
+
+def _build_repair_loop(user_request: str, ctx: RequestContext) -> _SqlRepairLoop:
+    # compact prompts (see prompt_builder): static prefix first, Table(cols) schema, token budget
+    schema = _get_schema_mapping(user_request, ctx)
+
+    def build_repair_prompt(invalid_sql: Optional[str], validation_message: str) -> Tuple[str, Dict[str, Any]]:
+        return build_prompt("repair", schema, ctx.snapshot, user_request,
+                            invalid_sql=invalid_sql, validation_message=validation_message)
+
+    return _SqlRepairLoop(build_prompt("generate", schema, ctx.snapshot, user_request),
+                          build_repair_prompt, ctx=ctx)
+
+
+def _nl_to_sql_result(loop: _SqlRepairLoop, user_request: str, execute: bool, limit: int) -> Dict[str, Any]:
+    if loop.state == _DONE:
+        result = _finalize_result(
+            generated_sql=loop.candidate_sql,
+            validated_sql=loop.validated_sql,
+            notes=loop.candidate_notes,
+            checker=loop.last_checker,
+            raw_model_responses=loop.raw_model_responses,
+            attempts_info=loop.attempts_info,
+            execute=execute,
+            limit=limit,
+            ctx=loop.ctx,
+        )
+        result["llm_calls"] = loop.llm_call_summary()
+        result["prompt_stats"] = loop.prompt_stats
+        if "error" not in result.get("execution", {}):
+            store_question(user_request, loop.ctx.schema_version, loop.validated_sql, loop.candidate_notes)
+        return result
 
+    if loop.timed_out:
+        result = _deadline_result(loop.timed_out, loop.attempts_info)
+    else:
+        result = {
+            "Error": f"Failed to produce a valid SQL after {loop.max_attempts} attempts.",
+            "attempts": loop.attempts_info,
+        }
+    result.update({
+        "raw_model_responses": loop.raw_model_responses,
+        "last_checker": loop.last_checker,
+        "llm_calls": loop.llm_call_summary(),
+        "prompt_stats": loop.prompt_stats,
+    })
+    return result
 
-    Example 4 — Non-T-SQL functions  
-        Wrong:
-        SELECT * FROM Orders WHERE OrderDate >= NOW() - INTERVAL '30 days';
 
-    Correct:
-        SELECT *
-        FROM Orders
-        WHERE OrderDate >= DATEADD(DAY, -30, GETDATE());
+def _deadline_result(reason: Any, attempts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # the request deadline ran out mid-pipeline: a normal error result, not an exception
+    return {
+        "Error": f"Timed out before a valid SQL was produced ({len(attempts)} attempt(s) made): {reason}",
+        "timed_out": True,
+        "attempts": attempts,
+    }
 
-        
 
-    THINK CAREFULLY BEFORE PRODUCING THE FINAL SQL
-    1. Read the validation message and identify ALL errors.
-    2. Cross-check table names and columns with the schema.
-    3. Fix joins, filters, grouping, and syntax errors.
-    4. Rebuild the SQL from scratch if needed.
-    5. Ensure the final SQL is syntactically correct T-SQL.
-    6. Provide a short explanation in `notes` of what you fixed.
 
 
-    Your job: produce a corrected Microsoft SQL Server (T-SQL) query that fixes the validation issues above.
-    Rules:
-     - Use only T-SQL syntax.
-     - Use exact table and column names from the provided schema.
-     - Do NOT use LIMIT, backticks, double-quoted identifiers, "::type" casting, ILIKE, or other non-T-SQL features.
-     - If you cannot fix the SQL, return JSON with "sql": null and explain why in "notes".
 
-    ***Return ONLY valid JSON (no surrounding text) with keys***:
-    {{
-     "sql": "<SQL query only — NO comments, NO explanations, NO text outside the pure SQL. or Null>",
-     "notes": "<short explanation of the changes or failure>",
-     "parameters": null
-    }}
-    """
-
-    candidate_sql = None
-    candidate_notes = None
-    last_checker: Dict[str, Any] = {}
+def _split_decision(user_request: str, max_parts: int = 5) -> Dict[str, Any]:
+    # local classifier: only an "uncertain" question pays for the Gemini split call
+    if SPLIT_CLASSIFIER:
+        return classify_split(user_request, max_parts=max_parts)
+    if is_complex_request(user_request):
+        return {"decision": "uncertain", "probability": None, "parts": []}
+    return {"decision": "no_split", "probability": None, "parts": [user_request]}
+
+
+def handle_complex_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5,
+                           max_concurrency: Optional[int] = None,
+                           ctx: Optional[RequestContext] = None,
+                           split_decision: Optional[Dict[str, Any]] = None,
+                           combined: Optional[bool] = None) -> Dict[str, Any]:
+    # one context for the split and every part: one snapshot, client and connection
+    with request_scope(ctx) as ctx:
+        return _handle_complex_request(user_request, execute, limit, max_parts, max_concurrency, ctx,
+                                       split_decision or _split_decision(user_request, max_parts),
+                                       COMBINED_SPLIT_GENERATE if combined is None else combined)
+
+
+def _handle_complex_request(user_request: str, execute: bool, limit: int, max_parts: int,
+                            max_concurrency: Optional[int], ctx: RequestContext,
+                            split_decision: Dict[str, Any], combined: bool) -> Dict[str, Any]:
+    # combined mode: one call drafts every part; each draft is then validated and
+    # only the failing ones go through the per-part repair loop
+    planned = _split_and_generate(user_request, max_parts, ctx, split_decision) if combined else None
+    if planned:
+        drafts_sql = _draft_sqls(planned, ctx)
+        if drafts_sql:
+            _seed_validation_memo(ctx, drafts_sql,
+                                  sql_db_query_checker_batch(drafts_sql, ctx=ctx))
+        sub_requests = [p["sub_request"] for p in planned]
+    elif split_decision["decision"] == "uncertain":
+        sub_requests = _split_request_with_llm(user_request, max_parts=max_parts, ctx=ctx)
+    else:
+        sub_requests = split_decision["parts"] or [user_request]
+    drafts = planned or [{} for _ in sub_requests]
 
-    for attempt in range(1, 4):
-        if attempt == 1:
-            prompt = gen_prompt_template
-        else:
-            invalid_sql_for_prompt = candidate_sql or "<no sql returned>"
-            validation_message = last_checker.get("message", "No message") if isinstance(last_checker, dict) else "No message"
-            prompt = repair_prompt_template.format(
-                invalid_sql=invalid_sql_for_prompt,
-                validation_message=validation_message,
-                user_request=user_request,
-                schema=json.dumps(schema, indent=2),
-            )
-
-        raw = _call_gemini(prompt)
-        raw_model_responses.append(raw)
-
-        parsed = extract_json_from_text(raw)
-        gen_sql = parsed.get("sql") if parsed else None
-        gen_notes = parsed.get("notes") if parsed else None
+    # If splitting didn't actually split (only 1 sub-request and similar to original),
+    # treat as simple: run nl_to_sql once and return its result (preserves format).
+    if len(sub_requests) == 1:
+        single_res = nl_to_sql(sub_requests[0], execute=execute, limit=limit, ctx=ctx,
+                               initial_sql=drafts[0].get("sql"), initial_notes=drafts[0].get("notes"))
+        single_res["_sub_request"] = sub_requests[0]
+        single_res["_sub_index"] = 1
+        single_res["is_complex"] = False
+        single_res["split_decision"] = split_decision
+        return single_res
 
-        if gen_sql:
-            checker_out = sql_db_query_checker(gen_sql)
-        else:
-            checker_out = {"valid": False, "message": "No SQL produced", "fixed_sql": None}
+    # sub-requests are independent by construction, so they run side by side;
+    # map() keeps part_results in sub-request order
+    workers = max(1, min(max_concurrency or COMPLEX_MAX_CONCURRENCY, len(sub_requests)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sub-request") as pool:
+        part_results = list(pool.map(
+            lambda item: _run_sub_request(item[0], item[1], execute, limit, ctx, drafts[item[0] - 1]),
+            enumerate(sub_requests, start=1),
+        ))
 
-        attempts_info.append({
-            "attempt": attempt,
-            "generated_sql": gen_sql,
-            "notes": gen_notes,
-            "checker": checker_out,
-        })
+    combined_info = _combine_tabular_results(part_results)
 
-        if isinstance(checker_out, dict) and checker_out.get("fixed_sql"):
-            candidate_sql = checker_out.get("fixed_sql")
-            candidate_notes = (gen_notes or "") + " | Applied checker-proposed fix."
-            last_checker = sql_db_query_checker(candidate_sql)
-            attempts_info[-1]["generated_sql"] = candidate_sql
-            attempts_info[-1]["checker"] = last_checker
-        else:
-            candidate_sql = gen_sql
-            candidate_notes = gen_notes
-            last_checker = checker_out
-
-        if isinstance(last_checker, dict) and last_checker.get("valid"):
-            validated_sql = last_checker.get("fixed_sql") or candidate_sql
-            return _finalize_result(
-                generated_sql=candidate_sql,
-                validated_sql=validated_sql,
-                notes=candidate_notes,
-                checker=last_checker,
-                raw_model_responses=raw_model_responses,
-                attempts_info=attempts_info,
-                execute=execute,
-                limit=limit,
-            )
-
-    final_checker = last_checker
     return {
-        "Error": "Failed to produce a valid SQL after 3 attempts.",
-        "attempts": attempts_info,
-        "raw_model_responses": raw_model_responses,
-        "last_checker": final_checker
+        "original_request": user_request,
+        "is_complex": True,
+        "sub_requests": sub_requests,
+        "split_decision": split_decision,
+        "split_generate": bool(planned),
+        "part_results": part_results,
+        "combined": combined_info,
     }
 
 
+async def ahandle_complex_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5,
+                                  max_concurrency: Optional[int] = None,
+                                  ctx: Optional[RequestContext] = None,
+                                  split_decision: Optional[Dict[str, Any]] = None,
+                                  combined: Optional[bool] = None) -> Dict[str, Any]:
+    async with arequest_scope(ctx) as ctx:
+        return await _ahandle_complex_request(user_request, execute, limit, max_parts, max_concurrency, ctx,
+                                              split_decision or _split_decision(user_request, max_parts),
+                                              COMBINED_SPLIT_GENERATE if combined is None else combined)
+
+
+async def _ahandle_complex_request(user_request: str, execute: bool, limit: int, max_parts: int,
+                                   max_concurrency: Optional[int], ctx: RequestContext,
+                                   split_decision: Dict[str, Any], combined: bool) -> Dict[str, Any]:
+    import asyncio
+
+    planned = None
+    if combined:
+        prompt = _split_generate_prompt(user_request, max_parts, ctx, split_decision)
+        reply = await _acall_gemini_json(prompt, SPLIT_GENERATE_SCHEMA, ctx=ctx, stage="generate")
+        planned = _parse_split_generate(reply, max_parts)
+    if planned:
+        drafts_sql = _draft_sqls(planned, ctx)
+        if drafts_sql:
+            _seed_validation_memo(ctx, drafts_sql, await asql_db_query_checker_batch(drafts_sql, ctx=ctx))
+        sub_requests = [p["sub_request"] for p in planned]
+    elif split_decision["decision"] == "uncertain":
+        sub_requests = await _asplit_request_with_llm(user_request, max_parts=max_parts, ctx=ctx)
+    else:
+        sub_requests = split_decision["parts"] or [user_request]
+    drafts = planned or [{} for _ in sub_requests]
 
-
-
-def is_complex_request(user_request: str, length_threshold: int = 350) -> bool:
-    if not user_request or not isinstance(user_request, str):
-        return False
-    if len(user_request) > length_threshold:
-        return True
-    low = user_request.lower()
-    strong_tokens = [";", " vs ", " compare ", " and also "]
-    weak_tokens = [" and ", " each ", " per "]
-    strong_hits = sum(1 for t in strong_tokens if t in low)
-    weak_hits = sum(1 for t in weak_tokens if t in low)
-    return strong_hits >= 1 or weak_hits >= 2
-
-
-def handle_complex_request(user_request: str, execute: bool = True, limit: int = 5, max_parts: int = 5) -> Dict[str, Any]:
-
-    sub_requests = _split_request_with_llm(user_request, max_parts=max_parts)
-
-    # If splitting didn't actually split (only 1 sub-request and similar to original),
-    # treat as simple: run nl_to_sql once and return its result (preserves format).
     if len(sub_requests) == 1:
-        single_res = nl_to_sql(sub_requests[0], execute=execute, limit=limit)
+        single_res = await anl_to_sql(sub_requests[0], execute=execute, limit=limit, ctx=ctx,
+                                      initial_sql=drafts[0].get("sql"), initial_notes=drafts[0].get("notes"))
         single_res["_sub_request"] = sub_requests[0]
         single_res["_sub_index"] = 1
         single_res["is_complex"] = False
+        single_res["split_decision"] = split_decision
         return single_res
 
-    part_results: List[Dict[str, Any]] = []
-    for i, sub in enumerate(sub_requests, start=1):
-        res = nl_to_sql(sub, execute=execute, limit=limit)
-        res["_sub_request"] = sub
-        res["_sub_index"] = i
-        part_results.append(res)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or COMPLEX_MAX_CONCURRENCY))
 
-    combined_info = _combine_tabular_results(part_results)
+    async def run_part(index: int, sub: str) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                res = await anl_to_sql(sub, execute=execute, limit=limit, ctx=ctx,
+                                       initial_sql=drafts[index - 1].get("sql"),
+                                       initial_notes=drafts[index - 1].get("notes"))
+            except Exception as e:
+                res = {"error": f"Sub-request failed: {e}"}
+            return _tag_sub_result(res, index, sub, started)
+
+    # gather() returns results in argument order, whatever order the parts finish in
+    part_results = list(await asyncio.gather(
+        *(run_part(i, sub) for i, sub in enumerate(sub_requests, start=1))
+    ))
+
+    combined_info = await run_in_db_pool(_combine_tabular_results, part_results)
 
     return {
         "original_request": user_request,
         "is_complex": True,
         "sub_requests": sub_requests,
+        "split_decision": split_decision,
+        "split_generate": bool(planned),
         "part_results": part_results,
         "combined": combined_info,
     }
 
 
 
+def _run_sub_request(index: int, sub: str, execute: bool, limit: int, ctx: RequestContext,
+                     draft: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # one failing part must not take the other parts down with it
+    started = time.perf_counter()
+    draft = draft or {}
+    try:
+        res = nl_to_sql(sub, execute=execute, limit=limit, ctx=ctx,
+                        initial_sql=draft.get("sql"), initial_notes=draft.get("notes"))
+    except Exception as e:
+        res = {"error": f"Sub-request failed: {e}"}
+    return _tag_sub_result(res, index, sub, started)
+
+
+def _tag_sub_result(res: Dict[str, Any], index: int, sub: str, started: float) -> Dict[str, Any]:
+    res["_sub_request"] = sub
+    res["_sub_index"] = index
+    res["_elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return res
+
+
 def _combine_tabular_results(part_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     try:
         import pandas as _pd
@@ -531,8 +849,104 @@ def _combine_tabular_results(part_results: List[Dict[str, Any]]) -> Dict[str, An
 
 
 
-def _split_request_with_llm(user_request: str, max_parts: int = 5) -> List[str]:
-    schema_mapping = _get_schema_mapping()
+def _split_and_generate(user_request: str, max_parts: int, ctx: RequestContext,
+                        split_decision: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    prompt = _split_generate_prompt(user_request, max_parts, ctx, split_decision)
+    # drafts SQL, so it runs on the generation model
+    return _parse_split_generate(_call_gemini_json(prompt, SPLIT_GENERATE_SCHEMA, ctx=ctx, stage="generate"),
+                                 max_parts)
+
+
+def _split_generate_prompt(user_request: str, max_parts: int, ctx: RequestContext,
+                           split_decision: Dict[str, Any]) -> str:
+    schema = _get_schema_mapping(user_request, ctx)
+    key_hints = ctx.snapshot.key_hints(list(schema))
+    parts_hint = ""
+    if split_decision.get("decision") == "split" and split_decision.get("parts"):
+        parts_hint = "\n    SUGGESTED SUB-REQUESTS (keep them unless they are clearly wrong):\n" + "\n".join(
+            f"    - {p}" for p in split_decision["parts"])
+
+    return f"""
+    You are an expert Microsoft SQL Server (T-SQL) assistant. Break the user request into at most {max_parts}
+    independent sub-requests (only when it really contains several separate tasks; otherwise keep exactly one)
+    and write ONE valid T-SQL query for each sub-request.
+
+    Strict rules:
+     - Use ONLY SQL Server syntax (T-SQL). Do NOT use LIMIT, backticks, "::type", ILIKE, USING joins or double-quoted identifiers.
+     - Use TOP (n) instead of LIMIT; GETDATE(), DATEADD(), FORMAT(...,'yyyy-MM'), EOMONTH(), YEAR(), MONTH() where needed.
+     - Use exact table/column names from the schema; take JOIN conditions from KEYS when they link the tables,
+       otherwise join on matching id columns from the schema.
+     - Each sub-request must be answerable on its own, by its own query. Read-only SELECT / WITH only.
+
+    SCHEMA (Table(columns)):
+{encode_schema(schema)}
+
+    KEYS (primary keys and declared foreign-key join conditions — prefer these for JOINs):
+    {key_hints}
+    {parts_hint}
+
+    USER REQUEST:
+    {user_request}
+
+    Return ONLY valid JSON (no surrounding text):
+    {{
+    "parts": [
+        {{"sub_request": "<self-contained sub-request>", "sql": "<T-SQL query only>", "notes": "<short assumptions>"}}
+    ]
+    }}
+    """
+
+
+def _draft_sqls(planned: List[Dict[str, Any]], ctx: RequestContext) -> List[str]:
+    # the drafts as each part's repair loop will see them (after the dialect rewrites)
+    return [rewrite_tsql(p["sql"], ctx.snapshot)[0] for p in planned if p.get("sql")]
+
+
+def _seed_validation_memo(ctx: RequestContext, sqls: List[str], verdicts: List[Dict[str, Any]]) -> None:
+    # all drafts were checked in one batch; each part's loop then starts from its verdict
+    for sql, verdict in zip(sqls, verdicts):
+        ctx.validation_memo[(sql, _VALIDATE)] = verdict
+
+
+def _parse_split_generate(reply: Dict[str, Any], max_parts: int) -> Optional[List[Dict[str, Any]]]:
+    # None when the response is unusable; the caller then falls back to split + per-part generation
+    parsed = reply["value"]
+    items = parsed.get("parts") if isinstance(parsed, dict) else parsed
+    if not isinstance(items, list):
+        return None
+    planned = []
+    for item in items[:max_parts]:
+        if not isinstance(item, dict):
+            continue
+        sub = str(item.get("sub_request") or "").strip()
+        if not sub:
+            continue
+        sql = item.get("sql")
+        planned.append({
+            "sub_request": sub,
+            "sql": sql.strip() if isinstance(sql, str) and sql.strip() else None,
+            "notes": item.get("notes"),
+        })
+    return planned or None
+
+
+def _split_request_with_llm(user_request: str, max_parts: int = 5, ctx: Optional[RequestContext] = None) -> List[str]:
+    prompt = _split_prompt(user_request, max_parts, ctx)
+    return _parse_split(_call_gemini_json(prompt, SPLIT_SCHEMA, ctx=ctx, stage="split"), user_request, max_parts)
+
+
+async def _asplit_request_with_llm(user_request: str, max_parts: int = 5,
+                                   ctx: Optional[RequestContext] = None) -> List[str]:
+    if ctx is None:
+        prompt = await run_in_db_pool(_split_prompt, user_request, max_parts)
+    else:
+        prompt = _split_prompt(user_request, max_parts, ctx)
+    return _parse_split(await _acall_gemini_json(prompt, SPLIT_SCHEMA, ctx=ctx, stage="split"),
+                        user_request, max_parts)
+
+
+def _split_prompt(user_request: str, max_parts: int, ctx: Optional[RequestContext] = None) -> str:
+    schema_mapping = _get_schema_mapping(user_request, ctx)
     split_prompt = f"""
     You are an advanced SQL task decomposition assistant. Your job is to break a complex natural-language
     request into a small number of simpler, independent sub-requests (maximum {max_parts}).***Strictly You must decide
@@ -598,16 +1012,18 @@ def _split_request_with_llm(user_request: str, max_parts: int = 5) -> List[str]:
     Wrong: ["Calculate revenue and list top customers."]
     Correct: ["Calculate revenue.", "List top customers."]
 
-    SCHEMA (for reference):
-    {json.dumps(schema_mapping, indent=2)}
+    SCHEMA (for reference, Table(columns)):
+{encode_schema(schema_mapping)}
 
     USER REQUEST:
     {user_request}
 
     """
+    return split_prompt
+
 
-    resp_text = _call_gemini(split_prompt)
-    parsed = extract_json_from_text(resp_text)
+def _parse_split(reply: Dict[str, Any], user_request: str, max_parts: int) -> List[str]:
+    parsed = reply["value"]
     if isinstance(parsed, list) and parsed:
         parts = [str(p).strip() for p in parsed if isinstance(p, (str, int, float))]
         parts = [p for p in parts if p]
@@ -616,6 +1032,7 @@ def _split_request_with_llm(user_request: str, max_parts: int = 5) -> List[str]:
         # If LLM returned only one part and it is effectively the original request, treat as no-split.
         if len(parts) == 1:
             return [user_request]
+        return parts[:max_parts]
 
     # fallback naive split on semicolons or newline or " and also "
     naive = [s.strip() for s in re.split(r'[;\n]', user_request) if s.strip()]
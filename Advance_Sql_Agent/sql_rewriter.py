@@ -0,0 +1,241 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from sql_tools import SchemaSnapshot
+
+# Deterministic MySQL/Postgres -> T-SQL fixes applied to generated SQL before it
+# is checked, so mechanical mistakes do not cost a Gemini repair round trip.
+SQL_AUTO_REWRITE = os.getenv("SQL_AUTO_REWRITE", "1") != "0"
+# collation used when ILIKE is turned into a case-insensitive LIKE
+ILIKE_COLLATION = os.getenv("ILIKE_COLLATION", "Latin1_General_CI_AS")
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = r"\x00\d+\x00"
+_IDENT = r"(?:\[[^\]]+\]|[A-Za-z_][\w$#@]*)"
+_QUALIFIED = rf"{_IDENT}(?:\.{_IDENT})*"
+
+# Postgres/MySQL type names that have a different spelling in T-SQL
+_TYPE_MAP = {
+    "text": "NVARCHAR(MAX)",
+    "varchar": "NVARCHAR(MAX)",
+    "string": "NVARCHAR(MAX)",
+    "integer": "INT",
+    "int4": "INT",
+    "int8": "BIGINT",
+    "bigint": "BIGINT",
+    "int": "INT",
+    "smallint": "SMALLINT",
+    "float": "FLOAT",
+    "float8": "FLOAT",
+    "real": "REAL",
+    "double": "FLOAT",
+    "boolean": "BIT",
+    "bool": "BIT",
+    "timestamp": "DATETIME2",
+    "timestamptz": "DATETIMEOFFSET",
+    "date": "DATE",
+    "time": "TIME",
+    "numeric": "NUMERIC",
+    "decimal": "DECIMAL",
+    "money": "MONEY",
+}
+
+# keywords that can follow a table without an alias; the alias group must not consume them
+_NOT_ALIAS = (
+    "on", "where", "join", "inner", "left", "right", "full", "cross", "outer", "group", "order",
+    "using", "union", "except", "intersect", "having", "with", "as",
+)
+_ALIAS = rf"(?!(?:{'|'.join(_NOT_ALIAS)})\b){_IDENT}"
+
+
+def _protect_literals(sql: str) -> Tuple[str, List[str]]:
+    literals: List[str] = []
+
+    def repl(m):
+        literals.append(m.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+    return _LITERAL.sub(repl, sql), literals
+
+
+def _restore_literals(sql: str, literals: List[str]) -> str:
+    return re.sub(_PLACEHOLDER, lambda m: literals[int(m.group(0).strip("\x00"))], sql)
+
+
+def _rewrite_identifiers(sql: str, applied: List[str]) -> str:
+    out, n = re.subn(r"`([^`]+)`", r"[\1]", sql)
+    if n:
+        applied.append(f"backtick identifiers -> [brackets] ({n})")
+    out, n = re.subn(r'"([^"]+)"', r"[\1]", out)
+    if n:
+        applied.append(f"double-quoted identifiers -> [brackets] ({n})")
+    return out
+
+
+def _rewrite_casts(sql: str, applied: List[str]) -> str:
+    operand = rf"({_PLACEHOLDER}|{_QUALIFIED}|\d+(?:\.\d+)?|\([^()]*\))"
+    pattern = re.compile(operand + r"\s*::\s*([A-Za-z_]\w*(?:\s+precision)?)(\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?", re.I)
+
+    def repl(m):
+        base = m.group(2).lower().split()[0]
+        size = (m.group(3) or "").strip()
+        t_sql_type = _TYPE_MAP.get(base, m.group(2).upper())
+        if size:
+            t_sql_type = t_sql_type.split("(")[0] + size
+        return f"CAST({m.group(1)} AS {t_sql_type})"
+
+    count = 0
+    while "::" in sql:
+        sql, n = pattern.subn(repl, sql)
+        if not n:
+            break
+        count += n
+    if count:
+        applied.append(f"'::type' casts -> CAST(... AS ...) ({count})")
+    return sql
+
+
+# one operand of ILIKE: a literal, a (qualified) column, a function call or a parenthesised
+# expression, optionally concatenated with more of the same
+_TERM = rf"(?:{_PLACEHOLDER}|{_QUALIFIED}(?:\s*\([^()]*\))?|\([^()]*\))"
+_OPERAND = rf"{_TERM}(?:\s*(?:\+|\|\|)\s*{_TERM})*"
+
+
+def _rewrite_ilike(sql: str, applied: List[str]) -> str:
+    # a lone literal pattern takes a case-insensitive collation; anything else (a column,
+    # a concatenation) is compared as LOWER(a) LIKE LOWER(b). An ILIKE whose operands
+    # cannot be read is left for the checker rather than made case-sensitive.
+    out, n1 = re.subn(rf"\bILIKE\s+({_PLACEHOLDER})(?!\s*(?:\+|\|\|))",
+                      rf"LIKE \1 COLLATE {ILIKE_COLLATION}", sql, flags=re.I)
+    out, n2 = re.subn(rf"(?<![\w$#@.\]\x00])({_OPERAND})(\s+NOT)?\s+ILIKE\s+(?!(?:ANY|ALL|SOME)\b)({_OPERAND})",
+                      r"LOWER(\1)\2 LIKE LOWER(\3)", out, flags=re.I)
+    if n1:
+        applied.append(f"ILIKE -> LIKE ... COLLATE {ILIKE_COLLATION} ({n1})")
+    if n2:
+        applied.append(f"ILIKE -> LOWER(...) LIKE LOWER(...) ({n2})")
+    return out
+
+
+def _table_refs(sql: str, end: int) -> List[Tuple[str, str]]:
+    # (table, name-to-qualify-with) for every FROM/JOIN source before `end`
+    refs = []
+    pattern = re.compile(rf"\b(?:FROM|JOIN)\s+({_QUALIFIED})(?:\s+(?:AS\s+)?({_ALIAS}))?", re.I)
+    for m in pattern.finditer(sql, 0, end):
+        refs.append((m.group(1), m.group(2) or m.group(1)))
+    return refs
+
+
+def _rewrite_using(sql: str, snapshot: Optional[SchemaSnapshot], applied: List[str]) -> str:
+    pattern = re.compile(r"\bUSING\s*\(([^()]+)\)", re.I)
+    while True:
+        m = pattern.search(sql)
+        if not m:
+            return sql
+        refs = _table_refs(sql, m.start())
+        if len(refs) < 2:
+            return sql
+        cols = [c.strip().strip("[]") for c in m.group(1).split(",") if c.strip()]
+        right_table, right = refs[-1]
+        left = refs[-2][1]
+        if snapshot is not None:
+            # prefer the closest earlier source that actually has every USING column
+            for table, name in reversed(refs[:-1]):
+                known = {c.lower() for c in snapshot.column_names(table.split(".")[-1].strip("[]"))}
+                if known and all(c.lower() in known for c in cols):
+                    left = name
+                    break
+        on = " AND ".join(f"{left}.{c} = {right}.{c}" for c in cols)
+        sql = sql[:m.start()] + f"ON {on}" + sql[m.end():]
+        applied.append(f"USING ({', '.join(cols)}) -> ON {on}")
+
+
+def _main_select(sql: str) -> Optional[re.Match]:
+    # first SELECT outside any parentheses (skips CTE bodies and subqueries)
+    depth = 0
+    for m in re.finditer(r"[()]|\bSELECT\b", sql, re.I):
+        tok = m.group(0)
+        if tok == "(":
+            depth += 1
+        elif tok == ")":
+            depth -= 1
+        elif depth == 0:
+            return m
+    return None
+
+
+def _has_top_level(sql: str, keyword: str) -> bool:
+    depth = 0
+    for m in re.finditer(rf"[()]|\b{keyword}\b", sql, re.I):
+        tok = m.group(0)
+        if tok == "(":
+            depth += 1
+        elif tok == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+def _rewrite_limits(sql: str, applied: List[str]) -> str:
+    # every SELECT scope, innermost first: subqueries and CTE bodies as well as the main
+    # query, so each scope's LIMIT sits at the end of its own text
+    stack: List[List[str]] = [[]]
+    for ch in sql:
+        if ch == "(":
+            stack.append([])
+        elif ch == ")" and len(stack) > 1:
+            inner = "".join(stack.pop())
+            if re.match(r"\s*(?:SELECT|WITH)\b", inner, re.I):
+                inner = _rewrite_limit(inner, applied)
+            stack[-1].append(f"({inner})")
+        else:
+            stack[-1].append(ch)
+    while len(stack) > 1:
+        # unbalanced parentheses: put the unclosed text back as it was
+        inner = "".join(stack.pop())
+        stack[-1].append(f"({inner}")
+    return _rewrite_limit("".join(stack[0]), applied)
+
+
+def _rewrite_limit(sql: str, applied: List[str]) -> str:
+    m = re.search(r"\s+LIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?\s*(;?)\s*$", sql, re.I)
+    if not m:
+        return sql
+    n, offset, semi = m.group(1), m.group(2), m.group(3)
+    body = sql[:m.start()]
+    if any(_has_top_level(body, kw) for kw in ("UNION", "INTERSECT", "EXCEPT")):
+        return sql
+
+    if offset:
+        if not _has_top_level(body, "ORDER"):
+            return sql
+        applied.append(f"LIMIT {n} OFFSET {offset} -> OFFSET {offset} ROWS FETCH NEXT {n} ROWS ONLY")
+        return f"{body} OFFSET {offset} ROWS FETCH NEXT {n} ROWS ONLY{semi}"
+
+    sel = _main_select(body)
+    if sel is None:
+        return sql
+    rest = body[sel.end():]
+    if re.match(r"\s+TOP\b", rest, re.I):
+        applied.append(f"LIMIT {n} dropped (query already uses TOP)")
+        return body + semi
+    mod = re.match(r"\s+(DISTINCT|ALL)\b", rest, re.I)
+    insert_at = sel.end() + (mod.end() if mod else 0)
+    applied.append(f"LIMIT {n} -> TOP ({n})")
+    return f"{body[:insert_at]} TOP ({n}){body[insert_at:]}{semi}"
+
+
+def rewrite_tsql(sql: str, snapshot: Optional[SchemaSnapshot] = None) -> Tuple[str, List[str]]:
+    # returns (rewritten_sql, list of applied rewrites); unchanged SQL yields []
+    applied: List[str] = []
+    if not SQL_AUTO_REWRITE or not sql or not isinstance(sql, str):
+        return sql, applied
+    code, literals = _protect_literals(sql)
+    code = _rewrite_identifiers(code, applied)
+    code = _rewrite_casts(code, applied)
+    code = _rewrite_ilike(code, applied)
+    code = _rewrite_using(code, snapshot, applied)
+    code = _rewrite_limits(code, applied)
+    if not applied:
+        return sql, applied
+    return _restore_literals(code, literals), applied
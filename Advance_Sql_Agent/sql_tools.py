@@ -1,52 +1,837 @@
 import os
 import json
 import re
+import time
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 load_dotenv()
-from sqlalchemy import inspect, text
-from sqlalchemy.engine import Engine
-import google.genai as genai
 
-from connect_db import get_engine
-ENGINE: Engine = get_engine()
+from connect_db import get_engine, SERVER, DATABASE, DATABASE_URL
+from llm_client import generate_json, agenerate_json
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+    from request_context import RequestContext
+
+# sqlalchemy and the engine are imported / created on first use (the Gemini client in
+# llm_client is equally lazy), so importing the agent (tests, `history`) stays cheap
+_ENGINE: Optional["Engine"] = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_shared_engine() -> "Engine":
+    global _ENGINE
+    if _ENGINE is None:
+        with _ENGINE_LOCK:
+            if _ENGINE is None:
+                _ENGINE = get_engine()
+    return _ENGINE
+
+
+# blocking DB work (pyodbc has no async driver) is offloaded to one bounded pool, so
+# the async pipeline never blocks the event loop and cannot exhaust the engine's pool
+DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", "8"))
+_DB_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _DB_EXECUTOR
+    if _DB_EXECUTOR is None:
+        with _ENGINE_LOCK:
+            if _DB_EXECUTOR is None:
+                _DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_THREAD_POOL_SIZE, thread_name_prefix="sql-db")
+    return _DB_EXECUTOR
+
+
+async def run_in_db_pool(fn, *args, **kwargs):
+    import asyncio
+    import functools
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(fn, *args, **kwargs))
+
+
+@contextmanager
+def _connect(ctx: Optional["RequestContext"] = None):
+    # a pooled connection for this call, counted against the request when there is one
+    if ctx is not None:
+        with ctx.connection() as conn:
+            yield conn
+    else:
+        with get_shared_engine().connect() as conn:
+            yield conn
+
+
+def __getattr__(name: str):
+    # keeps `from sql_tools import ENGINE` working without creating the engine at import time
+    if name == "ENGINE":
+        return get_shared_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", "300"))
+# directory for the persisted schema snapshot ("" disables it)
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", ".schema_cache")
+# 2: foreign keys carry their constraint, so composite and parallel keys stay apart
+SCHEMA_CACHE_FORMAT = 2
+# run the local sqlglot-based validator before asking the LLM checker
+SQL_LOCAL_VALIDATOR = os.getenv("SQL_LOCAL_VALIDATOR", "1") != "0"
+# validation backends tried in order by sql_db_query_checker: local parser, server binding, LLM
+SQL_CHECKER_BACKENDS = [
+    b.strip() for b in os.getenv("SQL_CHECKER_BACKENDS", "local,db,llm").split(",") if b.strip()
+]
+
+
+# Join graph – foreign keys as an undirected table graph with cached shortest paths
+class JoinGraph:
+    def __init__(self, foreign_keys: List[Dict[str, str]]):
+        # (table_a, table_b) -> one condition per FK constraint; the columns of a composite key are
+        # AND-ed, separate constraints (orders.billing_addr_id / orders.shipping_addr_id -> addresses)
+        # stay separate join options. A row without "constraint" is a single-column key of its own
+        columns: Dict[Tuple[str, str, str], List[str]] = {}
+        for i, fk in enumerate(foreign_keys):
+            a, b = fk["table"], fk["ref_table"]
+            if a == b:
+                continue
+            constraint = str(fk.get("constraint") or f"#{i}")
+            columns.setdefault((a, b, constraint), []).append(f"{a}.{fk['column']} = {b}.{fk['ref_column']}")
+        self._conditions: Dict[Tuple[str, str], List[str]] = {}
+        self._adj: Dict[str, List[str]] = {}
+        for (a, b, _), conds in columns.items():
+            cond = " AND ".join(conds)
+            self._conditions.setdefault((a, b), []).append(cond)
+            self._conditions.setdefault((b, a), []).append(cond)
+            for x, y in ((a, b), (b, a)):
+                if y not in self._adj.setdefault(x, []):
+                    self._adj[x].append(y)
+        self._paths: Dict[Tuple[str, str], Optional[List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def neighbours(self, table: str) -> List[str]:
+        return list(self._adj.get(table, []))
+
+    def conditions(self, a: str, b: str) -> List[str]:
+        # alternative join conditions between a and b, one per FK constraint
+        return list(self._conditions.get((a, b), []))
+
+    def condition(self, a: str, b: str) -> Optional[str]:
+        # prompt rendering: the only condition, or the alternatives to pick one from
+        conds = self._conditions.get((a, b))
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else "one of: " + " | ".join(conds)
+
+    def shortest_path(self, src: str, dst: str, max_hops: int = 4) -> Optional[List[str]]:
+        # list of tables from src to dst (inclusive), None when not connected within max_hops
+        key = (src, dst)
+        if key in self._paths:
+            return self._paths[key]
+        path = None
+        if src == dst:
+            path = [src]
+        elif src in self._adj and dst in self._adj:
+            prev: Dict[str, Optional[str]] = {src: None}
+            queue = deque([(src, 0)])
+            while queue:
+                node, depth = queue.popleft()
+                if node == dst:
+                    path = []
+                    while node is not None:
+                        path.append(node)
+                        node = prev[node]
+                    path.reverse()
+                    break
+                if depth >= max_hops:
+                    continue
+                for n in self._adj[node]:
+                    if n not in prev:
+                        prev[n] = node
+                        queue.append((n, depth + 1))
+        with self._lock:
+            self._paths[key] = path
+            self._paths[(dst, src)] = list(reversed(path)) if path else path
+        return path
+
+    def join_hints(self, tables: List[str], max_paths: int = 10) -> List[str]:
+        # direct FK conditions among `tables`, then multi-hop paths between pairs not directly linked
+        wanted = [t for t in tables if t in self._adj]
+        lines: List[str] = []
+        for i, a in enumerate(wanted):
+            for b in wanted[i + 1:]:
+                cond = self.condition(a, b)
+                if cond:
+                    lines.append(cond)
+        paths = 0
+        for i, a in enumerate(wanted):
+            for b in wanted[i + 1:]:
+                if paths >= max_paths:
+                    return lines
+                if self.condition(a, b):
+                    continue
+                path = self.shortest_path(a, b)
+                if path and len(path) > 2:
+                    steps = [self.condition(x, y) for x, y in zip(path, path[1:])]
+                    lines.append(f"{a} -> {b} via {' -> '.join(path[1:-1])}: " + " AND ".join(
+                        f"({s})" if s.startswith("one of: ") else s for s in steps))
+                    paths += 1
+        return lines
+
+
+# Schema snapshot – one catalog walk shared by every caller in the process
+class SchemaSnapshot:
+    def __init__(self,
+                 columns: Dict[str, List[Dict[str, Any]]],
+                 table_versions: Optional[Dict[str, str]] = None,
+                 loaded_at: Optional[float] = None,
+                 foreign_keys: Optional[List[Dict[str, str]]] = None,
+                 primary_keys: Optional[Dict[str, List[str]]] = None):
+        # table -> [{"name": ..., "type": ..., "nullable": ...}, ...]
+        self.columns = columns
+        # [{"table": ..., "column": ..., "ref_table": ..., "ref_column": ..., "constraint": ...}, ...]
+        self.foreign_keys = foreign_keys or []
+        # table -> [pk columns in key order]
+        self.primary_keys = primary_keys or {}
+        self._join_graph: Optional[JoinGraph] = None
+        # table -> catalog version marker (create/modify date); None when the dialect has none
+        self.table_versions = table_versions
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        self.refresh_info: Dict[str, Any] = {"mode": "full", "reloaded": len(columns), "dropped": 0}
+        payload = json.dumps([columns, self.foreign_keys, self.primary_keys], sort_keys=True, default=str)
+        self.version = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def has_table(self, table: str) -> bool:
+        return table in self.columns
+
+    def column_names(self, table: str) -> List[str]:
+        return [c["name"] for c in self.columns.get(table, [])]
+
+    def mapping(self, tables: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        if tables is None:
+            return {t: [c["name"] for c in cols] for t, cols in self.columns.items()}
+        return {t: [c["name"] for c in self.columns[t]] for t in tables if t in self.columns}
+
+    @property
+    def join_graph(self) -> JoinGraph:
+        if self._join_graph is None:
+            self._join_graph = JoinGraph(self.foreign_keys)
+        return self._join_graph
+
+    def neighbours(self, table: str) -> List[str]:
+        # tables one foreign key away, in either direction
+        return self.join_graph.neighbours(table)
+
+    def tables_in_sql(self, sql: str) -> List[str]:
+        # snapshot tables whose name appears as an identifier in the SQL text
+        idents = {w.lower() for w in re.findall(r"[A-Za-z_][\w$#@]*", sql or "")}
+        return [t for t in self.columns if t.lower() in idents]
+
+    def key_hints(self, tables: List[str]) -> str:
+        # compact prompt block: primary keys, then join conditions between the given tables
+        lines = [
+            f"{t}: PK({', '.join(self.primary_keys[t])})"
+            for t in tables if self.primary_keys.get(t)
+        ]
+        lines.extend(self.join_graph.join_hints(tables))
+        return "\n".join(lines) if lines else "(no declared keys)"
+
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    def is_stale(self, ttl: int = SCHEMA_CACHE_TTL) -> bool:
+        return ttl >= 0 and self.age() > ttl
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": SCHEMA_CACHE_FORMAT,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "columns": self.columns,
+            "table_versions": self.table_versions,
+            "foreign_keys": self.foreign_keys,
+            "primary_keys": self.primary_keys,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Optional["SchemaSnapshot"]:
+        if not isinstance(data, dict) or data.get("format") != SCHEMA_CACHE_FORMAT:
+            return None
+        snap = cls(
+            data["columns"],
+            table_versions=data.get("table_versions"),
+            loaded_at=data.get("loaded_at"),
+            foreign_keys=data.get("foreign_keys"),
+            primary_keys=data.get("primary_keys"),
+        )
+        # a hand-edited or truncated file must not masquerade as a valid snapshot
+        if snap.version != data.get("version"):
+            return None
+        snap.refresh_info = {"mode": "disk", "reloaded": 0, "dropped": 0}
+        return snap
+
+
+_SNAPSHOT: Optional[SchemaSnapshot] = None
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+# Bulk catalog loaders – one round trip for every column of every table
+_MSSQL_COLUMNS_SQL = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.CHARACTER_MAXIMUM_LENGTH,
+           c.NUMERIC_PRECISION, c.NUMERIC_SCALE, c.IS_NULLABLE
+    FROM INFORMATION_SCHEMA.COLUMNS c
+    JOIN INFORMATION_SCHEMA.TABLES t
+      ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    WHERE t.TABLE_TYPE = 'BASE TABLE' AND t.TABLE_SCHEMA = SCHEMA_NAME() {table_filter}
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+_SQLITE_COLUMNS_SQL = """
+    SELECT m.name, p.name, p.type, p."notnull"
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) p
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' {table_filter}
+    ORDER BY m.name, p.cid
+"""
+
+_MSSQL_FOREIGN_KEYS_SQL = """
+    SELECT tp.name, cp.name, tr.name, cr.name, fkc.constraint_object_id
+    FROM sys.foreign_key_columns fkc
+    JOIN sys.tables tp ON tp.object_id = fkc.parent_object_id
+    JOIN sys.columns cp ON cp.object_id = fkc.parent_object_id AND cp.column_id = fkc.parent_column_id
+    JOIN sys.tables tr ON tr.object_id = fkc.referenced_object_id
+    JOIN sys.columns cr ON cr.object_id = fkc.referenced_object_id AND cr.column_id = fkc.referenced_column_id
+    WHERE tp.schema_id = SCHEMA_ID() AND tr.schema_id = SCHEMA_ID()
+    ORDER BY fkc.constraint_object_id, fkc.constraint_column_id
+"""
+
+_SQLITE_FOREIGN_KEYS_SQL = """
+    SELECT m.name, f."from", f."table", f."to", m.name || ':' || f.id
+    FROM sqlite_master m
+    JOIN pragma_foreign_key_list(m.name) f
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+    ORDER BY m.name, f.id, f.seq
+"""
+
+_MSSQL_PRIMARY_KEYS_SQL = """
+    SELECT t.name, c.name
+    FROM sys.indexes i
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    JOIN sys.tables t ON t.object_id = i.object_id
+    WHERE i.is_primary_key = 1 AND t.schema_id = SCHEMA_ID()
+    ORDER BY t.name, ic.key_ordinal
+"""
+
+_SQLITE_PRIMARY_KEYS_SQL = """
+    SELECT m.name, p.name
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) p
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND p.pk > 0
+    ORDER BY m.name, p.pk
+"""
+
+_MSSQL_TABLE_VERSIONS_SQL = """
+    SELECT o.name, o.create_date, o.modify_date
+    FROM sys.objects o
+    WHERE o.type = 'U' AND o.schema_id = SCHEMA_ID()
+"""
+
+_SQLITE_TABLE_VERSIONS_SQL = """
+    SELECT name, sql
+    FROM sqlite_master
+    WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+"""
+
+
+def _mssql_type_name(data_type: str, char_len, precision, scale) -> str:
+    name = data_type.upper()
+    if name in ("CHAR", "VARCHAR", "NCHAR", "NVARCHAR", "BINARY", "VARBINARY"):
+        if char_len == -1:
+            return f"{name}(max)"
+        if char_len is not None:
+            return f"{name}({char_len})"
+    if name in ("DECIMAL", "NUMERIC") and precision is not None:
+        return f"{name}({precision}, {scale or 0})"
+    return name
+
+
+# SQL Server caps a statement at 2100 parameters; past this many changed tables (a restore,
+# bulk DDL) the whole catalog is read once and filtered here instead of one IN parameter each
+SCHEMA_IN_LIST_MAX = int(os.getenv("SCHEMA_IN_LIST_MAX", "500"))
+
+
+def _columns_query(sql_template: str, table_column: str, tables: Optional[List[str]]):
+    from sqlalchemy import bindparam, text
+
+    if tables is None:
+        return text(sql_template.format(table_filter="")), {}
+    query = text(sql_template.format(table_filter=f"AND {table_column} IN :tables"))
+    return query.bindparams(bindparam("tables", expanding=True)), {"tables": list(tables)}
+
+
+def _load_columns_bulk(engine: "Engine", tables: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    # tables=None loads the whole catalog, otherwise only the named tables
+    dialect = engine.dialect.name
+    columns: Dict[str, List[Dict[str, Any]]] = {}
+    if tables is not None and not tables:
+        return columns
+    if tables is not None and len(tables) > SCHEMA_IN_LIST_MAX and dialect in ("mssql", "sqlite"):
+        wanted = set(tables)
+        return {t: cols for t, cols in _load_columns_bulk(engine).items() if t in wanted}
+
+    if dialect == "mssql":
+        query, params = _columns_query(_MSSQL_COLUMNS_SQL, "c.TABLE_NAME", tables)
+        with engine.connect() as conn:
+            for table, col, data_type, char_len, precision, scale, nullable in conn.execute(query, params):
+                columns.setdefault(table, []).append({
+                    "name": col,
+                    "type": _mssql_type_name(data_type, char_len, precision, scale),
+                    "nullable": nullable == "YES",
+                })
+        return columns
+
+    if dialect == "sqlite":
+        query, params = _columns_query(_SQLITE_COLUMNS_SQL, "m.name", tables)
+        with engine.connect() as conn:
+            for table, col, col_type, notnull in conn.execute(query, params):
+                columns.setdefault(table, []).append({
+                    "name": col,
+                    "type": (col_type or "").upper(),
+                    "nullable": not notnull,
+                })
+        return columns
+
+    # any other dialect: per-table reflection
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    for table in (tables if tables is not None else inspector.get_table_names()):
+        columns[table] = [
+            {"name": c["name"], "type": str(c["type"]), "nullable": c["nullable"]}
+            for c in inspector.get_columns(table)
+        ]
+    return columns
+
+
+def _load_foreign_keys_bulk(engine: "Engine") -> List[Dict[str, str]]:
+    from sqlalchemy import inspect, text
+
+    dialect = engine.dialect.name
+    if dialect in ("mssql", "sqlite"):
+        sql = _MSSQL_FOREIGN_KEYS_SQL if dialect == "mssql" else _SQLITE_FOREIGN_KEYS_SQL
+        with engine.connect() as conn:
+            rows = conn.execute(text(sql)).fetchall()
+        return [
+            {"table": t, "column": c, "ref_table": rt, "ref_column": rc, "constraint": str(k)}
+            for t, c, rt, rc, k in rows
+        ]
+
+    inspector = inspect(engine)
+    out = []
+    for table in inspector.get_table_names():
+        for i, fk in enumerate(inspector.get_foreign_keys(table)):
+            constraint = f"{table}:{fk.get('name') or i}"
+            for c, rc in zip(fk["constrained_columns"], fk["referred_columns"]):
+                out.append({"table": table, "column": c, "ref_table": fk["referred_table"], "ref_column": rc,
+                            "constraint": constraint})
+    return out
+
+
+def _load_primary_keys_bulk(engine: "Engine") -> Dict[str, List[str]]:
+    from sqlalchemy import inspect, text
+
+    dialect = engine.dialect.name
+    out: Dict[str, List[str]] = {}
+    if dialect in ("mssql", "sqlite"):
+        sql = _MSSQL_PRIMARY_KEYS_SQL if dialect == "mssql" else _SQLITE_PRIMARY_KEYS_SQL
+        with engine.connect() as conn:
+            for table, col in conn.execute(text(sql)):
+                out.setdefault(table, []).append(col)
+        return out
+
+    inspector = inspect(engine)
+    for table in inspector.get_table_names():
+        cols = inspector.get_pk_constraint(table).get("constrained_columns") or []
+        if cols:
+            out[table] = list(cols)
+    return out
+
+
+def _load_table_versions(engine: "Engine") -> Optional[Dict[str, str]]:
+    # one cheap catalog query; None means the dialect cannot tell us what changed
+    from sqlalchemy import text
+
+    dialect = engine.dialect.name
+    if dialect == "mssql":
+        with engine.connect() as conn:
+            rows = conn.execute(text(_MSSQL_TABLE_VERSIONS_SQL)).fetchall()
+        return {name: f"{created.isoformat()}|{modified.isoformat()}" for name, created, modified in rows}
+    if dialect == "sqlite":
+        with engine.connect() as conn:
+            rows = conn.execute(text(_SQLITE_TABLE_VERSIONS_SQL)).fetchall()
+        return {name: hashlib.sha1((ddl or "").encode("utf-8")).hexdigest() for name, ddl in rows}
+    return None
+
+
+def _build_schema_snapshot() -> SchemaSnapshot:
+    # versions first, so DDL racing with the column load is picked up on the next refresh
+    engine = get_shared_engine()
+    versions = _load_table_versions(engine)
+    return SchemaSnapshot(
+        _load_columns_bulk(engine),
+        table_versions=versions,
+        foreign_keys=_load_foreign_keys_bulk(engine),
+        primary_keys=_load_primary_keys_bulk(engine),
+    )
+
+
+def _refresh_schema_snapshot(snap: SchemaSnapshot) -> SchemaSnapshot:
+    if snap.table_versions is None:
+        return _build_schema_snapshot()
+    engine = get_shared_engine()
+    versions = _load_table_versions(engine)
+    if versions is None:
+        return _build_schema_snapshot()
+
+    changed = [t for t, v in versions.items() if snap.table_versions.get(t) != v]
+    dropped = [t for t in snap.columns if t not in versions]
+
+    columns = {t: cols for t, cols in snap.columns.items() if t not in dropped}
+    columns.update(_load_columns_bulk(engine, changed))
+    columns = dict(sorted(columns.items()))
+    # keys live on both ends of a relationship, so reload them whenever anything moved
+    if changed or dropped:
+        foreign_keys = _load_foreign_keys_bulk(engine)
+        primary_keys = _load_primary_keys_bulk(engine)
+    else:
+        foreign_keys, primary_keys = snap.foreign_keys, snap.primary_keys
+
+    new_snap = SchemaSnapshot(columns, table_versions=versions,
+                              foreign_keys=foreign_keys, primary_keys=primary_keys)
+    new_snap.refresh_info = {"mode": "incremental", "reloaded": len(changed), "dropped": len(dropped)}
+    return new_snap
+
+
+# On-disk snapshot – one file per server+database so a cold start skips introspection
+def _snapshot_cache_path() -> Optional[str]:
+    if not SCHEMA_CACHE_DIR:
+        return None
+    target = DATABASE_URL or f"{SERVER}|{DATABASE}"
+    key = hashlib.sha1(target.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SCHEMA_CACHE_DIR, f"schema_{key}.json")
+
+
+def _load_snapshot_from_disk() -> Optional[SchemaSnapshot]:
+    path = _snapshot_cache_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return SchemaSnapshot.from_dict(json.load(f))
+    except Exception:
+        return None
+
+
+def _save_snapshot_to_disk(snap: SchemaSnapshot) -> None:
+    path = _snapshot_cache_path()
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap.to_dict(), f, separators=(",", ":"), default=str)
+        os.replace(tmp, path)
+    except OSError:
+        # the cache is an optimisation; never fail a question because of it
+        pass
+
+
+def _initial_schema_snapshot() -> SchemaSnapshot:
+    disk = _load_snapshot_from_disk()
+    if disk is None:
+        return _build_schema_snapshot()
+    if disk.table_versions is not None:
+        # validate against the catalog with the cheap version query, reloading only what changed
+        return _refresh_schema_snapshot(disk)
+    # no version markers for this dialect: trust the file until its TTL runs out
+    return disk if not disk.is_stale() else _build_schema_snapshot()
+
+
+def get_schema_snapshot(refresh: bool = False, full: bool = False) -> SchemaSnapshot:
+    global _SNAPSHOT
+    snap = _SNAPSHOT
+    if snap is not None and not refresh and not snap.is_stale():
+        return snap
+    with _SNAPSHOT_LOCK:
+        # another thread may have rebuilt it while we waited
+        if _SNAPSHOT is not None and _SNAPSHOT is not snap and not refresh:
+            return _SNAPSHOT
+        previous = _SNAPSHOT
+        if full:
+            _SNAPSHOT = _build_schema_snapshot()
+        elif _SNAPSHOT is None:
+            _SNAPSHOT = _initial_schema_snapshot()
+        else:
+            _SNAPSHOT = _refresh_schema_snapshot(_SNAPSHOT)
+        if previous is None or previous.version != _SNAPSHOT.version or _SNAPSHOT.refresh_info["mode"] == "full":
+            _save_snapshot_to_disk(_SNAPSHOT)
+        return _SNAPSHOT
+
+
+def refresh_schema_snapshot(full: bool = False) -> SchemaSnapshot:
+    # incremental by default: only tables whose catalog version changed are reloaded
+    return get_schema_snapshot(refresh=True, full=full)
+
 
 # TOOL 1 – List Tables
 def sql_db_list_tables():
-    inspector = inspect(ENGINE)
-    return {"tables": inspector.get_table_names()}
+    return {"tables": get_schema_snapshot().tables}
 
 
 # TOOL 2 – Table Schema
 def sql_db_schema(tables: str):
-    inspector = inspect(ENGINE)
-    all_tables = inspector.get_table_names()
+    snapshot = get_schema_snapshot()
     out = {}
 
     for table in [t.strip() for t in tables.split(",")]:
-        if table not in all_tables:
+        if not snapshot.has_table(table):
             out[table] = {"error": f"Table '{table}' not found."}
             continue
 
-        cols = inspector.get_columns(table)
-        out[table] = [
-            {"name": c["name"], "type": str(c["type"]), "nullable": c["nullable"]}
-            for c in cols
-        ]
+        out[table] = [dict(c) for c in snapshot.columns[table]]
+    return out
+
+
+# Server-side binding check – SQL Server compiles the query without running it
+_DESCRIBE_SQL = "EXEC sp_describe_first_result_set @tsql = :tsql"
+
+
+def _server_message(err: Exception) -> str:
+    # "[42S22] [Microsoft][ODBC Driver 17 for SQL Server][SQL Server]Invalid column name 'x'. (207) (SQLExecDirectW)"
+    raw = str(getattr(err, "orig", None) or err)
+    m = re.search(r"\[SQL Server\](.*?)(?:\s*\(\d+\))?\s*(?:\(SQL\w+\))?[\"')]*$", raw, re.S)
+    return (m.group(1) if m else raw.splitlines()[0]).strip()
+
+
+# SQL Server errors that say nothing about the query itself: missing permissions (or the
+# procedure itself missing), and statements sp_describe_first_result_set cannot analyse
+# (temp tables, dynamic SQL, EXEC, ...; 11502-11530)
+_DESCRIBE_UNDECIDED_ERRORS = {229, 230, 262, 297, 300, 916, 2812, *range(11502, 11531)}
+# "The batch could not be analyzed because of compile errors" - raised next to the real error
+_DESCRIBE_COMPILE_ERRORS = 11501
+
+
+def _server_error_numbers(err: Exception) -> List[int]:
+    # pymssql: args = (number, message); pyodbc: "...message. (207) (SQLExecDirectW)", one per error
+    orig = getattr(err, "orig", None) or err
+    args = getattr(orig, "args", ())
+    if args and isinstance(args[0], int):
+        return [args[0]]
+    return [int(n) for n in re.findall(r"\((\d+)\)\s*(?:\(SQL\w+\)|;|[\"')\]]*$)", str(orig))]
+
+
+def _describe_undecided(err: Exception) -> bool:
+    numbers = set(_server_error_numbers(err)) - {_DESCRIBE_COMPILE_ERRORS}
+    return bool(numbers) and numbers <= _DESCRIBE_UNDECIDED_ERRORS
+
+
+def sql_db_describe(sql: str, ctx: Optional["RequestContext"] = None) -> Dict[str, Any]:
+    from sqlalchemy.exc import DBAPIError, ProgrammingError
+
+    out: Dict[str, Any] = {"valid": None, "message": "", "fixed_sql": None, "source": "db"}
+    engine = get_shared_engine()
+    if engine.dialect.name != "mssql":
+        out["message"] = f"Server-side validation is not available for dialect '{engine.dialect.name}'."
+        return out
+    from sqlalchemy import text
+
+    statement = (sql or "").strip().rstrip(";")
+    try:
+        with _connect(ctx) as conn:
+            rows = conn.execute(text(_DESCRIBE_SQL), {"tsql": statement}).mappings().fetchall()
+    except ProgrammingError as e:
+        if _describe_undecided(e):
+            # no permission / a statement the procedure cannot analyse: not the query's fault
+            out["message"] = f"Server validation unavailable: {_server_message(e)}"
+            return out
+        # binding / syntax errors: exactly what the repair prompt needs to see
+        out.update(valid=False, message=_server_message(e))
+        return out
+    except DBAPIError as e:
+        # connectivity, timeouts, permissions on the proc - undecided, let the next backend try
+        out["message"] = f"Server validation unavailable: {_server_message(e)}"
+        return out
+
+    out.update(
+        valid=True,
+        message="Query compiles and binds on SQL Server.",
+        columns=[
+            {"name": r["name"], "type": r["system_type_name"], "nullable": bool(r["is_nullable"])}
+            for r in rows if not r.get("is_hidden")
+        ],
+    )
     return out
 
 
 # TOOL 3 – Query Checker
-def sql_db_query_checker(sql: str):
-    inspector = inspect(ENGINE)
-    client = genai.Client(api_key=GOOGLE_API_KEY)
+def sql_db_query_checker(sql: str, backends: Optional[List[str]] = None, ctx: Optional["RequestContext"] = None):
+    backends = SQL_CHECKER_BACKENDS if backends is None else backends
+    snapshot = ctx.snapshot if ctx is not None else get_schema_snapshot()
 
-    schema = {
-        t: [c["name"] for c in inspector.get_columns(t)]
-        for t in inspector.get_table_names()
-    }
+    # deterministic local check first: a definite "invalid" needs no further round trip
+    local = None
+    if "local" in backends and SQL_LOCAL_VALIDATOR:
+        from sql_validator import validate_tsql
+
+        local = validate_tsql(sql, snapshot)
+        if local["valid"] is False:
+            return local
+
+    # the server also catches what the local parser cannot (GROUP BY, type and function errors)
+    if "db" in backends:
+        described = sql_db_describe(sql, ctx)
+        if described["valid"] is not None:
+            return described
+
+    if local is not None and local["valid"]:
+        return local
+    if "llm" not in backends:
+        return {"valid": False, "message": "No validation backend could decide.", "fixed_sql": None, "source": "none"}
+    return _llm_query_checker(sql, snapshot, ctx)
+
+
+async def asql_db_query_checker(sql: str, backends: Optional[List[str]] = None, ctx: Optional["RequestContext"] = None):
+    backends = SQL_CHECKER_BACKENDS if backends is None else backends
+    # local parsing and the server round trip block, so they run in the DB pool;
+    # only the LLM fallback is awaited on the event loop
+    deterministic = [b for b in backends if b != "llm"]
+    out = await run_in_db_pool(sql_db_query_checker, sql, deterministic, ctx)
+    if out.get("source") != "none" or "llm" not in backends:
+        return out
+    snapshot = ctx.snapshot if ctx is not None else await run_in_db_pool(get_schema_snapshot)
+    return _parse_llm_checker(await _aask_json(_llm_checker_prompt(sql, snapshot), CHECKER_SCHEMA, ctx))
+
+
+def sql_db_query_checker_batch(sqls: List[str],
+                               backends: Optional[List[str]] = None,
+                               ctx: Optional["RequestContext"] = None) -> List[Dict[str, Any]]:
+    # one result per input (same shape as sql_db_query_checker). Deterministic backends run
+    # per query; everything they cannot decide shares ONE LLM prompt, so the schema block
+    # is paid once per batch instead of once per query
+    backends = SQL_CHECKER_BACKENDS if backends is None else backends
+    snapshot = ctx.snapshot if ctx is not None else get_schema_snapshot()
+    results, undecided = _check_batch_deterministic(sqls, backends, ctx)
+    if undecided:
+        if len(undecided) == 1:
+            verdicts = [_llm_query_checker(undecided[0], snapshot, ctx)]
+        else:
+            reply = _ask_json(_llm_batch_checker_prompt(undecided, snapshot), BATCH_CHECKER_SCHEMA, ctx)
+            verdicts = _parse_llm_batch_checker(reply, len(undecided))
+        results.update(zip(undecided, verdicts))
+    return [dict(results[sql]) for sql in sqls]
+
+
+async def asql_db_query_checker_batch(sqls: List[str],
+                                      backends: Optional[List[str]] = None,
+                                      ctx: Optional["RequestContext"] = None) -> List[Dict[str, Any]]:
+    backends = SQL_CHECKER_BACKENDS if backends is None else backends
+    results, undecided = await run_in_db_pool(_check_batch_deterministic, sqls, backends, ctx)
+    if undecided:
+        snapshot = ctx.snapshot if ctx is not None else await run_in_db_pool(get_schema_snapshot)
+        if len(undecided) == 1:
+            reply = await _aask_json(_llm_checker_prompt(undecided[0], snapshot), CHECKER_SCHEMA, ctx)
+            verdicts = [_parse_llm_checker(reply)]
+        else:
+            reply = await _aask_json(_llm_batch_checker_prompt(undecided, snapshot), BATCH_CHECKER_SCHEMA, ctx)
+            verdicts = _parse_llm_batch_checker(reply, len(undecided))
+        results.update(zip(undecided, verdicts))
+    return [dict(results[sql]) for sql in sqls]
+
+
+def _check_batch_deterministic(sqls: List[str], backends: List[str],
+                               ctx: Optional["RequestContext"] = None) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    # (sql -> decided result, [sqls left for the LLM]); duplicates are checked once
+    deterministic = [b for b in backends if b != "llm"]
+    results: Dict[str, Dict[str, Any]] = {}
+    undecided: List[str] = []
+    for sql in dict.fromkeys(sqls):
+        out = sql_db_query_checker(sql, deterministic, ctx)
+        if out.get("source") == "none" and "llm" in backends:
+            undecided.append(sql)
+        else:
+            results[sql] = out
+    return results, undecided
+
+
+# response schemas for the structured-output path (see llm_client.generate_json)
+CHECKER_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "valid": {"type": "BOOLEAN"},
+        "message": {"type": "STRING"},
+        "fixed_sql": {"type": "STRING", "nullable": True},
+    },
+    "required": ["valid", "message", "fixed_sql"],
+}
+BATCH_CHECKER_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "results": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"index": {"type": "INTEGER"}, **CHECKER_SCHEMA["properties"]},
+                "required": ["index", "valid", "message", "fixed_sql"],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+
+def _ask_json(prompt: str, schema: Dict[str, Any], ctx: Optional["RequestContext"] = None) -> Dict[str, Any]:
+    # checker prompts run on the "check" stage model (GEMINI_MODEL_CHECK, see llm_stages)
+    if ctx is None:
+        return generate_json(prompt, schema, stage="check")
+    ctx.count("llm_calls")
+    with ctx.timed("check"):
+        reply = generate_json(prompt, schema, client=ctx.get_client, stage="check", deadline=ctx.deadline)
+    return ctx.note_reply(reply)
+
+
+async def _aask_json(prompt: str, schema: Dict[str, Any], ctx: Optional["RequestContext"] = None) -> Dict[str, Any]:
+    if ctx is None:
+        return await agenerate_json(prompt, schema, stage="check")
+    ctx.count("llm_calls")
+    with ctx.timed("check"):
+        reply = await agenerate_json(prompt, schema, client=ctx.get_client, stage="check", deadline=ctx.deadline)
+    return ctx.note_reply(reply)
+
+
+def _llm_query_checker(sql: str, snapshot: SchemaSnapshot, ctx: Optional["RequestContext"] = None) -> Dict[str, Any]:
+    return _parse_llm_checker(_ask_json(_llm_checker_prompt(sql, snapshot), CHECKER_SCHEMA, ctx))
+
+
+def _checker_schema(sql: str, snapshot: SchemaSnapshot) -> str:
+    # the same compact Table(cols) rendering as the generation prompts, pruned to the query
+    from prompt_builder import encode_schema
+    from schema_index import prune_schema_for_sql
+
+    return encode_schema(prune_schema_for_sql(snapshot, sql))
+
+
+def _llm_checker_prompt(sql: str, snapshot: SchemaSnapshot) -> str:
+    key_hints = snapshot.key_hints(snapshot.tables_in_sql(sql))
 
     prompt = f"""
     You are a highly reliable SQL validation module designed specifically for **Microsoft SQL Server (T-SQL)** environments. 
@@ -74,7 +859,7 @@ def sql_db_query_checker(sql: str):
     2. **VALIDATION LOGIC**
         - Check if all table names exist in the schema.
         - Check if all column names exist in their respective tables.
-        - Check join conditions, where clauses, group by, order by, and functions for T-SQL compatibility.
+        - Check join conditions against the KEYS section (when KEYS declares none for the tables, a join on matching id columns is fine), where clauses, group by, order by, and functions for T-SQL compatibility.
         - Check for syntax issues or non-existent aliases.
         - If the SQL is correct according to the schema → mark valid = true.
         - If not → mark valid = false AND provide a corrected SQL version when possible.
@@ -85,7 +870,8 @@ def sql_db_query_checker(sql: str):
         - If the SQL is not fixable, set `"fixed_sql": null`.
 
     4. **ABOUT THE SCHEMA**
-        - The SCHEMA JSON lists tables and their columns.
+        - SCHEMA has one Table(col1,col2,...) line per table: the tables the query names plus
+          the closest matches for any name that does not exist.
         - Column types, nullable flags, etc., are not included unless needed for reasoning.
         - Use the exact names as shown — case sensitive & no guessing beyond closest match.
 
@@ -99,34 +885,90 @@ def sql_db_query_checker(sql: str):
           "fixed_sql": "<corrected SQL or null>"
             }}
     Here is the database schema (SQL Server):
-    SCHEMA:
-    {json.dumps(schema, indent=2)}
+    SCHEMA (Table(columns)):
+    {_checker_schema(sql, snapshot)}
+    KEYS (primary keys and declared foreign-key join conditions for the tables in the query):
+    {key_hints}
     Here is the SQL query to validate:
     QUERY:
     {sql}
     Now respond with ONLY the JSON described above. No extra text.
     """
+    return prompt
 
 
-    response = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt
-    )
+def _llm_batch_checker_prompt(sqls: List[str], snapshot: SchemaSnapshot) -> str:
+    tables: List[str] = []
+    for sql in sqls:
+        tables.extend(t for t in snapshot.tables_in_sql(sql) if t not in tables)
+    queries = "\n".join(f"    [{i}]\n    {sql}\n" for i, sql in enumerate(sqls, start=1))
+    schema = _checker_schema("\n".join(sqls), snapshot)
 
-    text_response = response.text
-    match = re.search(r"\{.*\}", text_response, re.S)
-    if not match:
-        return {"valid": False, "message": "Model returned no JSON.", "fixed_sql": None}
+    return f"""
+    You are a strict SQL validation module for **Microsoft SQL Server (T-SQL)**. Validate EACH of the
+    numbered queries below independently against the schema, exactly as SQL Server would.
 
-    return json.loads(match.group(0))
+    For every query check: table and column existence, aliases, JOIN conditions (see KEYS; without declared
+    keys, matching id columns are fine), GROUP BY /
+    ORDER BY validity, and T-SQL-only syntax (no LIMIT, backticks, USING joins, DATE('now'), strftime(),
+    "::type" casts, ILIKE, RETURNING or double-quoted identifiers). If a query is invalid, provide a
+    corrected T-SQL version when possible (closest correct schema names), otherwise null.
+
+    SCHEMA (Table(columns); the tables the queries name plus their closest matches):
+    {schema}
+    KEYS (primary keys and declared foreign-key join conditions for the tables in the queries):
+    {snapshot.key_hints(tables)}
+
+    QUERIES:
+{queries}
+    Respond with ONLY valid JSON, one entry per query, in the same order:
+    {{
+    "results": [
+        {{"index": 1, "valid": true/false, "message": "<very short explanation>", "fixed_sql": "<corrected SQL or null>"}}
+    ]
+    }}
+    """
+
+
+def _parse_llm_batch_checker(reply: Dict[str, Any], n: int) -> List[Dict[str, Any]]:
+    missing = {"valid": False, "message": "Model returned no verdict for this query.", "fixed_sql": None, "source": "llm"}
+    parsed = reply["value"]
+    items = parsed.get("results") if isinstance(parsed, dict) else parsed
+    verdicts: List[Dict[str, Any]] = [dict(missing) for _ in range(n)]
+    if not isinstance(items, list):
+        return verdicts
+    for pos, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index", pos + 1)
+        if isinstance(index, int) and 1 <= index <= n:
+            verdicts[index - 1] = {
+                "valid": bool(item.get("valid")),
+                "message": item.get("message", ""),
+                "fixed_sql": item.get("fixed_sql"),
+                "source": "llm",
+            }
+    return verdicts
+
+
+def _parse_llm_checker(reply: Dict[str, Any]) -> Dict[str, Any]:
+    # reply from generate_json: a typed object, or whatever could be scraped from plain text
+    out = reply["value"]
+    if not isinstance(out, dict):
+        return {"valid": False, "message": "Model returned no JSON.", "fixed_sql": None, "source": "llm"}
+    out.setdefault("source", "llm")
+    return out
 
 
 
 # TOOL 4 – Execute SQL
-def sql_db_query(sql: str, limit: int = 5):
+def sql_db_query(sql: str, limit: int = 5, ctx: Optional["RequestContext"] = None):
+    from sqlalchemy import text
+
     s = sql.lstrip()
     try:
-        if ENGINE.dialect.name == "mssql":
+        engine = get_shared_engine()
+        if engine.dialect.name == "mssql":
             if re.match(r'^\s*SELECT\s+TOP\b', s, re.IGNORECASE):
                 final_sql = sql
             else:
@@ -137,7 +979,7 @@ def sql_db_query(sql: str, limit: int = 5):
             else:
                 final_sql = f"{sql} LIMIT {limit}"
 
-        with ENGINE.connect() as conn:
+        with _connect(ctx) as conn:
             rows = conn.execute(text(final_sql)).fetchall()
             return {"rows": [dict(r._mapping) for r in rows], "sql_executed": final_sql}
 
@@ -145,6 +987,10 @@ def sql_db_query(sql: str, limit: int = 5):
         return {"error": str(e)}
 
 
+async def asql_db_query(sql: str, limit: int = 5, ctx: Optional["RequestContext"] = None):
+    return await run_in_db_pool(sql_db_query, sql, limit=limit, ctx=ctx)
+
+
 TOOL_DOCS = {
     "sql_db_list_tables": {
         "description": (
@@ -210,7 +1056,9 @@ TOOL_DOCS = {
             "  • 'valid'→ boolean indicating whether the query is valid "
             "  • 'message'→ short description of what is correct or incorrect "
             "  • 'fixed_sql' → corrected SQL query (string) when an automatic correction is possible, else null "
-            "This validation uses LLM reasoning combined with the real database schema."
+            "Tables, columns, aliases and non-T-SQL syntax are first checked locally against the cached schema, "
+            "then SQL Server binds the query via sp_describe_first_result_set (real server error messages); "
+            "LLM reasoning combined with the real database schema is used only when neither can decide."
         ),
         "parameters": {
             "query": (
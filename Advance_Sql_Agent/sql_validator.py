@@ -0,0 +1,174 @@
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from sql_tools import SchemaSnapshot
+
+# Local, deterministic first-line checker. Returns the same shape as
+# sql_db_query_checker plus "source": "local"; "valid": None means the
+# local checks cannot decide and the caller should fall back to the LLM.
+
+# (pattern, description) - matched against the SQL with string literals and comments blanked out
+_NON_TSQL_PATTERNS = [
+    (re.compile(r"\bLIMIT\b", re.I), "LIMIT (use TOP (n))"),
+    (re.compile(r"\bILIKE\b", re.I), "ILIKE (use LIKE)"),
+    (re.compile(r"`"), "backtick identifiers (use [brackets])"),
+    (re.compile(r"::"), "'::type' casts (use CAST(x AS type))"),
+    (re.compile(r"\bUSING\s*\(", re.I), "JOIN ... USING (use explicit ON)"),
+    (re.compile(r"\bRETURNING\b", re.I), "RETURNING clause"),
+    (re.compile(r'"'), "double-quoted identifiers (use [brackets])"),
+    (re.compile(r"\bSTRFTIME\s*\(", re.I), "strftime() (use FORMAT / DATEPART)"),
+    (re.compile(r"\bNOW\s*\(", re.I), "NOW() (use GETDATE())"),
+    (re.compile(r"\bINTERVAL\b", re.I), "INTERVAL arithmetic (use DATEADD)"),
+]
+
+_LITERAL_OR_COMMENT = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+
+
+def _blank_literals(sql: str) -> str:
+    # keep offsets stable, drop content that must not be pattern-matched
+    def repl(m):
+        text = m.group(0)
+        if text.startswith("'"):
+            return "'" + " " * (len(text) - 2) + "'"
+        return " " * len(text)
+    return _LITERAL_OR_COMMENT.sub(repl, sql)
+
+
+def find_non_tsql(sql: str) -> List[str]:
+    code = _blank_literals(sql)
+    found = [desc for pattern, desc in _NON_TSQL_PATTERNS if pattern.search(code)]
+    # the 'now' literal itself is blanked above, so this one is checked on the raw text
+    if re.search(r"\bDATE\s*\(\s*'now'\s*\)", sql, re.I):
+        found.append("DATE('now') (use GETDATE())")
+    return found
+
+
+def _result(valid: Optional[bool], message: str) -> Dict[str, Any]:
+    return {"valid": valid, "message": message, "fixed_sql": None, "source": "local"}
+
+
+def validate_tsql(sql: str, snapshot: SchemaSnapshot) -> Dict[str, Any]:
+    if not sql or not isinstance(sql, str) or not sql.strip():
+        return _result(False, "SQL is empty.")
+
+    non_tsql = find_non_tsql(sql)
+    if non_tsql:
+        return _result(False, "Non-T-SQL syntax: " + "; ".join(non_tsql) + ".")
+
+    try:
+        import sqlglot
+        from sqlglot import exp
+        from sqlglot.optimizer.scope import traverse_scope
+    except ImportError:
+        return _result(None, "sqlglot not installed; local validation skipped.")
+
+    # temp tables, variables and table-valued functions are outside what the snapshot knows
+    if "#" in sql or "@" in sql:
+        return _result(None, "Temp tables / variables present; deferring to the full checker.")
+
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="tsql") if s is not None]
+    except Exception as e:
+        return _result(None, f"Local parser could not parse the query: {e}")
+    if len(statements) != 1:
+        return _result(None, "Expected exactly one statement.")
+    tree = statements[0]
+    if not isinstance(tree, (exp.Select, exp.Union, exp.Intersect, exp.Except)) and not tree.find(exp.Select):
+        return _result(None, "Not a plain SELECT; deferring to the full checker.")
+
+    tables_ci = {t.lower(): t for t in snapshot.columns}
+    columns_ci: Dict[str, Set[str]] = {
+        t.lower(): {c["name"].lower() for c in cols} for t, cols in snapshot.columns.items()
+    }
+
+    try:
+        scopes = traverse_scope(tree)
+    except Exception as e:
+        return _result(None, f"Could not resolve query scopes: {e}")
+
+    problems: List[str] = []
+
+    def source_columns(source) -> Optional[Set[str]]:
+        # columns visible through a FROM source; None = unknown (e.g. SELECT * in a derived table)
+        if isinstance(source, exp.Table):
+            return columns_ci.get(source.name.lower())
+        names = getattr(source.expression, "named_selects", None)
+        if not names or "*" in names:
+            return None
+        return {n.lower() for n in names}
+
+    for scope in scopes:
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table):
+                db = (source.db or "").lower()
+                if source.catalog or db not in ("", "dbo"):
+                    return _result(None, f"Cross-schema reference {source.sql('tsql')}; deferring.")
+                if source.name.lower() not in tables_ci:
+                    problems.append(f"Unknown table '{source.name}'.")
+
+        select = scope.expression
+        # T-SQL lets ORDER BY (only) refer to select-list aliases
+        own_aliases = {
+            e.alias.lower() for e in getattr(select, "expressions", []) if isinstance(e, exp.Alias)
+        }
+
+        for col in scope.columns:
+            # sqlglot can list columns of nested subqueries here; those are checked in their own scope
+            if col.find_ancestor(exp.Select) is not select and isinstance(select, exp.Select):
+                continue
+            name = col.name.lower()
+            if not name or name == "*":
+                continue
+            qualifier = col.table
+            if qualifier:
+                # search this scope, then enclosing scopes (correlated subqueries)
+                s, source = scope, None
+                while s is not None and source is None:
+                    source = s.sources.get(qualifier) or next(
+                        (v for k, v in s.sources.items() if k.lower() == qualifier.lower()), None)
+                    s = s.parent
+                if source is None:
+                    problems.append(f"Unknown table alias '{qualifier}' for column '{col.name}'.")
+                    continue
+                cols = source_columns(source)
+                if cols is None:
+                    if isinstance(source, exp.Table):
+                        continue  # unknown table already reported
+                    return _result(None, f"Cannot resolve columns of '{qualifier}'; deferring.")
+                if name not in cols:
+                    problems.append(f"Column '{col.name}' not found in '{qualifier}'.")
+                continue
+
+            if name in own_aliases and col.find_ancestor(exp.Order) is not None:
+                continue
+            # SQL Server binds an unqualified name in the innermost scope that has it, and only
+            # if exactly one source there has it (Msg 209 otherwise)
+            s, matches, undecidable = scope, [], False
+            while s is not None and not matches:
+                for alias, source in s.sources.items():
+                    cols = source_columns(source)
+                    if cols is None:
+                        undecidable = undecidable or not isinstance(source, exp.Table)
+                    elif name in cols:
+                        matches.append(alias)
+                if not matches:
+                    s = s.parent
+            if len(matches) > 1:
+                problems.append(f"Ambiguous column name '{col.name}' (in {', '.join(matches)}).")
+            elif undecidable:
+                # a source with unknown columns may have (or also have) it
+                return _result(None, f"Cannot resolve column '{col.name}' locally; deferring.")
+            elif not matches:
+                problems.append(f"Column '{col.name}' not found in any referenced table.")
+
+    if problems:
+        # de-duplicate while keeping order
+        seen: List[str] = []
+        for p in problems:
+            if p not in seen:
+                seen.append(p)
+        return _result(False, " ".join(seen))
+    # names resolve, but grouping rules (Msg 8120) are not checked here
+    if tree.find(exp.Group, exp.Having, exp.AggFunc) is not None:
+        return _result(None, "Names resolve; GROUP BY / aggregates are not checked locally, deferring.")
+    return _result(True, "Tables, columns and aliases resolve against the schema; no non-T-SQL syntax found.")
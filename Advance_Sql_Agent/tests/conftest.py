@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the agent modules are flat and imported by name, as main.py / web_app.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# no on-disk LLM cache and no real Gemini client in tests
+os.environ["LLM_CACHE_PATH"] = ""
+os.environ.setdefault("GOOGLE_API_KEY", "test")
@@ -0,0 +1,25 @@
+import sql_tools
+from sql_tools import SchemaSnapshot
+
+# wide enough that pruning kicks in (more tables than SCHEMA_PRUNE_TOP_K)
+SNAPSHOT = SchemaSnapshot({
+    **{f"audit_log_{i}": [{"name": "entry_id", "type": "INT", "nullable": False},
+                          {"name": f"payload_{i}", "type": "NVARCHAR(MAX)", "nullable": True}]
+       for i in range(20)},
+    "customers": [{"name": "customer_id", "type": "INT", "nullable": False},
+                  {"name": "full_name", "type": "NVARCHAR(100)", "nullable": True}],
+})
+
+
+def test_checker_prompt_sends_the_pruned_compact_schema():
+    prompt = sql_tools._llm_checker_prompt("SELECT TOP (5) fullname FROM customers", SNAPSHOT)
+
+    assert "customers(customer_id,full_name)" in prompt
+    assert '"customers": [' not in prompt
+    assert prompt.count("payload_") <= 8
+
+
+def test_batch_checker_prompt_is_bounded_when_nothing_matches():
+    prompt = sql_tools._llm_batch_checker_prompt(["SELECT GETDATE()", "SELECT @@VERSION"], SNAPSHOT)
+
+    assert 0 < prompt.count("payload_") <= 8
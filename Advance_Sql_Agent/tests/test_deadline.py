@@ -0,0 +1,37 @@
+import time
+
+import sql_agent
+from fake_llm import FakeGeminiClient
+from llm_retry import deadline_after
+from request_context import RequestContext
+from sql_tools import SchemaSnapshot
+
+SNAPSHOT = SchemaSnapshot({
+    "customers": [{"name": "customer_id", "type": "INT", "nullable": False},
+                  {"name": "full_name", "type": "NVARCHAR(100)", "nullable": True}],
+})
+REJECTED = {"valid": False, "message": "Invalid column name 'fullname'.", "fixed_sql": None, "source": "sqlglot"}
+
+
+def _slow_checker(sql, backends=None, ctx=None):
+    # the first validation outlives the request's short deadline
+    time.sleep(0.1)
+    return dict(REJECTED)
+
+
+def test_deadline_returns_a_timeout_result_with_the_attempts_so_far(monkeypatch):
+    monkeypatch.setattr(sql_agent, "lookup_question", lambda *a, **k: None)
+    monkeypatch.setattr(sql_agent, "sql_db_query_checker", _slow_checker)
+    client = FakeGeminiClient(lambda prompt, schema: {"sql": "SELECT TOP (5) fullname FROM customers", "notes": None})
+    ctx = RequestContext(snapshot=SNAPSHOT, client=client)
+    ctx.deadline = deadline_after(50)
+
+    out = sql_agent.process_user_request("Show five customer names", execute=False, ctx=ctx)
+
+    assert out["timed_out"] is True
+    assert "Timed out" in out["Error"]
+    assert [a["generated_sql"] for a in out["attempts"]] == ["SELECT TOP (5) fullname FROM customers"]
+    assert out["attempts"][0]["checker"] == REJECTED
+    # the repair prompt was never sent
+    assert len(client.calls) == 1
+    assert "request_stats" in out
@@ -0,0 +1,35 @@
+from sql_tools import JoinGraph
+
+FKS = [
+    {"table": "orders", "column": "billing_addr_id", "ref_table": "addresses", "ref_column": "id", "constraint": "fk_bill"},
+    {"table": "orders", "column": "shipping_addr_id", "ref_table": "addresses", "ref_column": "id", "constraint": "fk_ship"},
+    {"table": "notes", "column": "order_id", "ref_table": "lines", "ref_column": "order_id", "constraint": "fk_line"},
+    {"table": "notes", "column": "line_no", "ref_table": "lines", "ref_column": "line_no", "constraint": "fk_line"},
+    {"table": "orders", "column": "customer_id", "ref_table": "customers", "ref_column": "id", "constraint": "fk_cust"},
+]
+
+
+def test_separate_constraints_are_alternative_joins():
+    graph = JoinGraph(FKS)
+    assert graph.conditions("orders", "addresses") == [
+        "orders.billing_addr_id = addresses.id",
+        "orders.shipping_addr_id = addresses.id",
+    ]
+    assert graph.condition("orders", "addresses") == (
+        "one of: orders.billing_addr_id = addresses.id | orders.shipping_addr_id = addresses.id")
+
+
+def test_composite_key_columns_are_one_condition():
+    graph = JoinGraph(FKS)
+    assert graph.conditions("notes", "lines") == ["notes.order_id = lines.order_id AND notes.line_no = lines.line_no"]
+
+
+def test_paths_keep_alternatives_apart():
+    hints = JoinGraph(FKS).join_hints(["customers", "addresses"])
+    assert hints == ["customers -> addresses via orders: orders.customer_id = customers.id AND "
+                     "(one of: orders.billing_addr_id = addresses.id | orders.shipping_addr_id = addresses.id)"]
+
+
+def test_rows_without_a_constraint_are_single_column_keys():
+    fks = [dict(fk, constraint=None) for fk in FKS[:2]]
+    assert len(JoinGraph(fks).conditions("addresses", "orders")) == 2
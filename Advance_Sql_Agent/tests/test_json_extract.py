@@ -0,0 +1,25 @@
+from json_extract import extract_json
+
+
+def test_braces_inside_strings_do_not_end_the_object():
+    text = 'Sure:\n{"sql": "SELECT \'{x}\' AS t WHERE a = \'}\'", "notes": "brace } here"}\nDone.'
+
+    assert extract_json(text, dict) == {"sql": "SELECT '{x}' AS t WHERE a = '}'", "notes": "brace } here"}
+
+
+def test_nested_objects_come_back_whole():
+    text = 'Result: {"plan": {"parts": [{"sql": "SELECT 1"}, {"sql": "SELECT 2"}]}, "ok": true}'
+
+    assert extract_json(text, dict) == {"plan": {"parts": [{"sql": "SELECT 1"}, {"sql": "SELECT 2"}]}, "ok": True}
+
+
+def test_truncated_output_keeps_the_complete_children():
+    text = '{"results": [{"index": 1, "valid": true}, {"index": 2, "valid": fal'
+
+    assert extract_json(text, list) is None
+    assert extract_json(text, dict) is None
+    assert extract_json('{"a": {"sql": "SELECT 1"}, "b": {"sql": "SEL', dict) == {"sql": "SELECT 1"}
+
+
+def test_prose_before_the_answer_is_skipped():
+    assert extract_json('Use {placeholder} then: ["a", "b"]', list) == ["a", "b"]
@@ -0,0 +1,28 @@
+from llm_cache import LLMCache, cache_key
+
+
+def test_put_then_get_round_trips(tmp_path):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"))
+
+    assert cache.get("gemini-flash", "prompt") is None
+    cache.put("gemini-flash", "prompt", '{"sql": "SELECT 1"}')
+
+    assert cache.get("gemini-flash", "prompt") == '{"sql": "SELECT 1"}'
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_key_depends_on_model_and_prompt(tmp_path):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"))
+    cache.put("gemini-flash", "prompt", "flash answer")
+
+    assert cache.get("gemini-pro", "prompt") is None
+    assert cache.get("gemini-flash", "prompt ") is None
+    assert cache_key("a", "bc") != cache_key("ab", "c")
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = LLMCache(str(tmp_path / "responses.sqlite"), ttl=0)
+    cache.put("m", "p", "old")
+    cache._conn.execute("UPDATE llm_cache SET created_at = created_at - 10")
+
+    assert cache.get("m", "p") is None
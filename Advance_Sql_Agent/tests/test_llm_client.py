@@ -0,0 +1,58 @@
+import pytest
+from google.genai import errors
+
+import llm_client
+import sql_agent
+from fake_llm import FakeGeminiClient
+
+
+def _client_error(message):
+    return errors.ClientError(400, {"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}})
+
+
+class _RejectingClient(FakeGeminiClient):
+    # refuses every structured call with `error`, answers plain-text calls normally
+    def __init__(self, error, responder):
+        super().__init__(responder)
+        self.error = error
+
+    def _reply(self, model, contents, config):
+        if (config or {}).get("response_schema") is not None:
+            raise self.error
+        return super()._reply(model, contents, config)
+
+
+def _answer(prompt, schema):
+    return {"sql": "SELECT 1", "notes": None}
+
+
+def test_schema_refusal_falls_back_to_plain_text():
+    error = _client_error('Invalid JSON payload received. Unknown name "responseSchema" at \'generation_config\'')
+    client = _RejectingClient(error, _answer)
+
+    out = llm_client.generate_json("q", sql_agent.GENERATION_SCHEMA, client=client, use_cache=False)
+
+    assert out["structured"] is False
+    assert out["value"] == {"sql": "SELECT 1", "notes": None}
+
+
+@pytest.mark.parametrize("error", [
+    _client_error("The input token count (1200000) exceeds the maximum number of tokens allowed (1048576)."),
+    TypeError("generate_content() got an unexpected keyword argument 'contnets'"),
+    ValueError("bad value"),
+])
+def test_other_errors_are_not_hidden_behind_a_text_retry(error):
+    client = _RejectingClient(error, _answer)
+
+    with pytest.raises(type(error)):
+        llm_client.generate_json("q", sql_agent.GENERATION_SCHEMA, client=client, use_cache=False)
+    assert client.calls == []
+
+
+def test_generation_schema_accepts_null_sql():
+    client = FakeGeminiClient(lambda prompt, schema: {"sql": None, "notes": "no such table"})
+
+    out = llm_client.generate_json("q", sql_agent.GENERATION_SCHEMA, client=client, use_cache=False)
+
+    assert out["structured"] is True
+    assert out["value"] == {"sql": None, "notes": "no such table"}
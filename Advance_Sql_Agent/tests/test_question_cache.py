@@ -0,0 +1,47 @@
+import pytest
+
+import question_cache
+from question_cache import lookup_question, normalize_question, store_question
+
+
+@pytest.mark.parametrize("a, b", [
+    ("orders shipped to Texas", "orders shipped from Texas"),
+    ("transfers to account 42", "transfers from account 42"),
+    ("customers who are active", "customers who were active"),
+    ("which order is late", "which order was late"),
+    ("products that are discontinued", "products that are not discontinued"),
+    ("all customers with orders", "customers with orders"),
+])
+def test_different_questions_get_different_keys(a, b):
+    assert normalize_question(a) != normalize_question(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Show the top 10 customers", "please show top 10 customers"),
+    ("List all orders.", "list ALL orders"),
+    ("Kindly list a product per category", "list products per category"),
+])
+def test_articles_politeness_case_and_plurals_share_a_key(a, b):
+    assert normalize_question(a) == normalize_question(b)
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(question_cache, "QUESTION_CACHE_FILE", str(tmp_path / "question_cache.json"))
+    monkeypatch.setattr(question_cache, "_CACHE", None)
+
+
+def test_lookup_never_serves_the_opposite_direction(cache_file):
+    store_question("orders shipped to Texas", "v1", "SELECT * FROM orders WHERE ship_to = 'TX'")
+
+    assert lookup_question("orders shipped from Texas", "v1") is None
+    assert lookup_question("Orders shipped to Texas", "v1")["validated_sql"].endswith("ship_to = 'TX'")
+
+
+def test_entries_from_the_old_normalization_are_dropped(cache_file):
+    key = normalize_question("orders shipped Texas")
+    question_cache._load()[key] = {"question": "orders shipped from Texas", "schema_version": "v1",
+                                   "validated_sql": "SELECT 1"}
+
+    assert lookup_question("orders shipped Texas", "v1") is None
+    assert key not in question_cache._load()
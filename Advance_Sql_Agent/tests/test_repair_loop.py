@@ -0,0 +1,72 @@
+import sql_agent
+from fake_llm import FakeGeminiClient
+from request_context import RequestContext
+from sql_tools import SchemaSnapshot
+
+SNAPSHOT = SchemaSnapshot({
+    "customers": [{"name": "customer_id", "type": "INT", "nullable": False},
+                  {"name": "full_name", "type": "NVARCHAR(100)", "nullable": True}],
+})
+BAD_SQL = "SELECT TOP (5) fullname FROM customers"
+FIXED_SQL = "SELECT TOP (5) full_name FROM customers"
+UNDECIDED = {"valid": False, "message": "No validation backend could decide.", "fixed_sql": None, "source": "none"}
+LLM_FIX = {"valid": False, "message": "Unknown column fullname.", "fixed_sql": FIXED_SQL, "source": "llm"}
+
+
+def _checker(calls):
+    # full chain: the LLM checker proposes a fix; deterministic-only: nobody can decide
+    def checker(sql, backends=None, ctx=None):
+        calls.append((sql, backends))
+        return dict(LLM_FIX) if backends is None else dict(UNDECIDED)
+    return checker
+
+
+def _loop(ctx):
+    return sql_agent._SqlRepairLoop(("generate", {"total_tokens": 0}),
+                                    lambda sql, msg: (f"repair: {msg}", {"total_tokens": 0}), ctx=ctx)
+
+
+def test_undecided_fix_check_trusts_the_checker_fix(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sql_agent, "sql_db_query_checker", _checker(calls))
+    client = FakeGeminiClient(lambda prompt, schema: {"sql": BAD_SQL, "notes": None})
+    ctx = RequestContext(snapshot=SNAPSHOT, client=client)
+
+    loop = sql_agent._run_repair_loop(_loop(ctx))
+
+    assert loop.state == "done"
+    assert loop.validated_sql == FIXED_SQL
+    assert loop.attempt == 1
+    assert len(client.calls) == 1
+    assert "trusted" in loop.last_checker["message"]
+    assert calls[-1] == (FIXED_SQL, sql_agent._deterministic_backends())
+
+
+def test_undecided_fix_never_reaches_the_repair_prompt(monkeypatch):
+    monkeypatch.setattr(sql_agent, "sql_db_query_checker", _checker([]))
+    client = FakeGeminiClient(lambda prompt, schema: {"sql": BAD_SQL, "notes": None})
+    ctx = RequestContext(snapshot=SNAPSHOT, client=client)
+
+    sql_agent._run_repair_loop(_loop(ctx))
+
+    assert not any("No validation backend could decide" in c["prompt"] for c in client.calls)
+
+
+def test_run_checked_query_keeps_an_undecided_fix(monkeypatch):
+    monkeypatch.setattr(sql_agent, "sql_db_query_checker", _checker([]))
+    ctx = RequestContext(snapshot=SNAPSHOT, client=FakeGeminiClient(lambda p, s: None))
+
+    out = sql_agent.run_checked_query(BAD_SQL, execute=False, ctx=ctx)
+
+    assert out["execution"]["sql_to_execute"] == FIXED_SQL
+
+
+def test_run_checked_query_counts_llm_calls_when_the_safety_check_fails(monkeypatch):
+    verdict = {"valid": True, "message": "ok", "fixed_sql": None, "source": "llm"}
+    monkeypatch.setattr(sql_agent, "sql_db_query_checker", lambda sql, backends=None, ctx=None: dict(verdict))
+    ctx = RequestContext(snapshot=SNAPSHOT, client=FakeGeminiClient(lambda p, s: None))
+
+    out = sql_agent.run_checked_query("SELECT * FROM customers", execute=False, ctx=ctx)
+
+    assert out["execution"]["reason"] == "SELECT * detected. Use explicit columns."
+    assert out["llm_calls"]["check"] == 1
@@ -0,0 +1,38 @@
+import threading
+
+from sqlalchemy import create_engine
+
+import request_context
+from request_context import RequestContext
+from sql_tools import SchemaSnapshot
+
+
+def test_concurrent_parts_use_separate_connections(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'parts.db'}")
+    monkeypatch.setattr(request_context, "get_shared_engine", lambda: engine)
+    ctx = RequestContext(snapshot=SchemaSnapshot({}), client=object())
+    # both parts must be inside a connection at the same time; a shared, locked
+    # connection would leave the second one waiting and break the barrier
+    both_inside = threading.Barrier(2, timeout=5)
+    seen, errors = [], []
+
+    def part():
+        try:
+            with ctx.connection() as conn:
+                seen.append(conn)
+                both_inside.wait()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=part) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert seen[0] is not seen[1]
+    stats = ctx.stats()
+    assert stats["db_round_trips"] == 2
+    assert stats["db_connections"] == 2
+    engine.dispose()
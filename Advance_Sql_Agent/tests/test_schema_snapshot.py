@@ -0,0 +1,116 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import sql_tools
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, full_name TEXT)"))
+        conn.execute(text("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, "
+                          "customer_id INTEGER REFERENCES customers(customer_id))"))
+        conn.execute(text("CREATE TABLE products (product_id INTEGER PRIMARY KEY, price REAL)"))
+    monkeypatch.setattr(sql_tools, "get_shared_engine", lambda: engine)
+    yield engine
+    engine.dispose()
+
+
+def _statements(engine):
+    seen = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *a: seen.append(statement))
+    return seen
+
+
+def test_many_changed_tables_are_read_without_an_in_list(engine, monkeypatch):
+    monkeypatch.setattr(sql_tools, "SCHEMA_IN_LIST_MAX", 1)
+    statements = _statements(engine)
+
+    columns = sql_tools._load_columns_bulk(engine, ["customers", "orders"])
+
+    assert sorted(columns) == ["customers", "orders"]
+    assert [c["name"] for c in columns["orders"]] == ["order_id", "customer_id"]
+    assert not any(" IN (" in s for s in statements)
+
+
+def test_few_changed_tables_use_the_filtered_query(engine):
+    statements = _statements(engine)
+
+    assert sorted(sql_tools._load_columns_bulk(engine, ["products"])) == ["products"]
+    assert any(" IN (" in s for s in statements)
+
+
+def _ddl(engine, *statements):
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+
+def test_refresh_reloads_only_the_changed_table(engine):
+    snap = sql_tools._build_schema_snapshot()
+    _ddl(engine, "ALTER TABLE products ADD COLUMN sku TEXT")
+
+    fresh = sql_tools._refresh_schema_snapshot(snap)
+
+    assert fresh.refresh_info == {"mode": "incremental", "reloaded": 1, "dropped": 0}
+    assert [c["name"] for c in fresh.columns["products"]] == ["product_id", "price", "sku"]
+    assert fresh.columns["customers"] is snap.columns["customers"]
+    assert fresh.version != snap.version
+
+
+def test_refresh_picks_up_added_and_dropped_tables(engine):
+    snap = sql_tools._build_schema_snapshot()
+    _ddl(engine, "CREATE TABLE suppliers (supplier_id INTEGER PRIMARY KEY, name TEXT)", "DROP TABLE products")
+
+    fresh = sql_tools._refresh_schema_snapshot(snap)
+
+    assert fresh.refresh_info == {"mode": "incremental", "reloaded": 1, "dropped": 1}
+    assert sorted(fresh.columns) == ["customers", "orders", "suppliers"]
+    assert fresh.primary_keys["suppliers"] == ["supplier_id"]
+
+
+def test_refresh_without_changes_keeps_the_version(engine):
+    snap = sql_tools._build_schema_snapshot()
+
+    fresh = sql_tools._refresh_schema_snapshot(snap)
+
+    assert fresh.refresh_info["reloaded"] == 0
+    assert fresh.version == snap.version
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_tools, "SCHEMA_CACHE_DIR", str(tmp_path / "schema_cache"))
+    monkeypatch.setattr(sql_tools, "_SNAPSHOT", None)
+    return tmp_path / "schema_cache"
+
+
+def test_stale_disk_snapshot_is_reloaded_from_the_catalog(engine, cache_dir):
+    sql_tools._save_snapshot_to_disk(sql_tools._build_schema_snapshot())
+    _ddl(engine, "ALTER TABLE customers ADD COLUMN email TEXT")
+
+    snap = sql_tools.get_schema_snapshot()
+
+    assert snap.refresh_info == {"mode": "incremental", "reloaded": 1, "dropped": 0}
+    assert "email" in snap.column_names("customers")
+    # the corrected snapshot replaces the stale file
+    assert "email" in sql_tools._load_snapshot_from_disk().column_names("customers")
+
+
+def test_current_disk_snapshot_is_used_as_is(engine, cache_dir):
+    saved = sql_tools._build_schema_snapshot()
+    sql_tools._save_snapshot_to_disk(saved)
+
+    snap = sql_tools.get_schema_snapshot()
+
+    assert snap.refresh_info["reloaded"] == 0
+    assert snap.version == saved.version
+
+
+def test_disk_snapshot_in_an_old_format_is_ignored(engine, cache_dir, monkeypatch):
+    sql_tools._save_snapshot_to_disk(sql_tools._build_schema_snapshot())
+    monkeypatch.setattr(sql_tools, "SCHEMA_CACHE_FORMAT", sql_tools.SCHEMA_CACHE_FORMAT + 1)
+
+    assert sql_tools._load_snapshot_from_disk() is None
+    assert sql_tools.get_schema_snapshot().refresh_info["mode"] == "full"
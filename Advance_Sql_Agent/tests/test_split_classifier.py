@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from benchmarks import _SPLIT_HELDOUT
+from split_classifier import classify, examples_from_history, is_complex_request
+
+
+@pytest.mark.parametrize("question", [
+    "List products with price above 100 and show the supplier name",
+    "Find orders over 500 dollars and list the customer email",
+    "Show stores in Mumbai and list their monthly revenue",
+])
+def test_a_clause_that_leans_on_another_is_never_split_locally(question):
+    assert classify(question, record=False)["decision"] != "split"
+
+
+def test_held_out_needs_no_more_split_calls_than_the_old_heuristic():
+    questions = [q for q, _ in _SPLIT_HELDOUT]
+    llm_calls = sum(1 for q in questions if classify(q, record=False)["decision"] == "uncertain")
+    legacy_calls = sum(1 for q in questions if is_complex_request(q))
+
+    assert llm_calls <= legacy_calls
+    assert classify("List products with price above 100 and show the supplier name",
+                    record=False)["decision"] == "no_split"
+
+
+def test_independent_tasks_still_split_locally():
+    out = classify("Count active users per day; list the 5 most viewed pages", record=False)
+    assert out["decision"] == "split"
+    assert out["parts"] == ["Count active users per day", "list the 5 most viewed pages"]
+
+
+def test_history_learns_only_from_labels_it_did_not_produce(tmp_path):
+    path = tmp_path / "query_history.json"
+    path.write_text(json.dumps([
+        {"question": "q local", "is_complex": True, "split_source": "local"},
+        {"question": "q legacy", "is_complex": True},
+        {"question": "q llm", "is_complex": True, "split_source": "llm"},
+        {"question": "q labelled", "is_complex": True, "split_source": "local", "split_label": False},
+    ]))
+    assert examples_from_history(str(path)) == [("q llm", True), ("q labelled", False)]
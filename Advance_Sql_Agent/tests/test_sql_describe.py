@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+import sql_tools
+
+
+def _odbc_error(*errors):
+    # pyodbc's message format, one "[SQL Server]<text> (<number>) (SQLExecDirectW)" per error
+    text = "; ".join(f"[42000] [Microsoft][ODBC Driver 17 for SQL Server][SQL Server]{msg} ({num}) (SQLExecDirectW)"
+                     for num, msg in errors)
+    return ProgrammingError("EXEC sp_describe_first_result_set", {}, Exception("42000", text))
+
+
+@pytest.fixture
+def describe_raises(monkeypatch):
+    def install(error):
+        @contextmanager
+        def connect(ctx=None):
+            raise error
+            yield
+
+        monkeypatch.setattr(sql_tools, "get_shared_engine", lambda: SimpleNamespace(dialect=SimpleNamespace(name="mssql")))
+        monkeypatch.setattr(sql_tools, "_connect", connect)
+    return install
+
+
+def test_binding_error_is_invalid(describe_raises):
+    describe_raises(_odbc_error((207, "Invalid column name 'fullname'."),
+                                (11501, "The batch could not be analyzed because of compile errors.")))
+
+    out = sql_tools.sql_db_describe("SELECT fullname FROM customers")
+
+    assert out["valid"] is False
+    assert "Invalid column name 'fullname'." in out["message"]
+
+
+@pytest.mark.parametrize("error", [
+    _odbc_error((229, "The EXECUTE permission was denied on the object 'sp_describe_first_result_set'.")),
+    _odbc_error((11525, "The metadata could not be determined because statement 'SELECT * FROM #t' uses a temp table.")),
+])
+def test_permission_and_unsupported_errors_are_undecided(describe_raises, error):
+    describe_raises(error)
+
+    out = sql_tools.sql_db_describe("SELECT * FROM #t")
+
+    assert out["valid"] is None
+    assert out["message"].startswith("Server validation unavailable")
@@ -0,0 +1,60 @@
+import pytest
+
+from sql_rewriter import rewrite_tsql
+from sql_tools import SchemaSnapshot
+from sql_validator import validate_tsql
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM c WHERE name ILIKE '%bob%'",
+     "SELECT * FROM c WHERE name LIKE '%bob%' COLLATE Latin1_General_CI_AS"),
+    ("SELECT * FROM c JOIN p ON p.name ILIKE c.name",
+     "SELECT * FROM c JOIN p ON LOWER(p.name) LIKE LOWER(c.name)"),
+    ("SELECT * FROM c WHERE c.name NOT ILIKE '%' + p.q + '%'",
+     "SELECT * FROM c WHERE LOWER(c.name) NOT LIKE LOWER('%' + p.q + '%')"),
+])
+def test_ilike_stays_case_insensitive(sql, expected):
+    assert rewrite_tsql(sql)[0] == expected
+
+
+def test_ilike_with_unreadable_operands_is_left_alone():
+    sql = "SELECT * FROM c WHERE a ILIKE ANY (ARRAY['x'])"
+    assert rewrite_tsql(sql) == (sql, [])
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM (SELECT id FROM t ORDER BY id LIMIT 3) s",
+     "SELECT * FROM (SELECT TOP (3) id FROM t ORDER BY id) s"),
+    ("WITH x AS (SELECT DISTINCT id FROM t LIMIT 10) SELECT * FROM x LIMIT 5;",
+     "WITH x AS (SELECT DISTINCT TOP (10) id FROM t) SELECT TOP (5) * FROM x;"),
+    ("SELECT * FROM t WHERE id IN (SELECT id FROM u ORDER BY d LIMIT 2 OFFSET 4)",
+     "SELECT * FROM t WHERE id IN (SELECT id FROM u ORDER BY d OFFSET 4 ROWS FETCH NEXT 2 ROWS ONLY)"),
+])
+def test_limit_is_rewritten_in_every_select(sql, expected):
+    assert rewrite_tsql(sql)[0] == expected
+
+
+SNAPSHOT = SchemaSnapshot({
+    "Orders": [{"name": "OrderID", "type": "INT", "nullable": False},
+               {"name": "CustomerID", "type": "INT", "nullable": False}],
+    "Customers": [{"name": "CustomerID", "type": "INT", "nullable": False},
+                  {"name": "Name", "type": "NVARCHAR(100)", "nullable": True}],
+    "Items": [{"name": "OrderID", "type": "INT", "nullable": False},
+              {"name": "Qty", "type": "INT", "nullable": False}],
+})
+
+
+def test_using_after_an_unaliased_table_is_rewritten():
+    sql, applied = rewrite_tsql("SELECT OrderID FROM Orders JOIN Customers USING (CustomerID)", SNAPSHOT)
+
+    assert sql == "SELECT OrderID FROM Orders JOIN Customers ON Orders.CustomerID = Customers.CustomerID"
+    assert applied
+    assert validate_tsql(sql, SNAPSHOT)["valid"] is not False
+
+
+def test_chained_using_joins_pick_the_source_that_has_the_columns():
+    sql, _ = rewrite_tsql("SELECT Qty FROM Orders JOIN Customers USING (CustomerID) "
+                          "LEFT JOIN Items USING (OrderID)", SNAPSHOT)
+
+    assert sql == ("SELECT Qty FROM Orders JOIN Customers ON Orders.CustomerID = Customers.CustomerID "
+                   "LEFT JOIN Items ON Orders.OrderID = Items.OrderID")
@@ -0,0 +1,44 @@
+import pytest
+
+from sql_tools import SchemaSnapshot
+from sql_validator import validate_tsql
+
+SNAPSHOT = SchemaSnapshot({
+    "Customers": [{"name": "CustomerID", "type": "INT", "nullable": False},
+                  {"name": "Name", "type": "NVARCHAR(100)", "nullable": True}],
+    "Orders": [{"name": "OrderID", "type": "INT", "nullable": False},
+               {"name": "CustomerID", "type": "INT", "nullable": False},
+               {"name": "Amount", "type": "MONEY", "nullable": True}],
+})
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT TOP (5) c.Name, o.Amount FROM Customers c JOIN Orders o ON c.CustomerID = o.CustomerID",
+    "SELECT Name FROM Customers c JOIN Orders o ON c.CustomerID = o.CustomerID",
+    "SELECT Name FROM Customers WHERE CustomerID IN (SELECT CustomerID FROM Orders WHERE Amount > 100)",
+])
+def test_valid_sql(sql):
+    assert validate_tsql(sql, SNAPSHOT)["valid"] is True
+
+
+def test_unknown_column_is_invalid():
+    out = validate_tsql("SELECT FullName FROM Customers", SNAPSHOT)
+
+    assert out["valid"] is False
+    assert "FullName" in out["message"]
+
+
+def test_column_in_two_sources_is_ambiguous():
+    out = validate_tsql("SELECT CustomerID FROM Customers c JOIN Orders o ON c.CustomerID = o.CustomerID", SNAPSHOT)
+
+    assert out["valid"] is False
+    assert "Ambiguous column name 'CustomerID'" in out["message"]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT c.Name, o.Amount, SUM(o.Amount) FROM Customers c JOIN Orders o ON c.CustomerID = o.CustomerID "
+    "GROUP BY c.Name",
+    "SELECT Name, COUNT(*) FROM Customers",
+])
+def test_grouping_is_left_undecided(sql):
+    assert validate_tsql(sql, SNAPSHOT)["valid"] is None
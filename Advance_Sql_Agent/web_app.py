@@ -5,20 +5,22 @@ from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse,
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-import pandas as pd
 import json
 import io
 import traceback
 from dotenv import load_dotenv
 import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 # load .env for the uvicorn process (must run in project root where .env resides)
 load_dotenv()
 
-# reuse your existing SQL agent and history utils
-from sql_agent import process_user_request, _call_gemini  # uses your agent pipeline
+# history utils are light; pandas, the SQL agent and the DB layer are imported
+# inside the handlers that need them, so worker startup does not pay for them
 from history_utils import load_history, add_history_entry, save_history
-from connect_db import get_engine  # for fallback raw SQL execution
 
 TEMPLATES_DIR = Path("templates")
 if not TEMPLATES_DIR.exists():
@@ -35,6 +37,8 @@ if Path("static").exists():
 LAST_DF = {"df": None, "sql": None, "question": None}
 
 def rows_to_df(rows):
+    import pandas as pd
+
     if rows is None:
         return pd.DataFrame()
     # list of dicts (preferred)
@@ -52,7 +56,7 @@ def rows_to_df(rows):
     except Exception:
         return pd.DataFrame()
 
-def choose_plot(df: pd.DataFrame, chart_type: str = None):
+def choose_plot(df: "pd.DataFrame", chart_type: str = None):
     if df is None or df.empty:
         return None
     from plotly.io import to_html
@@ -87,7 +91,29 @@ def choose_plot(df: pd.DataFrame, chart_type: str = None):
 @app.get("/_envcheck", response_class=PlainTextResponse)
 def envcheck():
     """Quick debug route to inspect whether the server sees the env vars."""
-    return f"GOOGLE_API_KEY present: {bool(os.getenv('GOOGLE_API_KEY'))}\nGEMINI_MODEL: {os.getenv('GEMINI_MODEL')}\n"
+    from llm_cache import get_llm_cache
+    from llm_client import GEMINI_STRUCTURED_OUTPUT, structured_stats
+    from llm_retry import LLM_HEDGE, retry_stats
+    from split_classifier import split_stats
+
+    cache = get_llm_cache()
+    cache_stats = cache.stats() if cache is not None else "disabled"
+    return (f"GOOGLE_API_KEY present: {bool(os.getenv('GOOGLE_API_KEY'))}\nGEMINI_MODEL: {os.getenv('GEMINI_MODEL')}\n"
+            f"LLM cache: {cache_stats}\nSplit classifier: {split_stats()}\n"
+            f"Structured output: {'on' if GEMINI_STRUCTURED_OUTPUT else 'off'} {structured_stats()}\n"
+            f"LLM retries (hedging {'on' if LLM_HEDGE else 'off'}): {retry_stats()}\n")
+
+@app.get("/_llm_stages")
+def llm_stage_stats(reset: bool = False):
+    """Per-stage Gemini model, SLO and latency (p50 / p95, breaches); ?reset=1 starts a new window."""
+    import llm_retry
+    from llm_stages import stage_stats, reset_stats
+
+    stats = stage_stats()
+    if reset:
+        reset_stats()
+        llm_retry.reset_stats()
+    return stats
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -106,11 +132,15 @@ async def index(request: Request):
 @app.post("/ask", response_class=HTMLResponse)
 async def ask(request: Request, question: str = Form(...), chart: str = Form(None)):
     global LAST_DF
+    # async pipeline: Gemini calls are awaited and DB work runs in a bounded thread pool,
+    # so one slow question does not stall the other requests on this worker
+    from sql_agent import aprocess_user_request, _acall_gemini
+
     history = load_history() or []
 
     try:
         # Use your SQL agent pipeline (NL -> SQL -> validate -> execute)
-        out = process_user_request(question, execute=True, limit=200)
+        out = await aprocess_user_request(question, execute=True, limit=200)
 
         # typical structure: out["execution"]["rows"]
         exec_info = out.get("execution", {}) if isinstance(out, dict) else {}
@@ -134,18 +164,19 @@ async def ask(request: Request, question: str = Form(...), chart: str = Form(Non
 
         # add to history with SQL info if available and persist
         add_history_entry(history, question, is_complex=bool(out.get("is_complex", False)),
-                          validated_sql=out.get("validated_sql"), generated_sql=out.get("generated_sql"))
+                          validated_sql=out.get("validated_sql"), generated_sql=out.get("generated_sql"),
+                          split_decision=out.get("split_decision"))
         save_history(history)
 
         hist_q = [h["question"] for h in history[-10:]] if history else []
 
-        # optional summary via agent's _call_gemini (best-effort; ignore errors)
+        # optional summary via agent's _acall_gemini (best-effort; ignore errors)
         summary = None
         try:
             if not df.empty:
                 head = df.head(10).to_string()
                 summary_prompt = f"Write a 2-3 sentence insight summary for this query result:\n{head}"
-                summary = _call_gemini(summary_prompt)
+                summary = await _acall_gemini(summary_prompt, stage="summarize")
         except Exception:
             summary = None
 
@@ -154,7 +185,8 @@ async def ask(request: Request, question: str = Form(...), chart: str = Form(Non
             "sql": LAST_DF["sql"],
             "table_html": table_html,
             "plot_div": plot_div,
-            "error": None,
+            # pipeline failures (repair loop gave up, request deadline ran out) come back as a result
+            "error": out.get("Error"),
             "history": hist_q,
             "question": question,
             "summary": summary
@@ -174,9 +206,12 @@ async def ask(request: Request, question: str = Form(...), chart: str = Form(Non
                         break
             if last_sql:
                 # execute last_sql directly using your DB connection
-                engine = get_engine()
+                import pandas as pd
+                from sql_tools import get_shared_engine, run_in_db_pool
+
+                engine = get_shared_engine()
                 # try to limit rows - if SQL has no TOP/LIMIT you may want to modify; here we execute as-is
-                df = pd.read_sql_query(last_sql, engine)
+                df = await run_in_db_pool(pd.read_sql_query, last_sql, engine)
                 LAST_DF["df"] = df
                 LAST_DF["sql"] = last_sql
                 LAST_DF["question"] = question